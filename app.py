@@ -4,14 +4,13 @@ Streamlit app for running Stedi Healthcare API requests
 """
 
 import streamlit as st
-import requests
 import json
 import time
-import inspect
-import ast
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
+    import stedi_client
+    import stedi_metrics
     import stedi_request
 except Exception as import_error:
     st.set_page_config(
@@ -53,98 +52,13 @@ REQUEST_DOC_PATHS = {
     22: "/docs/healthcare/api-reference/get-era-pdf",
 }
 
-# Initialize request functions
-for req_id in REQUESTS:
-    func_name = f"request_{req_id}"
-    REQUESTS[req_id]["func"] = getattr(stedi_request, func_name, None)
+DEFAULT_RUN_ALL_WORKERS = 8
 
-def extract_payload_from_function(func):
-    """Extract payload from a request function."""
-    if not func:
-        return None
-    
-    try:
-        source = inspect.getsource(func)
-        
-        # Find payload assignment
-        if 'payload = {' not in source:
-            return None
-        
-        # Extract the payload dictionary
-        lines = source.split('\n')
-        payload_start_idx = None
-        
-        for i, line in enumerate(lines):
-            if 'payload = {' in line:
-                payload_start_idx = i
-                break
-        
-        if payload_start_idx is None:
-            return None
-        
-        # Find the end of the payload dict by counting braces
-        payload_lines = []
-        brace_count = 0
-        in_payload = False
-        
-        for i in range(payload_start_idx, len(lines)):
-            line = lines[i]
-            if 'payload = {' in line:
-                in_payload = True
-                # Extract just the dict part
-                dict_start = line.find('{')
-                payload_lines.append(line[dict_start:])
-                brace_count = line[dict_start:].count('{') - line[dict_start:].count('}')
-            elif in_payload:
-                payload_lines.append(line)
-                brace_count += line.count('{') - line.count('}')
-                if brace_count == 0:
-                    break
-        
-        if not payload_lines:
-            return None
-        
-        # Reconstruct payload code
-        payload_code = '\n'.join(payload_lines)
-        
-        # Try to evaluate it safely
-        try:
-            # Create a minimal context
-            context = {
-                'BASE_URL': BASE_URL,
-                'get_api_key': get_api_key,
-                'get_usage_indicator': stedi_request.get_usage_indicator,
-            }
-            local_vars = {}
-            exec(f"payload = {payload_code}", context, local_vars)
-            return local_vars.get('payload')
-        except Exception as e:
-            # Fallback: try to parse as JSON-like structure
-            try:
-                # Replace Python None with null, True/False with true/false
-                json_str = payload_code.replace('None', 'null').replace('True', 'true').replace('False', 'false')
-                # Remove trailing comma issues
-                json_str = json_str.replace(',\n}', '\n}').replace(',\n]', '\n]')
-                return json.loads(json_str)
-            except:
-                return None
-    except Exception as e:
-        return None
-
-def execute_request_with_payload(req_id, payload, headers, url, method):
-    """Execute a request with custom payload."""
-    if method == "GET":
-        return requests.get(url, headers=headers)
-    elif method == "POST":
-        return requests.post(url, headers=headers, json=payload)
-    elif method == "PUT":
-        return requests.put(url, headers=headers, json=payload)
-    elif method == "PATCH":
-        return requests.patch(url, headers=headers, json=payload)
-    elif method == "DELETE":
-        return requests.delete(url, headers=headers)
-    else:
-        raise ValueError(f"Unsupported method: {method}")
+@st.cache_resource
+def prewarm_connections():
+    """Warm the shared connection pool once per server process."""
+    stedi_request.prewarm_connections(background=True)
+    return True
 
 def get_display_url(req_id):
     """Return the concrete sample URL shown and used by the UI."""
@@ -171,6 +85,107 @@ def get_docs_url(req_id):
         return stedi_request.get_request_docs_url(req_id)
     return f"{DOCS_BASE_URL}{REQUEST_DOC_PATHS[req_id]}"
 
+@st.cache_resource
+def get_request_templates(usage_indicator):
+    """Build the URLs and default payload text for every request once per server process.
+
+    Shared read-only by all sessions; the usage indicator is part of the key
+    because the X12 samples embed it. Sessions store only their edits.
+    """
+    templates = {}
+    for req_id in REQUESTS:
+        default_payload = stedi_request.get_default_payload(req_id)
+        templates[req_id] = {
+            "docs_url": get_docs_url(req_id),
+            "display_url": get_display_url(req_id),
+            "template_url": get_template_url(req_id),
+            "payload_json": None if default_payload is None else json.dumps(default_payload, indent=2),
+        }
+    return templates
+
+def apply_payload_edit(req_id, default_json):
+    """Keep a session's payload edit, or drop it once the text matches the default again."""
+    payload_key = f"payload_{req_id}"
+    edited_json = st.session_state[f"payload_text_{req_id}"]
+    st.session_state.payload_errors.pop(payload_key, None)
+    if edited_json == default_json:
+        st.session_state.edited_payloads.pop(payload_key, None)
+        return
+    try:
+        st.session_state.edited_payloads[payload_key] = json.loads(edited_json)
+    except json.JSONDecodeError as e:
+        # Keep the previous valid payload
+        st.session_state.payload_errors[payload_key] = str(e)
+
+def run_for_summary(req_id, payload):
+    """Run one request of a Run All sweep. Called from worker threads, so it does not touch st.*."""
+    start_time = time.time()
+    try:
+        response = stedi_request.execute_request(req_id, payload=payload)
+    except Exception as e:
+        return {
+            "id": req_id,
+            "status": "error",
+            "message": str(e),
+            "status_code": None,
+            "elapsed_time": time.time() - start_time
+        }, None
+    elapsed_time = time.time() - start_time
+    
+    try:
+        body = response.json()
+        body_type = "json"
+    except:
+        body = response.text[:500]  # Truncate long text
+        body_type = "text"
+    
+    timings = getattr(response, "timings", None)
+    result = {
+        "id": req_id,
+        "status": "success" if 200 <= response.status_code < 300 else "error",
+        "status_code": response.status_code,
+        "elapsed_time": elapsed_time,
+        "timings": timings,
+        "body_preview": body if body_type == "json" else body[:200],
+        "body_type": body_type
+    }
+    full_result = {
+        "status_code": response.status_code,
+        "headers": dict(response.headers),
+        "elapsed_time": elapsed_time,
+        "timings": timings,
+        "body": body if body_type == "json" else response.text,
+        "body_type": body_type,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    return result, full_result
+
+def timing_columns(timings):
+    """Split a response's stedi_metrics breakdown into our network, Stedi/payer time and download."""
+    if not timings:
+        return {"Connect (s)": None, "TTFB (s)": None, "Download (s)": None, "Bytes": None}
+    return {
+        "Connect (s)": round(timings["dns"] + timings["connect"] + timings["tls"], 3),
+        "TTFB (s)": round(timings["ttfb"], 3),
+        "Download (s)": round(timings["download"], 3),
+        "Bytes": timings["bytes"],
+    }
+
+def summary_rows(results_summary):
+    """Rows for the live Run All table, in request order."""
+    return [
+        {
+            "ID": result["id"],
+            "Method": REQUESTS[result["id"]]["method"],
+            "Path": REQUESTS[result["id"]]["path"],
+            "Status": "✅" if result["status"] == "success" else "❌",
+            "Status Code": result.get("status_code"),
+            "Time (s)": round(result.get("elapsed_time", 0), 2),
+            **timing_columns(result.get("timings")),
+        }
+        for result in sorted(results_summary, key=lambda r: r["id"])
+    ]
+
 # Page configuration
 st.set_page_config(
     page_title="Stedi Healthcare API Request Runner",
@@ -178,11 +193,16 @@ st.set_page_config(
     layout="wide"
 )
 
+prewarm_connections()
+
 # Initialize session state
 if 'request_results' not in st.session_state:
     st.session_state.request_results = {}
+# Only payloads a user has changed; unedited requests use the shared defaults.
 if 'edited_payloads' not in st.session_state:
     st.session_state.edited_payloads = {}
+if 'payload_errors' not in st.session_state:
+    st.session_state.payload_errors = {}
 
 # Title
 st.title("🏥 Stedi Healthcare API Request Runner")
@@ -204,6 +224,14 @@ with st.sidebar:
         ["Single Request", "All Requests"],
         help="Choose to run a single request or all requests at once"
     )
+    run_all_workers = st.slider(
+        "Concurrent Requests",
+        min_value=1,
+        max_value=len(REQUESTS),
+        value=min(DEFAULT_RUN_ALL_WORKERS, len(REQUESTS)),
+        disabled=run_mode != "All Requests",
+        help="How many requests Run All sends at the same time"
+    )
     
     st.markdown("---")
     
@@ -216,6 +244,15 @@ with st.sidebar:
     )
     usage_value = "T" if "Test" in usage_label else "P"
     stedi_request.set_usage_indicator(usage_value)
+    
+    st.markdown("---")
+    st.download_button(
+        "📈 Download Latency Metrics",
+        data=stedi_metrics.metrics.render(),
+        file_name="stedi_metrics.txt",
+        mime="application/openmetrics-text",
+        help="Per-request phase histograms for this server process, in OpenMetrics format"
+    )
 
 # Main content area
 if run_mode == "Single Request":
@@ -235,6 +272,7 @@ if run_mode == "Single Request":
     
     selected_id = request_options[selected_request]
     req_info = REQUESTS[selected_id]
+    template = get_request_templates(stedi_request.get_usage_indicator())[selected_id]
     
     # Show request details
     with st.expander("📄 Request Details", expanded=True):
@@ -244,50 +282,40 @@ if run_mode == "Single Request":
             st.write(f"**Path:** {req_info['path']}")
         with col2:
             st.write(f"**ID:** {selected_id}")
-            st.write(f"**Docs URL:** {get_docs_url(selected_id)}")
-            st.write(f"**API Request URL:** {get_display_url(selected_id)}")
+            st.write(f"**Docs URL:** {template['docs_url']}")
+            st.write(f"**API Request URL:** {template['display_url']}")
             if req_info.get("path_params"):
-                st.write(f"**Template URL:** {get_template_url(selected_id)}")
+                st.write(f"**Template URL:** {template['template_url']}")
         
         if req_info.get('description'):
             st.write(f"**Description:** {req_info['description']}")
         
-        # Extract and display payload
-        func = req_info['func']
-        default_payload = None
-        
-        if func and req_info['method'] in ['POST', 'PUT', 'PATCH']:
-            # Try to extract payload from function
-            default_payload = extract_payload_from_function(func)
-        
-        # Initialize edited payload in session state if not exists
-        payload_key = f"payload_{selected_id}"
-        if payload_key not in st.session_state.edited_payloads:
-            st.session_state.edited_payloads[payload_key] = default_payload
-        
         # Display editable payload
-        if default_payload is not None:
+        if template["payload_json"] is not None:
             st.markdown("---")
             st.subheader("📝 Request Payload (Editable)")
             
+            payload_key = f"payload_{selected_id}"
+            edited_payload = st.session_state.edited_payloads.get(payload_key)
+            if f"payload_text_{selected_id}" not in st.session_state:
+                # The editor was reset to the last valid payload, so an old parse error no longer applies.
+                st.session_state.payload_errors.pop(payload_key, None)
             # Use text area for editing (more reliable than json_editor)
-            payload_json = json.dumps(st.session_state.edited_payloads[payload_key], indent=2)
-            edited_json = st.text_area(
+            st.text_area(
                 "Edit Payload (JSON):",
-                value=payload_json,
+                value=template["payload_json"] if edited_payload is None else json.dumps(edited_payload, indent=2),
                 height=300,
                 key=f"payload_text_{selected_id}",
+                on_change=apply_payload_edit,
+                args=(selected_id, template["payload_json"]),
                 help="Modify the JSON payload below. Changes will be used when you click 'Run Request'."
             )
-            try:
-                parsed_payload = json.loads(edited_json)
-                st.session_state.edited_payloads[payload_key] = parsed_payload
+            if payload_key in st.session_state.payload_errors:
+                st.error(f"Invalid JSON format: {st.session_state.payload_errors[payload_key]}")
+            elif edited_payload is not None:
+                st.success("✓ Valid JSON (edited)")
+            else:
                 st.success("✓ Valid JSON")
-            except json.JSONDecodeError as e:
-                st.error(f"Invalid JSON format: {str(e)}")
-                # Keep the previous valid payload
-                if st.session_state.edited_payloads[payload_key] is None:
-                    st.session_state.edited_payloads[payload_key] = default_payload
     
     # Run button
     col1, col2, col3 = st.columns([1, 1, 4])
@@ -304,108 +332,33 @@ if run_mode == "Single Request":
     if run_button:
         with st.spinner(f"Running request {selected_id}..."):
             try:
-                func = req_info['func']
-                if not func:
-                    st.error(f"Request function {selected_id} not found!")
-                else:
-                    # Get URL and headers from function
-                    source = inspect.getsource(func)
-                    url = get_display_url(selected_id)
-                    headers = {
-                        "Authorization": get_api_key(),
-                        "Content-Type": "application/json"
-                    }
-                    
-                    # Try to extract actual URL from function (handles path parameters)
-                    try:
-                        # Look for URL assignment in function source
-                        for line in source.split('\n'):
-                            if 'url = f"' in line:
-                                # Extract f-string and evaluate it
-                                # Find the f-string content
-                                start_idx = line.find('f"') + 2
-                                end_idx = line.rfind('"')
-                                if end_idx > start_idx:
-                                    url_template = line[start_idx:end_idx]
-                                    # Replace {BASE_URL} with actual BASE_URL
-                                    url_template = url_template.replace('{BASE_URL}', BASE_URL)
-                                    
-                                    # Extract any variables from the f-string
-                                    # Look for variable references like {variable_name}
-                                    var_pattern = r'\{(\w+)\}'
-                                    variables = re.findall(var_pattern, url_template)
-                                    
-                                    # Try to get variable values from function source
-                                    for var_name in variables:
-                                        if var_name == 'BASE_URL':
-                                            continue
-                                        # Look for variable assignment
-                                        for func_line in source.split('\n'):
-                                            if f'{var_name} = ' in func_line:
-                                                try:
-                                                    var_value = func_line.split('=')[1].strip().strip('"').strip("'")
-                                                    url_template = url_template.replace(f'{{{var_name}}}', var_value)
-                                                except:
-                                                    pass
-                                    
-                                    url = url_template
-                                    break
-                            elif 'url = "' in line and BASE_URL in line:
-                                # Simple string URL
-                                url_match = re.search(r'url = "([^"]+)"', line)
-                                if url_match:
-                                    url = url_match.group(1).replace('{BASE_URL}', BASE_URL)
-                                    break
-                    except Exception as e:
-                        # Fallback to default URL construction
-                        pass
-                    
-                    # Get edited payload or use default
-                    payload_key = f"payload_{selected_id}"
-                    payload = st.session_state.edited_payloads.get(payload_key)
-                    
-                    # If no edited payload, try to extract from function
-                    if payload is None:
-                        payload = extract_payload_from_function(func)
-                    
-                    start_time = time.time()
-                    
-                    # Execute request with payload. If the payload extractor cannot
-                    # evaluate a generated payload, use the curated function.
-                    if req_info['method'] == 'GET' or payload is None:
-                        response = func()
-                    elif req_info['method'] == 'POST':
-                        response = requests.post(url, headers=headers, json=payload)
-                    elif req_info['method'] == 'PUT':
-                        response = requests.put(url, headers=headers, json=payload)
-                    elif req_info['method'] == 'PATCH':
-                        response = requests.patch(url, headers=headers, json=payload)
-                    elif req_info['method'] == 'DELETE':
-                        response = requests.delete(url, headers=headers)
-                    else:
-                        st.error(f"Unsupported method: {req_info['method']}")
-                        st.stop()
-                    
-                    elapsed_time = time.time() - start_time
-                    
-                    # Store result
-                    result = {
-                        "status_code": response.status_code,
-                        "headers": dict(response.headers),
-                        "elapsed_time": elapsed_time,
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                    
-                    try:
-                        result["body"] = response.json()
-                        result["body_type"] = "json"
-                    except:
-                        result["body"] = response.text
-                        result["body_type"] = "text"
-                    
-                    st.session_state.request_results[selected_id] = result
-                    st.success(f"Request completed in {elapsed_time:.2f}s")
-                    st.rerun()
+                # Use the session's edit, or a fresh copy of the registered sample.
+                payload_key = f"payload_{selected_id}"
+                payload = st.session_state.edited_payloads.get(payload_key)
+                
+                start_time = time.time()
+                response = stedi_request.execute_request(selected_id, payload=payload)
+                elapsed_time = time.time() - start_time
+                
+                # Store result
+                result = {
+                    "status_code": response.status_code,
+                    "headers": dict(response.headers),
+                    "elapsed_time": elapsed_time,
+                    "timings": getattr(response, "timings", None),
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+                }
+                
+                try:
+                    result["body"] = response.json()
+                    result["body_type"] = "json"
+                except:
+                    result["body"] = response.text
+                    result["body_type"] = "text"
+                
+                st.session_state.request_results[selected_id] = result
+                st.success(f"Request completed in {elapsed_time:.2f}s")
+                st.rerun()
             except Exception as e:
                 st.error(f"Error running request: {str(e)}")
                 import traceback
@@ -426,6 +379,12 @@ if run_mode == "Single Request":
         with col3:
             st.metric("Timestamp", result["timestamp"])
         
+        if result.get("timings"):
+            # Connect is our network, TTFB is Stedi and the payer, download grows with the response size.
+            st.dataframe([timing_columns(result["timings"])], hide_index=True, use_container_width=True)
+        elif result["headers"].get("X-Stedi-Cache") == "HIT":
+            st.caption("Answered from the eligibility cache, no request was sent.")
+        
         # Response body
         st.subheader("Response Body")
         if result["body_type"] == "json":
@@ -439,7 +398,7 @@ if run_mode == "Single Request":
 
 else:  # All Requests mode
     st.header("Run All Requests")
-    st.warning(f"⚠️ This will execute all {len(REQUESTS)} requests sequentially. This may take a while.")
+    st.info(f"Runs all {len(REQUESTS)} requests, {run_all_workers} at a time. Results appear as each request finishes.")
     
     col1, col2, col3 = st.columns([1, 1, 4])
     with col1:
@@ -454,68 +413,34 @@ else:  # All Requests mode
     if run_all_button:
         progress_bar = st.progress(0)
         status_text = st.empty()
-        results_container = st.container()
+        results_table = st.empty()
         
         total_requests = len(REQUESTS)
-        completed = 0
         results_summary = []
+        payloads = {req_id: st.session_state.edited_payloads.get(f"payload_{req_id}") for req_id in REQUESTS}
+        # Keep a pooled connection per worker so threads don't wait on each other.
+        # The session is shared by every Streamlit session, so it is only ever grown, never closed.
+        stedi_client.grow_pool(run_all_workers)
         
-        for req_id, req_info in REQUESTS.items():
-            status_text.text(f"Running request {req_id}/{total_requests}: {req_info['method']} {req_info['path']}")
-            
-            try:
-                func = req_info['func']
-                if not func:
-                    result = {
-                        "id": req_id,
-                        "status": "error",
-                        "message": "Function not found",
-                        "status_code": None,
-                        "elapsed_time": 0
-                    }
-                else:
-                    start_time = time.time()
-                    response = func()
-                    elapsed_time = time.time() - start_time
-                    
-                    try:
-                        body = response.json()
-                        body_type = "json"
-                    except:
-                        body = response.text[:500]  # Truncate long text
-                        body_type = "text"
-                    
-                    result = {
-                        "id": req_id,
-                        "status": "success" if 200 <= response.status_code < 300 else "error",
-                        "status_code": response.status_code,
-                        "elapsed_time": elapsed_time,
-                        "body_preview": body if body_type == "json" else body[:200],
-                        "body_type": body_type
-                    }
-                    
-                    # Store full result
-                    st.session_state.request_results[req_id] = {
-                        "status_code": response.status_code,
-                        "headers": dict(response.headers),
-                        "elapsed_time": elapsed_time,
-                        "body": body if body_type == "json" else response.text,
-                        "body_type": body_type,
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                
+        sweep_start = time.time()
+        status_text.text(f"Running {total_requests} requests, {run_all_workers} at a time...")
+        with ThreadPoolExecutor(max_workers=run_all_workers) as executor:
+            futures = [executor.submit(run_for_summary, req_id, payloads[req_id]) for req_id in REQUESTS]
+            for future in as_completed(futures):
+                result, full_result = future.result()
                 results_summary.append(result)
-            except Exception as e:
-                results_summary.append({
-                    "id": req_id,
-                    "status": "error",
-                    "message": str(e),
-                    "status_code": None,
-                    "elapsed_time": 0
-                })
-            
-            completed += 1
-            progress_bar.progress(completed / total_requests)
+                if full_result is not None:
+                    st.session_state.request_results[result["id"]] = full_result
+                
+                req_info = REQUESTS[result["id"]]
+                progress_bar.progress(len(results_summary) / total_requests)
+                status_text.text(
+                    f"Completed {len(results_summary)}/{total_requests}: "
+                    f"{req_info['method']} {req_info['path']} ({result.get('status_code') or 'error'})"
+                )
+                results_table.dataframe(summary_rows(results_summary), hide_index=True, use_container_width=True)
+        sweep_time = time.time() - sweep_start
+        results_summary.sort(key=lambda r: r["id"])
         
         status_text.text("✅ All requests completed!")
         progress_bar.empty()
@@ -538,7 +463,11 @@ else:  # All Requests mode
         with col3:
             st.metric("❌ Errors", error_count)
         with col4:
-            st.metric("⏱️ Total Time", f"{total_time:.2f}s")
+            st.metric(
+                "⏱️ Total Time",
+                f"{sweep_time:.2f}s",
+                help=f"Wall-clock time for the sweep; the requests took {total_time:.2f}s combined."
+            )
         
         # Results table
         st.subheader("Detailed Results")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Benchmark the request execution modes against a local mock Stedi server
+
+Starts mock_stedi_server.MockStediServer in this process and runs the same
+workload (a cycle over REQUESTS ids) through each execution mode, every mode
+in its own child process so memory is measured in isolation:
+
+  unpooled  a new connection per request, like the original request functions
+  pooled    stedi_request.execute_request() one at a time on the shared session
+  threaded  execute_request() from a thread pool
+  async     stedi_async.AsyncStediClient on one aiohttp session
+
+Throughput, latency percentiles, outcome counts and memory for each mode
+are printed and written to a JSON file; --compare prints the change
+against an earlier file.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import stedi_request
+from stedi_metrics import percentile
+from mock_stedi_server import DEFAULT_LATENCY, MockStediServer, parse_errors, parse_latency
+
+MODES = ("unpooled", "pooled", "threaded", "async")
+DEFAULT_REQUESTS = 200
+DEFAULT_CONCURRENCY = 20
+DEFAULT_OUTPUT = "bench_output.json"
+
+# (latency in seconds, outcome) where outcome is a status code or an exception name.
+Sample = Tuple[float, str]
+
+
+def _outcome(response: Any) -> str:
+    return str(response.status_code)
+
+
+def _timed(func, *args) -> Sample:
+    start = time.perf_counter()
+    try:
+        outcome = _outcome(func(*args))
+    except Exception as e:
+        outcome = type(e).__name__
+    return time.perf_counter() - start, outcome
+
+
+def run_unpooled(workload: List[int], concurrency: int) -> List[Sample]:
+    """One requests.request() per call, so every request opens its own connection."""
+    import requests
+
+    def send(request_id: int) -> Any:
+        call = stedi_request.build_request(request_id)
+        return requests.request(call["method"], call["url"], **call["kwargs"])
+
+    return [_timed(send, request_id) for request_id in workload]
+
+
+def run_pooled(workload: List[int], concurrency: int) -> List[Sample]:
+    return [_timed(stedi_request.execute_request, request_id) for request_id in workload]
+
+
+def run_threaded(workload: List[int], concurrency: int) -> List[Sample]:
+    import stedi_client
+
+    stedi_client.configure_pool(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda request_id: _timed(stedi_request.execute_request, request_id), workload))
+
+
+def run_async(workload: List[int], concurrency: int) -> List[Sample]:
+    import asyncio
+    import stedi_async
+
+    async def run() -> List[Sample]:
+        # Time each request from when it gets a slot, as the thread pool does.
+        slots = asyncio.Semaphore(concurrency)
+        async with stedi_async.AsyncStediClient(concurrency=concurrency) as client:
+            async def timed(request_id: int) -> Sample:
+                async with slots:
+                    start = time.perf_counter()
+                    try:
+                        outcome = _outcome(await client.run_request(request_id))
+                    except Exception as e:
+                        outcome = type(e).__name__
+                    return time.perf_counter() - start, outcome
+
+            return await asyncio.gather(*(timed(request_id) for request_id in workload))
+
+    return asyncio.run(run())
+
+
+RUNNERS = {
+    "unpooled": run_unpooled,
+    "pooled": run_pooled,
+    "threaded": run_threaded,
+    "async": run_async,
+}
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def summarize(mode: str, samples: List[Sample], wall_time: float, rss_before: float, rss_after: float) -> Dict[str, Any]:
+    latencies = sorted(latency for latency, _ in samples)
+    outcomes: Dict[str, int] = {}
+    for _, outcome in samples:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    errors = sum(count for outcome, count in outcomes.items() if not (outcome.isdigit() and int(outcome) < 400))
+    return {
+        "mode": mode,
+        "requests": len(samples),
+        "errors": errors,
+        "outcomes": outcomes,
+        "wall_time": round(wall_time, 4),
+        "throughput_rps": round(len(samples) / wall_time, 2) if wall_time else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "memory_mb": {
+            "peak_rss": round(rss_after, 1),
+            "growth": round(rss_after - rss_before, 1),
+        },
+    }
+
+
+def run_worker(mode: str, base_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Run one mode against ``base_url`` in this process and return its summary."""
+    import stedi_cache
+    import stedi_ratelimit
+    import stedi_retry
+
+    stedi_request.set_base_urls(healthcare=base_url, payers=base_url)
+    stedi_request.set_api_key("benchmark")
+    stedi_ratelimit.limiter.enabled = args.rate_limit
+    stedi_cache.cache.enabled = args.cache
+    stedi_retry.configure_policy(max_attempts=args.max_attempts)
+
+    workload = [args.ids[i % len(args.ids)] for i in range(args.requests)]
+    runner = RUNNERS[mode]
+    if args.warmup:
+        runner(workload[:args.warmup], args.concurrency)
+
+    rss_before = _max_rss_mb()
+    start = time.perf_counter()
+    samples = runner(workload, args.concurrency)
+    wall_time = time.perf_counter() - start
+    return summarize(mode, samples, wall_time, rss_before, _max_rss_mb())
+
+
+def _worker_command(mode: str, base_url: str, args: argparse.Namespace) -> List[str]:
+    command = [
+        sys.executable, __file__, "--worker", mode, "--base-url", base_url,
+        "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+        "--ids", ",".join(str(request_id) for request_id in args.ids),
+        "--max-attempts", str(args.max_attempts), "--warmup", str(args.warmup),
+    ]
+    if args.rate_limit:
+        command.append("--rate-limit")
+    if args.cache:
+        command.append("--cache")
+    return command
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print(f"\n{'mode':10s} {'reqs':>6s} {'errors':>6s} {'req/s':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'peak MB':>8s}")
+    for result in results:
+        latency = result["latency_ms"]
+        print(
+            f"{result['mode']:10s} {result['requests']:6d} {result['errors']:6d} {result['throughput_rps']:9.1f} "
+            f"{latency['p50']:9.1f} {latency['p95']:9.1f} {latency['p99']:9.1f} {result['memory_mb']['peak_rss']:8.1f}"
+        )
+
+
+def print_comparison(results: List[Dict[str, Any]], previous_path: str) -> None:
+    with open(previous_path) as f:
+        previous = {result["mode"]: result for result in json.load(f)["results"]}
+
+    def change(new: float, old: float) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"\nCompared with {previous_path}:")
+    for result in results:
+        old = previous.get(result["mode"])
+        if not old:
+            continue
+        print(
+            f"{result['mode']:10s} req/s {old['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} "
+            f"({change(result['throughput_rps'], old['throughput_rps'])}), "
+            f"p95 {old['latency_ms']['p95']:.1f} -> {result['latency_ms']['p95']:.1f} ms "
+            f"({change(result['latency_ms']['p95'], old['latency_ms']['p95'])})"
+        )
+
+
+def main():
+    """Main entry point for the benchmark CLI."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark request execution modes against a local mock Stedi server.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s
+  %(prog)s --modes pooled,async --requests 2000 --concurrency 100
+  %(prog)s --latency uniform:0.02,0.2 --errors 503:0.02,reset:0.005
+  %(prog)s --output after.json --compare before.json
+        """
+    )
+    parser.add_argument(
+        "--modes",
+        type=lambda value: [mode.strip() for mode in value.split(",") if mode.strip()],
+        default=list(MODES),
+        help=f"Comma-separated modes to run (default: {','.join(MODES)})"
+    )
+    parser.add_argument(
+        "--ids",
+        type=lambda value: [int(part) for part in value.split(",") if part.strip()],
+        default=list(stedi_request.REQUESTS),
+        metavar="IDS",
+        help="Comma-separated request IDs to cycle through (default: all)"
+    )
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, metavar="N", help=f"Requests per mode (default: {DEFAULT_REQUESTS})")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        metavar="N",
+        help=f"Workers or requests in flight for threaded and async (default: {DEFAULT_CONCURRENCY})"
+    )
+    parser.add_argument("--warmup", type=int, default=0, metavar="N", help="Unmeasured requests sent first in each mode")
+    parser.add_argument("--latency", default=DEFAULT_LATENCY, help=f"Mock server latency distribution (default: {DEFAULT_LATENCY})")
+    parser.add_argument("--errors", help="Mock server error injection, e.g. 503:0.01,429:0.02,reset:0.005")
+    parser.add_argument("--response-bytes", type=int, default=0, help="Extra padding in mock JSON responses")
+    parser.add_argument("--max-attempts", type=int, default=4, metavar="N", help="Attempts per request, 1 disables retries (default: 4)")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep the client-side rate limiter on (off by default)")
+    parser.add_argument("--cache", action="store_true", help="Keep the eligibility cache on (off by default)")
+    parser.add_argument("--output", "-o", default=DEFAULT_OUTPUT, help=f"JSON results file (default: {DEFAULT_OUTPUT})")
+    parser.add_argument("--compare", metavar="PATH", help="Earlier results file to compare against")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.base_url, args)))
+        return
+
+    unknown = [mode for mode in args.modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown modes {unknown}; expected some of {list(MODES)}")
+    unknown = [request_id for request_id in args.ids if request_id not in stedi_request.REQUESTS]
+    if unknown:
+        parser.error(f"unknown request IDs {unknown}")
+    if args.requests < 1 or args.concurrency < 1 or args.max_attempts < 1:
+        parser.error("--requests, --concurrency and --max-attempts must be at least 1")
+    try:
+        parse_latency(args.latency)
+        parse_errors(args.errors)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = MockStediServer(args.latency, args.errors, args.response_bytes)
+    base_url = server.start()
+    print(f"Mock server on {base_url}: latency {args.latency}, errors {args.errors or 'none'}")
+
+    results = []
+    try:
+        for mode in args.modes:
+            print(f"Running {mode} ({args.requests} requests)...", flush=True)
+            completed = subprocess.run(_worker_command(mode, base_url, args), capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                sys.exit(f"{mode} benchmark failed")
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    finally:
+        server.stop()
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "ids": args.ids,
+            "latency": args.latency,
+            "errors": args.errors,
+            "response_bytes": args.response_bytes,
+            "max_attempts": args.max_attempts,
+            "rate_limit": args.rate_limit,
+            "cache": args.cache,
+        },
+        "server_outcomes": server.counts,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_results(results)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Bulk 270/271 eligibility checks driven by a patient roster file
+
+Reads subscribers from a CSV or JSONL roster, fills in the request_3
+eligibility payload for each row and submits them concurrently through
+stedi_async. Each result is appended to a JSONL output file as soon as
+its check finishes, so memory stays flat for very large rosters.
+"""
+
+import argparse
+import asyncio
+import copy
+import csv
+import json
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple, Union
+
+import stedi_async
+import stedi_ratelimit
+import stedi_request
+
+ELIGIBILITY_REQUEST_ID = 3
+
+REQUIRED_COLUMNS = ["memberId", "dateOfBirth", "firstName", "lastName", "tradingPartnerServiceId"]
+COLUMN_ALIASES = {
+    "dob": "dateOfBirth",
+    "birthDate": "dateOfBirth",
+    "payerId": "tradingPartnerServiceId",
+}
+
+
+def read_roster(path: str) -> Iterator[Union[Dict[str, Any], ValueError]]:
+    """Yield roster rows from a .csv or .jsonl file, one at a time.
+
+    A JSONL line that is not a JSON object is yielded as a ValueError in
+    place of its row, so callers can record it as a row error and carry on.
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield ValueError(f"Invalid JSON: {e}")
+                    continue
+                if isinstance(row, dict):
+                    yield row
+                else:
+                    yield ValueError(f"Expected a JSON object, got {type(row).__name__}")
+
+
+def normalize_date(value: str) -> str:
+    """Return a date as YYYYMMDD, accepting YYYY-MM-DD and YYYY/MM/DD."""
+    digits = str(value).strip().replace("-", "").replace("/", "")
+    if len(digits) != 8 or not digits.isdigit():
+        raise ValueError(f"Invalid date: {value!r}")
+    return digits
+
+
+def parse_service_type_codes(value: Any) -> List[str]:
+    """Accept a list or a string separated by ';', '|', ',' or spaces."""
+    if isinstance(value, list):
+        return [str(code) for code in value]
+    # A JSONL roster may hold a single code as a number.
+    value = str(value)
+    for separator in ";|,":
+        value = value.replace(separator, " ")
+    return value.split()
+
+
+def build_eligibility_payload(row: Dict[str, Any], template: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill the request_3 payload template with one roster row."""
+    row = {COLUMN_ALIASES.get(key, key): value for key, value in row.items() if value not in (None, "")}
+    missing = [column for column in REQUIRED_COLUMNS if column not in row]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    payload = copy.deepcopy(template)
+    payload["tradingPartnerServiceId"] = row["tradingPartnerServiceId"]
+    payload["subscriber"] = {
+        "memberId": row["memberId"],
+        "dateOfBirth": normalize_date(row["dateOfBirth"]),
+        "firstName": row["firstName"],
+        "lastName": row["lastName"],
+    }
+
+    encounter = dict(payload.get("encounter", {}))
+    if "serviceTypeCodes" in row:
+        encounter["serviceTypeCodes"] = parse_service_type_codes(row["serviceTypeCodes"])
+    if "dateOfService" in row:
+        encounter["dateOfService"] = normalize_date(row["dateOfService"])
+    payload["encounter"] = encounter
+
+    if "externalPatientId" in row:
+        payload["externalPatientId"] = row["externalPatientId"]
+    else:
+        payload.pop("externalPatientId", None)
+
+    return payload
+
+
+def get_payload_template(provider_npi: Optional[str] = None, provider_name: Optional[str] = None) -> Dict[str, Any]:
+    """Return the request_3 sample payload, with the provider optionally replaced."""
+    template = stedi_request.build_request(ELIGIBILITY_REQUEST_ID)["kwargs"]["json"]
+    if provider_npi:
+        template["provider"]["npi"] = provider_npi
+    if provider_name:
+        template["provider"]["organizationName"] = provider_name
+    return template
+
+
+def format_result(row_number: int, payload: Dict[str, Any], result: Any) -> Dict[str, Any]:
+    """Build the JSONL record written for one roster row."""
+    record = {
+        "row": row_number,
+        "memberId": payload["subscriber"]["memberId"],
+        "tradingPartnerServiceId": payload["tradingPartnerServiceId"],
+    }
+    if isinstance(result, BaseException):
+        record.update({"status": "error", "status_code": None, "message": str(result)})
+        return record
+
+    record.update({
+        "status": "success" if 200 <= result.status_code < 300 else "error",
+        "status_code": result.status_code,
+        "elapsed_time": round(result.elapsed, 4),
+    })
+    try:
+        record["body"] = result.json()
+    except ValueError:
+        record["body"] = result.text
+    return record
+
+
+async def run_bulk_eligibility(
+    roster: Iterator[Union[Dict[str, Any], ValueError]],
+    output: TextIO,
+    template: Dict[str, Any],
+    concurrency: int = stedi_async.DEFAULT_CONCURRENCY,
+) -> Dict[str, int]:
+    """Submit one eligibility check per roster row and stream results to ``output``.
+
+    Rows that cannot be turned into a payload are written as errors without
+    being submitted. Returns counts of submitted, successful and failed rows.
+    """
+    counts = {"submitted": 0, "success": 0, "error": 0}
+    in_flight: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+
+    def write(record: Dict[str, Any]) -> None:
+        output.write(json.dumps(record, separators=(",", ":")) + "\n")
+        output.flush()
+        counts[record["status"]] += 1
+
+    def items() -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for row_number, row in enumerate(roster, start=1):
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                payload = build_eligibility_payload(row, template)
+            except ValueError as e:
+                write({"row": row_number, "status": "error", "status_code": None, "message": str(e)})
+                continue
+            in_flight[counts["submitted"]] = (row_number, payload)
+            counts["submitted"] += 1
+            yield ELIGIBILITY_REQUEST_ID, payload
+
+    async for index, result in stedi_async.iter_completed(items(), concurrency=concurrency):
+        row_number, payload = in_flight.pop(index)
+        write(format_result(row_number, payload, result))
+
+    return counts
+
+
+def main():
+    """Main entry point for the bulk eligibility CLI."""
+    parser = argparse.ArgumentParser(
+        description="Run 270/271 eligibility checks for every subscriber in a roster file.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+Roster columns (CSV header or JSONL keys):
+  required: {', '.join(REQUIRED_COLUMNS)}
+  optional: serviceTypeCodes (e.g. "30;MH"), dateOfService, externalPatientId
+
+Examples:
+  %(prog)s roster.csv --output results.jsonl
+  %(prog)s roster.jsonl --output results.jsonl --concurrency 50
+        """
+    )
+    parser.add_argument("roster", help="Roster file (.csv or .jsonl)")
+    parser.add_argument(
+        "--output", "-o",
+        default="eligibility_results.jsonl",
+        help="JSONL file results are appended to (default: eligibility_results.jsonl)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=stedi_async.DEFAULT_CONCURRENCY,
+        metavar="N",
+        help=f"Maximum checks in flight (default: {stedi_async.DEFAULT_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        metavar="RPS",
+        help=f"Client-side limit on checks per second (default: {stedi_ratelimit.DEFAULT_RATE:g} or the endpoint's rate_limit)"
+    )
+    parser.add_argument("--no-rate-limit", action="store_true", help="Turn off the client-side rate limiter")
+    parser.add_argument("--provider-npi", help="Override the provider NPI from the request_3 sample")
+    parser.add_argument("--provider-name", help="Override the provider organization name from the request_3 sample")
+    parser.add_argument(
+        "--api-key",
+        help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
+    )
+    args = parser.parse_args()
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.api_key:
+        stedi_request.set_api_key(args.api_key)
+    stedi_ratelimit.limiter.enabled = not args.no_rate_limit
+    # Let --concurrency requests actually run at once instead of the default cap.
+    stedi_ratelimit.limiter.override(stedi_request.REQUESTS[ELIGIBILITY_REQUEST_ID]["path"], args.rate, args.concurrency)
+
+    template = get_payload_template(args.provider_npi, args.provider_name)
+    start_time = time.time()
+    with open(args.output, "a") as output:
+        counts = asyncio.run(
+            run_bulk_eligibility(read_roster(args.roster), output, template, concurrency=args.concurrency)
+        )
+    elapsed_time = time.time() - start_time
+
+    print(
+        f"Submitted {counts['submitted']} checks in {elapsed_time:.1f}s: "
+        f"{counts['success']} successful, {counts['error']} errors. Results: {args.output}"
+    )
+    if counts["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Bulk 835 ERA ingestion into SQLite and Parquet
+
+Fetches the request_10 835 report for many transactionIds concurrently on
+stedi_async and flattens every claim payment into tables that can be
+queried across months of ERAs:
+
+  era_transactions   one row per transactionId: when it was loaded, status, claim count
+  era_claims         one row per claim payment (CLP), with check and payer details
+  era_service_lines  one row per service line (SVC)
+  era_adjustments    one row per claim or service line adjustment (CAS)
+
+Rows are written to SQLite in batched executemany() inserts and, when
+pyarrow is installed and a Parquet directory is given, as row groups of
+one Parquet file per table and run. Reports may be Stedi's JSON ERA or raw
+X12, which goes through x12_parser. Transactions already in the database
+are skipped unless --refetch is given.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import stedi_async
+import stedi_ratelimit
+import stedi_request
+import x12_parser
+
+ERA_REQUEST_ID = 10
+DEFAULT_DB = "eras.db"
+DEFAULT_BATCH_SIZE = 5000
+
+# Column name and SQLite type for every table, in insert order.
+TABLES: Dict[str, List[Tuple[str, str]]] = {
+    "era_transactions": [
+        ("transaction_id", "TEXT PRIMARY KEY"),
+        ("ingested_at", "REAL"),
+        ("status", "TEXT"),
+        ("claim_count", "INTEGER"),
+        ("error", "TEXT"),
+    ],
+    "era_claims": [
+        ("transaction_id", "TEXT"),
+        ("claim_index", "INTEGER"),
+        ("patient_control_number", "TEXT"),
+        ("claim_status_code", "TEXT"),
+        ("charge_amount", "REAL"),
+        ("payment_amount", "REAL"),
+        ("patient_responsibility_amount", "REAL"),
+        ("claim_filing_indicator_code", "TEXT"),
+        ("payer_claim_control_number", "TEXT"),
+        ("patient_last_name", "TEXT"),
+        ("patient_first_name", "TEXT"),
+        ("patient_member_id", "TEXT"),
+        ("claim_statement_period_start", "TEXT"),
+        ("payer_name", "TEXT"),
+        ("payee_name", "TEXT"),
+        ("check_or_eft_trace_number", "TEXT"),
+        ("payment_method_code", "TEXT"),
+        ("payment_date", "TEXT"),
+        ("total_payment_amount", "REAL"),
+    ],
+    "era_service_lines": [
+        ("transaction_id", "TEXT"),
+        ("claim_index", "INTEGER"),
+        ("line_index", "INTEGER"),
+        ("procedure_qualifier", "TEXT"),
+        ("procedure_code", "TEXT"),
+        ("procedure_modifiers", "TEXT"),
+        ("charge_amount", "REAL"),
+        ("payment_amount", "REAL"),
+        ("units", "REAL"),
+        ("service_date", "TEXT"),
+    ],
+    "era_adjustments": [
+        ("transaction_id", "TEXT"),
+        ("claim_index", "INTEGER"),
+        ("line_index", "INTEGER"),
+        ("group_code", "TEXT"),
+        ("reason_code", "TEXT"),
+        ("amount", "REAL"),
+        ("quantity", "REAL"),
+    ],
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS era_claims_transaction ON era_claims (transaction_id)",
+    "CREATE INDEX IF NOT EXISTS era_claims_patient_control_number ON era_claims (patient_control_number)",
+    "CREATE INDEX IF NOT EXISTS era_claims_payment_date ON era_claims (payment_date)",
+    "CREATE INDEX IF NOT EXISTS era_service_lines_transaction ON era_service_lines (transaction_id)",
+    "CREATE INDEX IF NOT EXISTS era_adjustments_transaction ON era_adjustments (transaction_id)",
+]
+
+# SQLite column type -> pyarrow type name.
+PARQUET_TYPES = {"TEXT": "string", "REAL": "float64", "INTEGER": "int64"}
+
+
+def _number(value: Any) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _json_adjustments(groups: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Expand Stedi JSON CAS groups (adjustmentReasonCode1..6) like x12_parser does for CAS segments."""
+    adjustments = []
+    for group in groups or []:
+        for position in range(1, 7):
+            reason = group.get(f"adjustmentReasonCode{position}")
+            if reason:
+                adjustments.append({
+                    "groupCode": group.get("claimAdjustmentGroupCode"),
+                    "reasonCode": reason,
+                    "amount": group.get(f"adjustmentAmount{position}"),
+                    "quantity": group.get(f"adjustmentQuantity{position}"),
+                })
+    return adjustments
+
+
+def iter_835_json_claims(report: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield claim records shaped like x12_parser.iter_835_claims() from Stedi's JSON 835 report.
+
+    Lists and objects that are null in the report are treated as empty.
+    """
+    for transaction in report.get("transactions") or []:
+        financial = transaction.get("financialInformation") or {}
+        payment = {
+            "totalPaymentAmount": financial.get("totalActualProviderPaymentAmount"),
+            "paymentMethodCode": financial.get("paymentMethodCode"),
+            "paymentDate": financial.get("checkIssueOrEFTEffectiveDate"),
+            "checkOrEftTraceNumber": (transaction.get("paymentAndRemitReassociationDetails") or {}).get("checkOrEFTTraceNumber"),
+            "payerName": (transaction.get("payer") or {}).get("name"),
+            "payeeName": (transaction.get("payee") or {}).get("name"),
+        }
+        for detail in transaction.get("detailInfo") or []:
+            for payment_info in detail.get("paymentInfo") or []:
+                claim_info = payment_info.get("claimPaymentInfo") or {}
+                patient = payment_info.get("patientName") or {}
+                service_lines = []
+                for line in payment_info.get("serviceLines") or []:
+                    service = line.get("servicePaymentInformation") or {}
+                    service_lines.append({
+                        "procedureQualifier": service.get("productOrServiceIDQualifier"),
+                        "procedureCode": service.get("adjudicatedProcedureCode"),
+                        "procedureModifiers": service.get("adjudicatedProcedureModifierCodes") or [],
+                        "chargeAmount": service.get("lineItemChargeAmount"),
+                        "paymentAmount": service.get("lineItemProviderPaymentAmount"),
+                        "units": service.get("unitsOfServicePaidCount"),
+                        "serviceDate": line.get("serviceDate"),
+                        "adjustments": _json_adjustments(line.get("serviceAdjustments")),
+                    })
+                yield {
+                    **payment,
+                    "patientControlNumber": claim_info.get("patientControlNumber"),
+                    "claimStatusCode": claim_info.get("claimStatusCode"),
+                    "chargeAmount": claim_info.get("totalClaimChargeAmount"),
+                    "paymentAmount": claim_info.get("claimPaymentAmount"),
+                    "patientResponsibilityAmount": claim_info.get("patientResponsibilityAmount"),
+                    "claimFilingIndicatorCode": claim_info.get("claimFilingIndicatorCode"),
+                    "payerClaimControlNumber": claim_info.get("payerClaimControlNumber"),
+                    "patientLastName": patient.get("lastName"),
+                    "patientFirstName": patient.get("firstName"),
+                    "patientMemberId": patient.get("memberId"),
+                    "claimStatementPeriodStart": payment_info.get("claimStatementPeriodStart"),
+                    "adjustments": _json_adjustments(payment_info.get("claimAdjustments")),
+                    "serviceLines": service_lines,
+                }
+
+
+def iter_report_claims(content: bytes) -> Iterator[Dict[str, Any]]:
+    """Yield claim records from a request_10 response body, JSON or raw X12."""
+    if content.lstrip()[:3] == b"ISA":
+        return x12_parser.iter_835_claims(x12_parser.tokenize([content]))
+    report = json.loads(content)
+    if not isinstance(report, dict):
+        raise ValueError(f"expected a JSON object, got {type(report).__name__}")
+    return iter_835_json_claims(report)
+
+
+def flatten_claims(transaction_id: str, claims: Iterable[Dict[str, Any]]) -> Iterator[Tuple[str, tuple]]:
+    """Yield (table, row) pairs for every claim, service line and adjustment."""
+    for claim_index, claim in enumerate(claims):
+        yield "era_claims", (
+            transaction_id,
+            claim_index,
+            claim.get("patientControlNumber"),
+            claim.get("claimStatusCode"),
+            _number(claim.get("chargeAmount")),
+            _number(claim.get("paymentAmount")),
+            _number(claim.get("patientResponsibilityAmount")),
+            claim.get("claimFilingIndicatorCode"),
+            claim.get("payerClaimControlNumber"),
+            claim.get("patientLastName"),
+            claim.get("patientFirstName"),
+            claim.get("patientMemberId"),
+            claim.get("claimStatementPeriodStart"),
+            claim.get("payerName"),
+            claim.get("payeeName"),
+            claim.get("checkOrEftTraceNumber"),
+            claim.get("paymentMethodCode"),
+            claim.get("paymentDate"),
+            _number(claim.get("totalPaymentAmount")),
+        )
+        for adjustment in claim.get("adjustments", []):
+            yield "era_adjustments", _adjustment_row(transaction_id, claim_index, None, adjustment)
+        for line_index, line in enumerate(claim.get("serviceLines", [])):
+            yield "era_service_lines", (
+                transaction_id,
+                claim_index,
+                line_index,
+                line.get("procedureQualifier"),
+                line.get("procedureCode"),
+                ":".join(line.get("procedureModifiers") or []) or None,
+                _number(line.get("chargeAmount")),
+                _number(line.get("paymentAmount")),
+                _number(line.get("units")),
+                line.get("serviceDate"),
+            )
+            for adjustment in line.get("adjustments", []):
+                yield "era_adjustments", _adjustment_row(transaction_id, claim_index, line_index, adjustment)
+
+
+def _adjustment_row(transaction_id: str, claim_index: int, line_index: Optional[int], adjustment: Dict[str, Any]) -> tuple:
+    return (
+        transaction_id,
+        claim_index,
+        line_index,
+        adjustment.get("groupCode"),
+        adjustment.get("reasonCode"),
+        _number(adjustment.get("amount")),
+        _number(adjustment.get("quantity")),
+    )
+
+
+class EraStore:
+    """SQLite tables (and optional Parquet files) that flattened ERAs are written to in batches."""
+
+    def __init__(self, sqlite_path: str, parquet_dir: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._db = sqlite3.connect(sqlite_path)
+        for table, columns in TABLES.items():
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{name} {kind}' for name, kind in columns)})")
+        for statement in INDEXES:
+            self._db.execute(statement)
+        self._db.commit()
+
+        self._inserts = {
+            table: f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' for _ in columns)})"
+            for table, columns in TABLES.items()
+        }
+        self._pending: Dict[str, List[tuple]] = {table: [] for table in TABLES}
+        self._pending_rows = 0
+        self._parquet = _ParquetWriters(parquet_dir) if parquet_dir else None
+        self._loaded = {row[0] for row in self._db.execute("SELECT transaction_id FROM era_transactions")}
+
+    def ingested(self) -> set:
+        """Return the transactionIds already loaded successfully."""
+        return {row[0] for row in self._db.execute("SELECT transaction_id FROM era_transactions WHERE status = 'success'")}
+
+    def add(self, transaction_id: str, claims: Iterable[Dict[str, Any]]) -> int:
+        """Queue the rows of one ERA, replacing anything loaded for it before. Returns its claim count."""
+        if transaction_id in self._loaded:
+            # Rows of the earlier load may still sit in the current batch.
+            self.flush()
+            with self._db:
+                self._delete_rows(transaction_id)
+        self._loaded.add(transaction_id)
+
+        claim_count = 0
+        for table, row in flatten_claims(transaction_id, claims):
+            claim_count += table == "era_claims"
+            self._queue(table, row)
+        self._queue("era_transactions", (transaction_id, time.time(), "success", claim_count, None))
+        return claim_count
+
+    def add_error(self, transaction_id: str, message: str) -> None:
+        """Record a failed load, dropping the rows of any earlier load so the tables match its status."""
+        row = (transaction_id, time.time(), "error", 0, message)
+        if transaction_id not in self._loaded:
+            self._loaded.add(transaction_id)
+            self._queue("era_transactions", row)
+            return
+
+        self.flush()
+        with self._db:
+            self._delete_rows(transaction_id)
+            self._db.execute(self._inserts["era_transactions"], row)
+        if self._parquet is not None:
+            self._parquet.write({"era_transactions": [row]})
+
+    def _delete_rows(self, transaction_id: str) -> None:
+        for table in TABLES:
+            if table != "era_transactions":
+                self._db.execute(f"DELETE FROM {table} WHERE transaction_id = ?", (transaction_id,))
+
+    def _queue(self, table: str, row: tuple) -> None:
+        self._pending[table].append(row)
+        self._pending_rows += 1
+        if self._pending_rows >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the queued rows in one transaction."""
+        if not self._pending_rows:
+            return
+        with self._db:
+            for table, rows in self._pending.items():
+                if rows:
+                    self._db.executemany(self._inserts[table], rows)
+        if self._parquet is not None:
+            self._parquet.write(self._pending)
+        self._pending = {table: [] for table in TABLES}
+        self._pending_rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        if self._parquet is not None:
+            self._parquet.close()
+        self._db.close()
+
+
+class _ParquetWriters:
+    """One Parquet file per table for this run, written a row group per flushed batch."""
+
+    def __init__(self, parquet_dir: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow: pip install pyarrow") from None
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._dir = parquet_dir
+        self._run = time.strftime("%Y%m%dT%H%M%S")
+        self._schemas = {
+            table: pyarrow.schema([(name, PARQUET_TYPES[kind.split()[0]]) for name, kind in columns])
+            for table, columns in TABLES.items()
+        }
+        self._writers: Dict[str, Any] = {}
+
+    def write(self, pending: Dict[str, List[tuple]]) -> None:
+        for table, rows in pending.items():
+            if not rows:
+                continue
+            writer = self._writers.get(table)
+            if writer is None:
+                os.makedirs(os.path.join(self._dir, table), exist_ok=True)
+                path = os.path.join(self._dir, table, f"{self._run}.parquet")
+                writer = self._writers[table] = self._pq.ParquetWriter(path, self._schemas[table])
+            columns = list(zip(*rows))
+            writer.write_table(self._pa.Table.from_arrays(
+                [self._pa.array(column, type=field.type) for column, field in zip(columns, self._schemas[table])],
+                schema=self._schemas[table],
+            ))
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+
+
+async def ingest_eras(
+    transaction_ids: List[str],
+    store: EraStore,
+    concurrency: int = stedi_async.DEFAULT_CONCURRENCY,
+) -> Dict[str, int]:
+    """Fetch the 835 report of each transactionId concurrently and add it to ``store`` as it arrives.
+
+    Returns counts of loaded and failed transactions and of claims.
+    """
+    counts = {"success": 0, "error": 0, "claims": 0}
+    items = ((ERA_REQUEST_ID, None, {"transactionId": transaction_id}) for transaction_id in transaction_ids)
+    async for index, result in stedi_async.iter_completed(items, concurrency=concurrency):
+        transaction_id = transaction_ids[index]
+        if isinstance(result, BaseException):
+            message = str(result) or type(result).__name__
+        elif result.status_code >= 400:
+            message = f"HTTP {result.status_code}: {result.text[:200]}"
+        else:
+            # Parse the whole report before adding any rows, so a malformed
+            # one is recorded as an error without leaving partial claims queued.
+            try:
+                claims = list(iter_report_claims(result.content))
+            except (ValueError, TypeError, AttributeError, KeyError) as e:
+                message = f"Unreadable 835 report: {e}"
+            else:
+                counts["claims"] += store.add(transaction_id, claims)
+                counts["success"] += 1
+                continue
+        store.add_error(transaction_id, message)
+        counts["error"] += 1
+    return counts
+
+
+def main():
+    """Main entry point for the ERA ingestion CLI."""
+    parser = argparse.ArgumentParser(
+        description="Fetch 835 ERAs concurrently and load claim payments, service lines and adjustments into SQLite/Parquet.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --ids-file era_transaction_ids.txt --db eras.db
+  %(prog)s --ids-file era_transaction_ids.txt --parquet-dir eras_parquet --concurrency 50
+  sqlite3 eras.db "SELECT payer_name, SUM(payment_amount) FROM era_claims GROUP BY payer_name"
+        """
+    )
+    parser.add_argument("ids", nargs="*", help="835 transaction IDs")
+    parser.add_argument("--ids-file", help="File with one transaction ID per line")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"SQLite database to load into (default: {DEFAULT_DB})")
+    parser.add_argument("--parquet-dir", help="Also write one Parquet file per table and run here (needs pyarrow)")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=stedi_async.DEFAULT_CONCURRENCY,
+        metavar="N",
+        help=f"Maximum reports fetched at once (default: {stedi_async.DEFAULT_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        metavar="RPS",
+        help=f"Client-side limit on report requests per second (default: {stedi_ratelimit.DEFAULT_RATE:g} or the endpoint's rate_limit)"
+    )
+    parser.add_argument("--no-rate-limit", action="store_true", help="Turn off the client-side rate limiter")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        metavar="ROWS",
+        help=f"Rows per insert batch (default: {DEFAULT_BATCH_SIZE})"
+    )
+    parser.add_argument("--refetch", action="store_true", help="Load transactions again even if already in the database")
+    parser.add_argument(
+        "--api-key",
+        help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
+    )
+    args = parser.parse_args()
+
+    transaction_ids = stedi_request.read_ids(args.ids, args.ids_file)
+    if not transaction_ids:
+        parser.error("give transaction IDs or --ids-file")
+    if args.concurrency < 1 or args.batch_size < 1:
+        parser.error("--concurrency and --batch-size must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.api_key:
+        stedi_request.set_api_key(args.api_key)
+    stedi_ratelimit.limiter.enabled = not args.no_rate_limit
+    # Let --concurrency requests actually run at once instead of the default cap.
+    stedi_ratelimit.limiter.override(stedi_request.REQUESTS[ERA_REQUEST_ID]["path"], args.rate, args.concurrency)
+
+    try:
+        store = EraStore(args.db, args.parquet_dir, args.batch_size)
+    except RuntimeError as e:
+        parser.error(str(e))
+    skipped = 0
+    if not args.refetch:
+        ingested = store.ingested()
+        skipped = sum(1 for transaction_id in transaction_ids if transaction_id in ingested)
+        transaction_ids = [transaction_id for transaction_id in transaction_ids if transaction_id not in ingested]
+
+    start_time = time.time()
+    try:
+        counts = asyncio.run(ingest_eras(transaction_ids, store, args.concurrency))
+    finally:
+        store.close()
+    elapsed_time = time.time() - start_time
+
+    print(
+        f"Loaded {counts['success']} ERAs ({counts['claims']} claims) in {elapsed_time:.1f}s, "
+        f"{counts['error']} errors, {skipped} already loaded. Database: {args.db}"
+    )
+    if counts["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
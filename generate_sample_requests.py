@@ -4,9 +4,13 @@ Script to generate sample requests from Stedi Healthcare OpenAPI specifications.
 """
 
 import argparse
+import hashlib
 import json
-from typing import Dict, Any, List, Optional
-from urllib.request import urlopen
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
 from urllib.parse import urljoin
 
 API_REFERENCE_URL = "https://www.stedi.com/docs/healthcare/api-reference"
@@ -20,6 +24,176 @@ OPENAPI_SPECS = {
     "event-destinations": "https://raw.githubusercontent.com/Stedi/openApi/main/event-destinations.json",
 }
 
+DEFAULT_SPEC_CACHE_DIR = ".spec_cache"
+MANIFEST_VERSION = 2
+DEFAULT_NDJSON_OUTPUT = "sample_requests.jsonl"
+DEFAULT_REGISTRY_OUTPUT = "sample_registry.py"
+SPEC_TIMEOUT = 30
+
+
+def _spec_cache_paths(url: str, cache_dir: str) -> Tuple[str, str]:
+    """Return the cached body and metadata file paths for a spec URL."""
+    name = hashlib.sha1(url.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{name}.json"), os.path.join(cache_dir, f"{name}.meta.json")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def fetch_spec(url: str, cache_dir: Optional[str] = DEFAULT_SPEC_CACHE_DIR, offline: bool = False) -> Tuple[Dict[str, Any], str]:
+    """Return an OpenAPI spec and where it came from: "downloaded", "not modified" or "cached ...".
+
+    With a ``cache_dir`` the last download is kept on disk and revalidated
+    with If-None-Match/If-Modified-Since, so an unchanged spec costs one
+    empty 304 response. ``offline`` skips the network and uses the cached
+    copy; so does a failed download when a cached copy exists.
+    """
+    if not cache_dir:
+        with urlopen(url, timeout=SPEC_TIMEOUT) as response:
+            return json.load(response), "downloaded"
+
+    body_path, meta_path = _spec_cache_paths(url, cache_dir)
+    meta: Dict[str, Any] = {}
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    if offline:
+        if not meta:
+            raise RuntimeError(f"No cached copy of {url} in {cache_dir}; run once without --offline")
+        status = "cached"
+    else:
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            with urlopen(Request(url, headers=headers), timeout=SPEC_TIMEOUT) as response:
+                content = response.read()
+                spec = json.loads(content)
+                os.makedirs(cache_dir, exist_ok=True)
+                _write_atomic(body_path, content)
+                _write_atomic(meta_path, json.dumps({
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }).encode())
+                return spec, "downloaded"
+        except HTTPError as e:
+            if not meta:
+                raise
+            if e.code == 304:
+                status = "not modified"
+            else:
+                status = f"cached, download failed: {e}"
+        except (URLError, OSError) as e:
+            if not meta:
+                raise
+            status = f"cached, download failed: {e}"
+
+    with open(body_path) as f:
+        return json.load(f), status
+
+
+def manifest_path(output_json: str) -> str:
+    """Return the manifest file kept next to a JSON output file."""
+    return f"{os.path.splitext(output_json)[0]}.manifest.json"
+
+
+def load_manifest(output_json: str) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """Map each operation key of the last run to its (hash, generated request).
+
+    Returns an empty mapping, so everything is regenerated, when the
+    manifest or output is missing or they do not match.
+    """
+    try:
+        with open(manifest_path(output_json)) as f:
+            manifest = json.load(f)
+        with open(output_json) as f:
+            requests_list = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    operations = manifest.get("operations", {})
+    if manifest.get("version") != MANIFEST_VERSION or len(operations) != len(requests_list):
+        return {}
+    return {key: (operation_hash, request) for (key, operation_hash), request in zip(operations.items(), requests_list)}
+
+
+def save_manifest(output_json: str, operations: List[Tuple[str, str]]) -> None:
+    """Record the hash of every operation by key, in output order."""
+    with open(manifest_path(output_json), "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "operations": dict(operations)}, f, indent=2)
+
+
+_known_request_classes: Optional[Dict[Tuple[str, str], Dict[str, str]]] = None
+
+
+def _request_classes(method: str, path: str) -> Dict[str, str]:
+    """Return the "retry" and "cache" classes of a generated request.
+
+    Endpoints already in stedi_request.REQUESTS keep the classes recorded
+    there (a POST eligibility check is "safe" and cached, for instance).
+    Other endpoints fall back to _retry_class() and are not cached.
+    """
+    global _known_request_classes
+    if _known_request_classes is None:
+        import stedi_request
+
+        _known_request_classes = {
+            (entry["method"], entry["path"]): {key: entry[key] for key in ("retry", "cache") if key in entry}
+            for entry in stedi_request.REQUESTS.values()
+        }
+    known = _known_request_classes.get((method.upper(), path))
+    if known and "retry" in known:
+        return dict(known)
+    return {"retry": _retry_class(method, path)}
+
+
+def _retry_class(method: str, path: str) -> str:
+    """Guess the stedi_retry class of an endpoint stedi_request does not know yet."""
+    if method.upper() in ("GET", "HEAD", "OPTIONS"):
+        return "safe"
+    if "submission" in path:
+        return "idempotency-key"
+    return "unsafe"
+
+
+def _write_if_changed(path: str, content: str) -> None:
+    """Write a text file unless it already has exactly this content."""
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return
+    except OSError:
+        pass
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _json_hash(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def _find_refs(value: Any) -> List[str]:
+    """Return every $ref string inside a JSON-shaped value."""
+    refs = []
+    pending = [value]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, dict):
+            ref = item.get("$ref")
+            if isinstance(ref, str):
+                refs.append(ref)
+            pending.extend(item.values())
+        elif isinstance(item, list):
+            pending.extend(item)
+    return refs
+
 
 class SampleRequestGenerator:
     def __init__(
@@ -32,12 +206,26 @@ class SampleRequestGenerator:
         self.spec: Dict[str, Any] = {}
         self.base_url = ""
         self.schemas: Dict[str, Any] = {}
-        
-    def load_spec(self) -> None:
-        """Load the OpenAPI specification from the URL."""
-        print(f"Loading OpenAPI spec from {self.openapi_url}...")
-        with urlopen(self.openapi_url, timeout=30) as response:
-            self.spec = json.load(response)
+        # $ref string -> resolved schema, and memoized samples of referenced schemas
+        self._resolved_refs: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._ref_samples: Dict[Any, Any] = {}
+        # $refs whose sample is being generated, to cut self-referential schemas
+        self._resolving: Set[str] = set()
+        # $ref -> (content hash, directly referenced $refs), for operation_hash()
+        self._ref_hashes: Dict[str, Tuple[str, List[str]]] = {}
+        
+    def load_spec(self, cache_dir: Optional[str] = DEFAULT_SPEC_CACHE_DIR, offline: bool = False) -> str:
+        """Load the OpenAPI specification from the URL, or the spec cache when it is unchanged.
+
+        Returns where the spec came from, as reported by fetch_spec().
+        """
+        spec, status = fetch_spec(self.openapi_url, cache_dir, offline)
+        self.set_spec(spec)
+        return status
+
+    def set_spec(self, spec: Dict[str, Any]) -> None:
+        """Use an already loaded OpenAPI specification."""
+        self.spec = spec
         
         # Extract base URL
         if "servers" in self.spec and len(self.spec["servers"]) > 0:
@@ -46,8 +234,58 @@ class SampleRequestGenerator:
         # Extract schemas
         if "components" in self.spec and "schemas" in self.spec["components"]:
             self.schemas = self.spec["components"]["schemas"]
-        
-        print(f"Loaded spec with {len(self.spec.get('paths', {}))} paths")
+
+        self._resolved_refs.clear()
+        self._ref_samples.clear()
+        self._ref_hashes.clear()
+
+    def resolve_ref(self, ref: str) -> Optional[Dict[str, Any]]:
+        """Return the schema a $ref points to, or None if it cannot be found.
+
+        Local JSON pointers ("#/components/schemas/Claim") are followed
+        through the spec; anything else is looked up by its last segment in
+        the component schemas. Results are cached per $ref.
+        """
+        if ref in self._resolved_refs:
+            return self._resolved_refs[ref]
+
+        target: Any = None
+        if ref.startswith("#/"):
+            target = self.spec
+            for part in ref[2:].split("/"):
+                part = part.replace("~1", "/").replace("~0", "~")
+                if not isinstance(target, dict) or part not in target:
+                    target = None
+                    break
+                target = target[part]
+        if not isinstance(target, dict):
+            target = self.schemas.get(ref.split("/")[-1])
+
+        self._resolved_refs[ref] = target
+        return target
+
+    def _generate_ref_sample(self, ref: str, prop_name: str) -> Any:
+        """Generate the sample of a referenced schema once and reuse it for every later reference.
+
+        The same dict or list is returned each time, so generated samples
+        are shared between requests and must not be modified in place.
+        """
+        schema = self.resolve_ref(ref)
+        if schema is None:
+            return None
+
+        # Property names only pick string samples, so objects share one sample.
+        key = ref if schema.get("type") == "object" else (ref, prop_name)
+        if key not in self._ref_samples:
+            if ref in self._resolving:
+                # Self-referential schema: stop here instead of recursing forever.
+                return None
+            self._resolving.add(ref)
+            try:
+                self._ref_samples[key] = self.generate_sample_value(schema, prop_name)
+            finally:
+                self._resolving.discard(ref)
+        return self._ref_samples[key]
 
     def get_example_value(self, source: Dict[str, Any]) -> Optional[Any]:
         """Return an OpenAPI example value from an object, if one is available."""
@@ -71,9 +309,7 @@ class SampleRequestGenerator:
         if "type" not in schema:
             # Check for $ref
             if "$ref" in schema:
-                ref_path = schema["$ref"].split("/")[-1]
-                if ref_path in self.schemas:
-                    return self.generate_sample_value(self.schemas[ref_path], prop_name)
+                return self._generate_ref_sample(schema["$ref"], prop_name)
             return None
         
         schema_type = schema["type"]
@@ -199,6 +435,7 @@ class SampleRequestGenerator:
             "spec": self.spec_name,
             "method": method.upper(),
             "path": path,
+            "path_template": path,
             "summary": operation.get("summary", ""),
             "description": operation.get("description", ""),
             "base_url": self.base_url,
@@ -240,21 +477,73 @@ class SampleRequestGenerator:
         
         return request_info
     
+    def iter_operations(self) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """Yield (path, method, operation) for every operation in the spec."""
+        for path, path_item in self.spec.get("paths", {}).items():
+            for method in ["get", "post", "put", "patch", "delete"]:
+                if method in path_item:
+                    yield path, method, path_item[method]
+
+    def iter_all_requests(self) -> Iterator[Dict[str, Any]]:
+        """Generate sample requests for all endpoints one at a time."""
+        for path, method, operation in self.iter_operations():
+            yield self.generate_sample_request(path, method, operation)
+
     def generate_all_requests(self) -> List[Dict[str, Any]]:
         """Generate sample requests for all endpoints."""
+        return list(self.iter_all_requests())
+
+    def operation_key(self, path: str, method: str) -> str:
+        """Return the manifest key of an operation."""
+        return f"{self.spec_name} {method.upper()} {path}"
+
+    def _ref_hash(self, ref: str) -> Tuple[str, List[str]]:
+        """Return the content hash of a referenced schema and the $refs it uses directly."""
+        if ref not in self._ref_hashes:
+            schema = self.resolve_ref(ref)
+            self._ref_hashes[ref] = (_json_hash(schema), _find_refs(schema))
+        return self._ref_hashes[ref]
+
+    def operation_hash(self, path: str, method: str, operation: Dict[str, Any]) -> str:
+        """Hash an operation together with every schema its parameters and body refer to."""
+        refs: Set[str] = set()
+        pending = _find_refs(operation)
+        while pending:
+            ref = pending.pop()
+            if ref not in refs:
+                refs.add(ref)
+                pending.extend(self._ref_hash(ref)[1])
+        return _json_hash([
+            self.base_url,
+            path,
+            method,
+            operation,
+            [(ref, self._ref_hash(ref)[0]) for ref in sorted(refs)],
+        ])
+
+    def generate_changed_requests(
+        self, previous: Dict[str, Tuple[str, Dict[str, Any]]]
+    ) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]], int]:
+        """Generate requests only for operations whose hash differs from ``previous``.
+
+        ``previous`` maps operation keys to their (hash, request) from the
+        last run, as returned by load_manifest(). Returns the requests, their
+        (key, hash) pairs for the new manifest and how many were regenerated.
+        """
         requests_list = []
-        
-        if "paths" not in self.spec:
-            return requests_list
-        
-        for path, path_item in self.spec["paths"].items():
-            for method in ["get", "post", "put", "patch", "delete"]:
-                if method in path_item:
-                    operation = path_item[method]
-                    sample_request = self.generate_sample_request(path, method, operation)
-                    requests_list.append(sample_request)
-        
-        return requests_list
+        operations = []
+        regenerated = 0
+        for path, method, operation in self.iter_operations():
+            key = self.operation_key(path, method)
+            operation_hash = self.operation_hash(path, method, operation)
+            old_hash, old_request = previous.get(key, (None, None))
+            if old_hash == operation_hash:
+                requests_list.append(old_request)
+            else:
+                requests_list.append(self.generate_sample_request(path, method, operation))
+                regenerated += 1
+            operations.append((key, operation_hash))
+        return requests_list, operations, regenerated
     
     def print_request(self, request_info: Dict[str, Any], format_type: str = "python") -> None:
         """Print a formatted request."""
@@ -314,6 +603,78 @@ class SampleRequestGenerator:
             json.dump(requests_list, f, indent=2)
         print(f"\nSaved {len(requests_list)} sample requests to {filename}")
     
+    def save_to_ndjson(self, requests_iter: Iterable[Dict[str, Any]], filename: str = DEFAULT_NDJSON_OUTPUT) -> int:
+        """Write requests as they are produced, one compact JSON object per line.
+
+        Nothing but the current request is held in memory. The file is
+        replaced only once every request has been written.
+        """
+        count = 0
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "w") as f:
+            for request_info in requests_iter:
+                f.write(json.dumps(request_info, separators=(",", ":")))
+                f.write("\n")
+                count += 1
+        os.replace(tmp_filename, filename)
+        print(f"\nSaved {count} sample requests to {filename}")
+        return count
+
+    def generate_registry_module(self, requests_list: List[Dict[str, Any]], filename: str = DEFAULT_REGISTRY_OUTPUT) -> None:
+        """Write a registry module that stedi_request.load_registry() turns into REQUESTS entries.
+
+        The module holds only a small metadata dict per request, so importing
+        it stays cheap however large the payloads are. Each JSON body is
+        written to its own fixture file, read when the payload is first used.
+        Fixtures whose content did not change are left untouched.
+        """
+        fixtures_name = f"{os.path.splitext(os.path.basename(filename))[0]}_fixtures"
+        fixtures_dir = os.path.join(os.path.dirname(filename), fixtures_name)
+        os.makedirs(fixtures_dir, exist_ok=True)
+
+        entries = []
+        fixtures = set()
+        for request_id, req in enumerate(requests_list, 1):
+            path = req.get("path_template", req["path"])
+            entry: Dict[str, Any] = {
+                "method": req["method"],
+                "path": path,
+                "description": req.get("summary") or req.get("description", "").split("\n")[0],
+                **_request_classes(req["method"], path),
+            }
+            if req.get("base_url"):
+                entry["base_url"] = req["base_url"]
+            if req.get("path_params"):
+                entry["path_params"] = {name: str(value) for name, value in req["path_params"].items()}
+            if req.get("query_params"):
+                entry["params"] = req["query_params"]
+            if req.get("body") is not None:
+                fixture = f"request_{request_id}.json"
+                _write_if_changed(os.path.join(fixtures_dir, fixture), json.dumps(req["body"], indent=2) + "\n")
+                entry["payload_file"] = fixture
+                fixtures.add(fixture)
+            entries.append(f"    {request_id}: {entry!r},\n")
+
+        for name in os.listdir(fixtures_dir):
+            if name.startswith("request_") and name.endswith(".json") and name not in fixtures:
+                os.remove(os.path.join(fixtures_dir, name))
+
+        _write_if_changed(filename, "".join([
+            '"""\n',
+            'Request registry generated from the Stedi OpenAPI specifications\n',
+            '\n',
+            f'Load it with stedi_request.load_registry("{os.path.basename(filename)}"). Sample\n',
+            f'payloads are JSON files in {fixtures_name}/, read on first use.\n',
+            '"""\n',
+            '\n',
+            f'FIXTURES_DIR = {fixtures_name!r}\n',
+            '\n',
+            'REQUESTS = {\n',
+            *entries,
+            '}\n',
+        ]))
+        print(f"Generated request registry with {len(requests_list)} requests: {filename} ({len(fixtures)} payload fixtures)")
+
     def generate_python_script(self, requests_list: List[Dict[str, Any]], filename: str = "sample_requests.py") -> None:
         """Generate a Python script with all sample requests."""
         with open(filename, "w") as f:
@@ -385,6 +746,46 @@ def main():
         action="store_true",
         help="Only write the JSON output file.",
     )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_SPEC_CACHE_DIR,
+        help=f"Directory for downloaded specs, revalidated by ETag/Last-Modified. Default: {DEFAULT_SPEC_CACHE_DIR}.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always download the specs and do not keep copies.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use the cached specs without contacting the network.",
+    )
+    parser.add_argument(
+        "--output-registry",
+        default=DEFAULT_REGISTRY_OUTPUT,
+        help=f"Registry module for stedi_request.load_registry(), with payloads in a fixtures directory next to it. Default: {DEFAULT_REGISTRY_OUTPUT}.",
+    )
+    parser.add_argument(
+        "--skip-registry",
+        action="store_true",
+        help="Do not write the registry module.",
+    )
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="Stream requests to --output-ndjson as they are generated instead of writing the JSON and Python files.",
+    )
+    parser.add_argument(
+        "--output-ndjson",
+        default=DEFAULT_NDJSON_OUTPUT,
+        help=f"NDJSON output file for --ndjson. Default: {DEFAULT_NDJSON_OUTPUT}.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only regenerate operations whose hash changed since the last run, tracked in a manifest next to the JSON output.",
+    )
     parser.add_argument(
         "--list-specs",
         action="store_true",
@@ -408,18 +809,60 @@ def main():
     )
     requests_list: List[Dict[str, Any]] = []
 
+    cache_dir = None if args.no_cache else args.cache_dir
+    if args.offline and not cache_dir:
+        parser.error("--offline needs the spec cache; do not combine it with --no-cache")
+    if args.ndjson and args.incremental:
+        parser.error("--incremental works on the JSON output and cannot be used with --ndjson")
+
     try:
-        for spec_name, spec_url in selected_specs:
-            generator = SampleRequestGenerator(spec_url, spec_name=spec_name)
+        generators = [SampleRequestGenerator(spec_url, spec_name=spec_name) for spec_name, spec_url in selected_specs]
 
-            # Load the OpenAPI spec
-            generator.load_spec()
+        # Load the OpenAPI specs concurrently; each is one conditional request when cached
+        print(f"Loading {len(generators)} OpenAPI spec(s)...")
+        with ThreadPoolExecutor(max_workers=len(generators)) as executor:
+            statuses = list(executor.map(lambda generator: generator.load_spec(cache_dir, args.offline), generators))
 
-            # Generate all sample requests
-            print(f"\nGenerating sample requests for {spec_name}...")
-            requests_list.extend(generator.generate_all_requests())
+        for generator, status in zip(generators, statuses):
+            print(f"Loaded {generator.spec_name} spec ({status}) with {len(generator.spec.get('paths', {}))} paths")
 
-        print(f"\nGenerated {len(requests_list)} sample requests")
+        if args.ndjson:
+            # One request in memory at a time, whatever the size of the specs
+            generators[0].save_to_ndjson(
+                (request_info for generator in generators for request_info in generator.iter_all_requests()),
+                args.output_ndjson,
+            )
+            print("\nDone!")
+            return
+
+        previous = load_manifest(args.output_json) if args.incremental else {}
+        operations: List[Tuple[str, str]] = []
+        regenerated = 0
+        for generator in generators:
+            # Generate all sample requests, or only the changed ones
+            print(f"\nGenerating sample requests for {generator.spec_name}...")
+            if args.incremental:
+                spec_requests, spec_operations, spec_regenerated = generator.generate_changed_requests(previous)
+                requests_list.extend(spec_requests)
+                operations.extend(spec_operations)
+                regenerated += spec_regenerated
+            else:
+                requests_list.extend(generator.generate_all_requests())
+
+        if args.incremental:
+            removed = len(set(previous) - {key for key, _ in operations})
+            print(
+                f"\nRegenerated {regenerated} of {len(requests_list)} sample requests "
+                f"({len(requests_list) - regenerated} unchanged, {removed} removed)"
+            )
+            outputs_current = (args.skip_python or os.path.exists(args.output_python)) and (
+                args.skip_registry or os.path.exists(args.output_registry)
+            )
+            if not regenerated and not removed and len(previous) == len(operations) and outputs_current:
+                print(f"Nothing changed; {args.output_json} is up to date")
+                return
+        else:
+            print(f"\nGenerated {len(requests_list)} sample requests")
         
         # Print first few requests as examples
         print("\n" + "="*80)
@@ -434,8 +877,12 @@ def main():
         
         # Save to files
         generator.save_to_file(requests_list, args.output_json)
+        if args.incremental:
+            save_manifest(args.output_json, operations)
         if not args.skip_python:
             generator.generate_python_script(requests_list, args.output_python)
+        if not args.skip_registry:
+            generator.generate_registry_module(requests_list, args.output_registry)
         
         print("\nDone!")
         
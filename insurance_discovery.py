@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Concurrent insurance discovery checks with a single polling scheduler
+
+Insurance discovery is two steps: request_16 submits a check and, unless the
+answer is ready right away, returns a discoveryId that request_17 polls until
+the check is no longer pending. DiscoveryJobs runs both steps for many checks
+on one asyncio scheduler: a heap of due submissions and polls, a bounded
+number of requests in flight and per-job exponential backoff with jitter.
+No job has a sleeping thread or task of its own.
+
+Finished jobs are delivered to an optional callback and through the
+results() async iterator.
+"""
+
+import argparse
+import asyncio
+import heapq
+import inspect
+import itertools
+import json
+import random
+import sys
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional, TextIO, Tuple, Union
+
+import stedi_async
+import stedi_ratelimit
+import stedi_request
+import stedi_retry
+from bulk_eligibility import normalize_date, read_roster
+
+SUBMIT_REQUEST_ID = 16
+RESULT_REQUEST_ID = 17
+
+PENDING_STATUSES = ("PENDING", "IN_PROGRESS")
+DEFAULT_INITIAL_DELAY = 2.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_BACKOFF = 1.5
+DEFAULT_TIMEOUT = 1800.0
+JITTER = 0.2
+
+REQUIRED_COLUMNS = ["firstName", "lastName", "dateOfBirth"]
+ADDRESS_COLUMNS = ["address1", "address2", "city", "state", "postalCode"]
+
+
+class DiscoveryJobs:
+    """Submit insurance discovery checks and poll the pending ones until they finish.
+
+    Use inside an AsyncStediClient::
+
+        async with stedi_async.AsyncStediClient(concurrency=20) as client:
+            jobs = DiscoveryJobs(client)
+            for row_number, payload in payloads:
+                jobs.submit(payload, key=row_number)
+            async for job in jobs.results():
+                ...
+
+    Each finished job is a dict with the caller's ``key``, the
+    ``discoveryId``, the final ``status`` (the check's own status, or
+    ``ERROR`` / ``TIMEOUT``), the number of ``polls``, ``elapsed`` seconds
+    since submission, the last response ``body`` and an ``error`` message.
+    """
+
+    def __init__(
+        self,
+        client: stedi_async.AsyncStediClient,
+        on_result: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        initial_delay: float = DEFAULT_INITIAL_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        backoff: float = DEFAULT_BACKOFF,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.client = client
+        self.on_result = on_result
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+
+        # (due time, sequence, action, job); the sequence keeps equal due times in order.
+        self._due: List[Tuple[float, int, str, Dict[str, Any]]] = []
+        self._sequence = itertools.count()
+        self._outstanding = 0
+        self._wakeup = asyncio.Event()
+        self._finished: asyncio.Queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(client.concurrency)
+        self._running: set = set()
+
+    @property
+    def pending(self) -> int:
+        """Jobs submitted or tracked that have not finished yet."""
+        return self._outstanding
+
+    def submit(self, payload: Dict[str, Any], key: Hashable = None) -> None:
+        """Queue a request_16 discovery check."""
+        self._schedule(time.monotonic(), "submit", self._new_job(key, payload=payload))
+
+    def track(self, discovery_id: str, key: Hashable = None) -> None:
+        """Poll a check that was submitted earlier, e.g. one that timed out in a previous run."""
+        job = self._new_job(key, discovery_id=discovery_id)
+        self._schedule(time.monotonic(), "poll", job)
+
+    def _new_job(self, key: Hashable, payload: Optional[Dict[str, Any]] = None, discovery_id: Optional[str] = None) -> Dict[str, Any]:
+        self._outstanding += 1
+        return {
+            "key": key,
+            "discoveryId": discovery_id,
+            "status": None,
+            "polls": 0,
+            "attempts": 0,
+            "payload": payload,
+            # Kept for every submission attempt, so a resubmitted check is not run twice.
+            "idempotency_key": str(uuid.uuid4()),
+            "started": time.monotonic(),
+        }
+
+    def _schedule(self, due: float, action: str, job: Dict[str, Any]) -> None:
+        heapq.heappush(self._due, (due, next(self._sequence), action, job))
+        self._wakeup.set()
+
+    def _next_delay(self, job: Dict[str, Any], retry_after: Optional[float] = None) -> float:
+        # Every submission or poll so far, failed ones included, lengthens the wait.
+        delay = min(self.max_delay, self.initial_delay * self.backoff ** max(0, job["attempts"] - 1))
+        delay *= random.uniform(1 - JITTER, 1 + JITTER)
+        return max(delay, retry_after or 0.0)
+
+    async def results(self) -> AsyncIterator[Dict[str, Any]]:
+        """Run the scheduler and yield each job as it finishes, until no job is left."""
+        scheduler = asyncio.ensure_future(self._run_scheduler())
+        try:
+            while True:
+                job = await self._finished.get()
+                if job is None:
+                    break
+                yield job
+            await scheduler
+        finally:
+            scheduler.cancel()
+
+    async def run(self) -> List[Dict[str, Any]]:
+        """Run every queued job to completion and return them in the order they finished."""
+        return [job async for job in self.results()]
+
+    async def _run_scheduler(self) -> None:
+        try:
+            while self._outstanding:
+                now = time.monotonic()
+                while self._due and self._due[0][0] <= now:
+                    _, _, action, job = heapq.heappop(self._due)
+                    await self._slots.acquire()
+                    task = asyncio.ensure_future(self._run_action(action, job))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+
+                self._wakeup.clear()
+                timeout = self._due[0][0] - time.monotonic() if self._due else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in self._running:
+                task.cancel()
+            self._finished.put_nowait(None)
+
+    async def _run_action(self, action: str, job: Dict[str, Any]) -> None:
+        job["attempts"] += 1
+        try:
+            if action == "submit":
+                call = stedi_request.build_request(
+                    SUBMIT_REQUEST_ID,
+                    payload=job["payload"],
+                    headers={stedi_retry.IDEMPOTENCY_HEADER: job["idempotency_key"]},
+                )
+            else:
+                job["polls"] += 1
+                call = stedi_request.build_request(RESULT_REQUEST_ID, path_params={"discoveryId": job["discoveryId"]})
+            try:
+                response = await self.client.send(call["method"], call["url"], **call["kwargs"])
+            except Exception as e:
+                await self._retry_or_finish(job, action, str(e))
+                return
+            await self._handle_response(action, job, response)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
+
+    async def _handle_response(self, action: str, job: Dict[str, Any], response: stedi_async.AsyncResponse) -> None:
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        job["body"] = body
+
+        if response.status_code == 429 or response.status_code >= 500:
+            # stedi_async has already retried; keep the job and try again later.
+            await self._retry_or_finish(job, action, f"HTTP {response.status_code}", response)
+            return
+        if response.status_code >= 400 or not isinstance(body, dict):
+            job["status"] = "ERROR"
+            job["error"] = f"HTTP {response.status_code}"
+            await self._finish(job)
+            return
+
+        job["discoveryId"] = body.get("discoveryId") or job["discoveryId"]
+        job["status"] = body.get("status")
+        if job["status"] not in PENDING_STATUSES:
+            await self._finish(job)
+        elif not job["discoveryId"]:
+            job["status"] = "ERROR"
+            job["error"] = "Pending check without a discoveryId"
+            await self._finish(job)
+        else:
+            await self._retry_or_finish(job, "poll", None, response)
+
+    async def _retry_or_finish(
+        self,
+        job: Dict[str, Any],
+        action: str,
+        error: Optional[str],
+        response: Optional[stedi_async.AsyncResponse] = None,
+    ) -> None:
+        now = time.monotonic()
+        deadline = job["started"] + self.timeout
+        if now >= deadline:
+            job["status"] = "TIMEOUT" if job["status"] in PENDING_STATUSES else "ERROR"
+            job["error"] = error or f"Still pending after {self.timeout:g}s"
+            await self._finish(job)
+            return
+        retry_after = stedi_ratelimit.parse_retry_after(response.headers.get("Retry-After")) if response else None
+        # The last poll lands on the deadline rather than past it.
+        due = min(now + self._next_delay(job, retry_after), deadline)
+        self._schedule(due, action, job)
+
+    async def _finish(self, job: Dict[str, Any]) -> None:
+        job.pop("payload", None)
+        job.pop("idempotency_key", None)
+        job.pop("attempts", None)
+        job["elapsed"] = round(time.monotonic() - job.pop("started"), 3)
+        job.setdefault("error", None)
+        job.setdefault("body", None)
+        self._outstanding -= 1
+        if self.on_result is not None:
+            outcome = self.on_result(job)
+            if inspect.isawaitable(outcome):
+                await outcome
+        self._finished.put_nowait(job)
+
+
+def build_discovery_payload(row: Dict[str, Any], template: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill the request_16 payload template with one roster row."""
+    row = {key: value for key, value in row.items() if value not in (None, "")}
+    missing = [column for column in REQUIRED_COLUMNS if column not in row]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    payload = json.loads(json.dumps(template))
+    subscriber = {
+        "firstName": row["firstName"],
+        "lastName": row["lastName"],
+        "dateOfBirth": normalize_date(row["dateOfBirth"]),
+    }
+    for column in ("middleName", "gender", "ssn", "memberId"):
+        if column in row:
+            subscriber[column] = row[column]
+    address = {column: row[column] for column in ADDRESS_COLUMNS if column in row}
+    if address:
+        subscriber["address"] = address
+    payload["subscriber"] = subscriber
+
+    if "dateOfService" in row:
+        date_of_service = normalize_date(row["dateOfService"])
+        payload["encounter"] = {"beginningDateOfService": date_of_service, "endDateOfService": date_of_service}
+    return payload
+
+
+def format_result(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the JSONL record written for one finished job."""
+    return {
+        "row": job["key"],
+        "discoveryId": job["discoveryId"],
+        "status": job["status"],
+        "polls": job["polls"],
+        "elapsed_time": job["elapsed"],
+        "error": job["error"],
+        "body": job["body"],
+    }
+
+
+async def run_discovery(
+    roster: Iterator[Union[Dict[str, Any], ValueError]],
+    output: TextIO,
+    discovery_ids: List[str],
+    concurrency: int = stedi_async.DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Dict[str, int]:
+    """Submit a check per roster row, poll them and the given discoveryIds, and stream results to ``output``.
+
+    Returns counts of finished jobs by final status.
+    """
+    counts: Dict[str, int] = {}
+    template = stedi_request.get_default_payload(SUBMIT_REQUEST_ID)
+
+    def write(record: Dict[str, Any]) -> None:
+        output.write(json.dumps(record, separators=(",", ":")) + "\n")
+        output.flush()
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+
+    async with stedi_async.AsyncStediClient(concurrency=concurrency) as client:
+        jobs = DiscoveryJobs(client, on_result=lambda job: write(format_result(job)), timeout=timeout)
+        for row_number, row in enumerate(roster, start=1):
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                jobs.submit(build_discovery_payload(row, template), key=row_number)
+            except ValueError as e:
+                write({"row": row_number, "discoveryId": None, "status": "ERROR", "error": str(e)})
+        for discovery_id in discovery_ids:
+            jobs.track(discovery_id, key=discovery_id)
+        await jobs.run()
+    return counts
+
+
+def read_discovery_ids(path: str) -> List[str]:
+    """Read discoveryIds, one per line, or from the discoveryId field of a results JSONL file."""
+    discovery_ids = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                if record.get("status") in PENDING_STATUSES + ("TIMEOUT",) and record.get("discoveryId"):
+                    discovery_ids.append(record["discoveryId"])
+            else:
+                discovery_ids.append(line)
+    return discovery_ids
+
+
+def main():
+    """Main entry point for the insurance discovery CLI."""
+    parser = argparse.ArgumentParser(
+        description="Run insurance discovery checks for every patient in a roster file and poll them to completion.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+Roster columns (CSV header or JSONL keys):
+  required: {', '.join(REQUIRED_COLUMNS)}
+  optional: middleName, gender, ssn, memberId, {', '.join(ADDRESS_COLUMNS)}, dateOfService
+
+Examples:
+  %(prog)s self_pay.csv --output discovery.jsonl
+  %(prog)s --discovery-ids discovery.jsonl --output discovery_retry.jsonl   # poll checks that timed out
+        """
+    )
+    parser.add_argument("roster", nargs="?", help="Roster file (.csv or .jsonl)")
+    parser.add_argument(
+        "--discovery-ids",
+        metavar="PATH",
+        help="Also poll these discoveryIds: one per line, or a results file whose TIMEOUT/PENDING rows are polled again"
+    )
+    parser.add_argument(
+        "--output", "-o",
+        default="discovery_results.jsonl",
+        help="JSONL file results are appended to (default: discovery_results.jsonl)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=stedi_async.DEFAULT_CONCURRENCY,
+        metavar="N",
+        help=f"Maximum submissions and polls in flight (default: {stedi_async.DEFAULT_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        metavar="RPS",
+        help=f"Client-side limit on submissions and polls per second (default: {stedi_ratelimit.DEFAULT_RATE:g} or the endpoint's rate_limit)"
+    )
+    parser.add_argument("--no-rate-limit", action="store_true", help="Turn off the client-side rate limiter")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        metavar="SECONDS",
+        help=f"Give up on a check still pending after this long (default: {DEFAULT_TIMEOUT:.0f})"
+    )
+    parser.add_argument(
+        "--api-key",
+        help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
+    )
+    args = parser.parse_args()
+
+    if not args.roster and not args.discovery_ids:
+        parser.error("give a roster file, --discovery-ids, or both")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.api_key:
+        stedi_request.set_api_key(args.api_key)
+    stedi_ratelimit.limiter.enabled = not args.no_rate_limit
+    # Let --concurrency requests actually run at once instead of the default cap.
+    for request_id in (SUBMIT_REQUEST_ID, RESULT_REQUEST_ID):
+        stedi_ratelimit.limiter.override(stedi_request.REQUESTS[request_id]["path"], args.rate, args.concurrency)
+
+    discovery_ids = read_discovery_ids(args.discovery_ids) if args.discovery_ids else []
+    roster = read_roster(args.roster) if args.roster else iter(())
+    start_time = time.time()
+    with open(args.output, "a") as output:
+        counts = asyncio.run(run_discovery(roster, output, discovery_ids, args.concurrency, args.timeout))
+    elapsed_time = time.time() - start_time
+
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items(), key=lambda item: str(item[0])))
+    print(f"Finished {sum(counts.values())} discovery checks in {elapsed_time:.1f}s: {summary or 'none'}. Results: {args.output}")
+    if any(status in ("ERROR", "TIMEOUT") for status in counts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
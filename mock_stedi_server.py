@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Stedi healthcare and payers APIs
+
+Answers every path in stedi_request.REQUESTS with a canned response of the
+right content type (JSON, CSV or PDF) after a delay drawn from a
+configurable latency distribution, and injects errors (429, 5xx or dropped
+connections) at configurable rates. Insurance discovery checks stay PENDING
+for a configurable time before they are COMPLETE, 835 reports are a
+small JSON ERA with two claim payments, and /polling/transactions pages
+through a fixed number of transaction events. Used by benchmark.py; it can also be
+run on its own and targeted with stedi_request.set_base_urls().
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import stedi_ratelimit
+import stedi_request
+
+DEFAULT_LATENCY = "lognormal:0.05,0.5"
+DEFAULT_DISCOVERY_DELAY = 0.0
+
+# Request paths whose responses are binary or CSV rather than JSON.
+PDF_PATHS = {"/export/pdf", "/export/{transactionId}/1500/pdf", "/electronic-remittance-advice/{transactionId}/pdf"}
+CSV_PATHS = {"/payers/csv"}
+DISCOVERY_SUBMIT_PATH = "/insurance-discovery/check/v1"
+DISCOVERY_RESULT_PATH = "/insurance-discovery/check/v1/{discoveryId}"
+ERA_REPORT_PATH = "/change/medicalnetwork/reports/v2/{transactionId}/835"
+EVENTS_PATH = "/polling/transactions"
+DEFAULT_EVENTS = 250
+PDF_BODY = b"%PDF-1.4\n% mock_stedi_server\n" + b"0" * 4096 + b"\n%%EOF\n"
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Return a function drawing one delay in seconds from a distribution spec.
+
+    Specs: ``fixed:S``, ``uniform:LOW,HIGH``, ``exponential:MEAN`` and
+    ``lognormal:MEDIAN,SIGMA``. All values are in seconds.
+    """
+    kind, _, args = spec.partition(":")
+    try:
+        values = [float(value) for value in args.split(",")] if args else []
+    except ValueError:
+        raise ValueError(f"Invalid latency spec {spec!r}") from None
+
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "exponential" and len(values) == 1:
+        return lambda: random.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0]) if values[0] > 0 else float("-inf")
+        return lambda: random.lognormvariate(mu, values[1]) if values[0] > 0 else 0.0
+    raise ValueError(
+        f"Invalid latency spec {spec!r}; expected fixed:S, uniform:LOW,HIGH, exponential:MEAN or lognormal:MEDIAN,SIGMA"
+    )
+
+
+def parse_errors(spec: Optional[str]) -> List[Tuple[str, float]]:
+    """Parse ``KIND:RATE,...`` error injection, where KIND is an HTTP status code or ``reset``."""
+    errors: List[Tuple[str, float]] = []
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        kind, _, rate = part.strip().partition(":")
+        if kind != "reset" and not (kind.isdigit() and 400 <= int(kind) < 600):
+            raise ValueError(f"Invalid error kind {kind!r}; expected an HTTP status code or 'reset'")
+        errors.append((kind, float(rate)))
+    if sum(rate for _, rate in errors) > 1:
+        raise ValueError("Error rates add up to more than 1")
+    return errors
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under benchmark concurrency.
+    request_queue_size = 256
+
+
+def _era_report_body() -> Dict:
+    """A small JSON 835 report with two claim payments, shaped like Stedi's."""
+    def claim(number: str, charge: str, paid: str) -> Dict:
+        return {
+            "claimPaymentInfo": {
+                "patientControlNumber": number,
+                "claimStatusCode": "1",
+                "totalClaimChargeAmount": charge,
+                "claimPaymentAmount": paid,
+                "patientResponsibilityAmount": "20",
+                "claimFilingIndicatorCode": "12",
+                "payerClaimControlNumber": f"PCN{number}",
+            },
+            "patientName": {"lastName": "DOE", "firstName": "JOHN", "memberId": "M12345"},
+            "claimAdjustments": [{
+                "claimAdjustmentGroupCode": "PR",
+                "adjustmentReasonCode1": "1",
+                "adjustmentAmount1": "20",
+            }],
+            "serviceLines": [{
+                "servicePaymentInformation": {
+                    "productOrServiceIDQualifier": "HC",
+                    "adjudicatedProcedureCode": "99213",
+                    "adjudicatedProcedureModifierCodes": ["25"],
+                    "lineItemChargeAmount": charge,
+                    "lineItemProviderPaymentAmount": paid,
+                    "unitsOfServicePaidCount": "1",
+                },
+                "serviceDate": "20240115",
+                "serviceAdjustments": [{
+                    "claimAdjustmentGroupCode": "CO",
+                    "adjustmentReasonCode1": "45",
+                    "adjustmentAmount1": "30",
+                }],
+            }],
+        }
+
+    return {
+        "transactions": [{
+            "financialInformation": {
+                "totalActualProviderPaymentAmount": "180",
+                "paymentMethodCode": "ACH",
+                "checkIssueOrEFTEffectiveDate": "20240201",
+            },
+            "paymentAndRemitReassociationDetails": {"checkOrEFTTraceNumber": "12345"},
+            "payer": {"name": "MOCK PAYER"},
+            "payee": {"name": "MOCK CLINIC"},
+            "detailInfo": [{"paymentInfo": [claim("1001", "150", "100"), claim("1002", "130", "80")]}],
+        }],
+    }
+
+
+class MockStediServer:
+    """Threaded HTTP server answering the REQUESTS paths on 127.0.0.1."""
+
+    def __init__(
+        self,
+        latency: str = DEFAULT_LATENCY,
+        errors: Optional[str] = None,
+        response_bytes: int = 0,
+        port: int = 0,
+        discovery_delay: float = DEFAULT_DISCOVERY_DELAY,
+        events: int = DEFAULT_EVENTS,
+    ):
+        self.sample_latency = parse_latency(latency)
+        self.errors = parse_errors(errors)
+        self.response_bytes = response_bytes
+        self.discovery_delay = discovery_delay
+        self.discoveries: Dict[str, float] = {}
+        # Number of transaction events served; raise it to simulate new transactions.
+        self.events = events
+        self.counts: Dict[str, int] = {}
+        self._counts_lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Serve on a background thread and return the base URL."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-stedi-server", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self) -> None:
+        """Serve on the calling thread until interrupted."""
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, outcome: str) -> None:
+        with self._counts_lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def _pick_error(self) -> Optional[str]:
+        roll = random.random()
+        for kind, rate in self.errors:
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+    def _discovery_body(self, path: str, url: str) -> Dict[str, object]:
+        if path == DISCOVERY_SUBMIT_PATH:
+            discovery_id = str(uuid.uuid4())
+            with self._counts_lock:
+                self.discoveries[discovery_id] = time.monotonic()
+        else:
+            discovery_id = url.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        # Checks this server did not submit, such as the request_17 sample, are already complete.
+        submitted = self.discoveries.get(discovery_id, float("-inf"))
+        if time.monotonic() - submitted < self.discovery_delay:
+            return {"discoveryId": discovery_id, "status": "PENDING"}
+        return {"discoveryId": discovery_id, "status": "COMPLETE", "items": [{"payer": {"name": "Mock Payer"}, "coverage": "ACTIVE"}]}
+
+    def _events_body(self, url: str) -> Dict[str, object]:
+        query = parse_qs(urlsplit(url).query)
+        start = int(query.get("pageToken", ["0"])[0])
+        end = min(self.events, start + int(query.get("pageSize", ["100"])[0]))
+        items = [
+            {
+                "transactionId": f"mock-{index:06d}",
+                "direction": "INBOUND",
+                "x12": {"metadata": {"transaction": {"transactionSetIdentifier": "835" if index % 2 else "277"}}},
+            }
+            for index in range(start, end)
+        ]
+        body: Dict[str, object] = {"items": items}
+        if end < self.events:
+            body["nextPageToken"] = str(end)
+        return body
+
+    def _body_for(self, path: str, method: str, url: str) -> Tuple[str, bytes]:
+        if path in PDF_PATHS:
+            return "application/pdf", PDF_BODY
+        if path in CSV_PATHS:
+            return "text/csv", b"stediId,displayName,primaryPayerId\nQDTRP,Mock Payer,12345\n"
+        body = {"mock": True, "path": path, "method": method, "status": "SUCCESS"}
+        if path in (DISCOVERY_SUBMIT_PATH, DISCOVERY_RESULT_PATH):
+            body = self._discovery_body(path, url)
+        if path == ERA_REPORT_PATH:
+            body = _era_report_body()
+        if path == EVENTS_PATH:
+            body = self._events_body(url)
+        if path == "/payers":
+            body = {"items": [{"stediId": "QDTRP", "displayName": "Mock Payer", "primaryPayerId": "12345"}]}
+        if self.response_bytes:
+            body["padding"] = "x" * self.response_bytes
+        return "application/json", json.dumps(body).encode()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this, Nagle's
+            # algorithm delays the body on reused connections.
+            disable_nagle_algorithm = True
+
+            def _respond(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                path = stedi_ratelimit.limiter.endpoint_for(self.path).path
+                if urlsplit(self.path).path == EVENTS_PATH:
+                    # Served by the core API, so not among the REQUESTS paths.
+                    path = EVENTS_PATH
+
+                time.sleep(server.sample_latency())
+                error = server._pick_error()
+                if error == "reset":
+                    server._count("reset")
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+
+                if path == "*":
+                    status, content_type, body = 404, "application/json", b'{"message": "Not Found"}'
+                elif error:
+                    status, content_type, body = int(error), "application/json", b'{"message": "Injected error"}'
+                else:
+                    status = 200
+                    content_type, body = server._body_for(path, self.command, self.path)
+                server._count(str(status))
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            do_GET = do_POST = do_HEAD = _respond
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+
+def main():
+    """Run the mock server in the foreground."""
+    parser = argparse.ArgumentParser(description="Serve canned responses for every stedi_request.REQUESTS path.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument(
+        "--latency",
+        default=DEFAULT_LATENCY,
+        help=f"Latency distribution: fixed:S, uniform:LOW,HIGH, exponential:MEAN or lognormal:MEDIAN,SIGMA (default: {DEFAULT_LATENCY})"
+    )
+    parser.add_argument("--errors", help="Injected errors as KIND:RATE pairs, e.g. 503:0.01,429:0.02,reset:0.005")
+    parser.add_argument("--response-bytes", type=int, default=0, help="Extra padding added to JSON responses")
+    parser.add_argument(
+        "--discovery-delay",
+        type=float,
+        default=DEFAULT_DISCOVERY_DELAY,
+        metavar="SECONDS",
+        help="How long submitted insurance discovery checks stay PENDING (default: 0)"
+    )
+    args = parser.parse_args()
+
+    try:
+        server = MockStediServer(args.latency, args.errors, args.response_bytes, port=args.port, discovery_delay=args.discovery_delay)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Mock Stedi server on {server.base_url} for {len(stedi_request.REQUESTS)} request paths")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
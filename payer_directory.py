@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Local payer directory built from the Stedi payer list
+
+Downloads the full payer list once with request_19 (GET /payers) and keeps
+an in-process index of it: exact lookup by stediId, primaryPayerId or alias,
+and a trigram + prefix index for name search. A background thread can
+re-download the list periodically and apply only the payers that changed,
+so lookups never wait on a network round trip through request_18/request_21.
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import stedi_client
+import stedi_request
+
+PAYERS_REQUEST_ID = 19
+DEFAULT_REFRESH_INTERVAL = 6 * 60 * 60
+DEFAULT_SEARCH_LIMIT = 10
+
+
+def normalize_name(name: str) -> str:
+    """Lower-case a payer name and collapse punctuation to single spaces."""
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", name.lower()).split())
+
+
+def trigrams(text: str) -> Set[str]:
+    """Return the padded character trigrams of a normalized name."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _payer_names(payer: Dict[str, Any]) -> Set[str]:
+    names = [payer.get("displayName")] + list(payer.get("names") or [])
+    return {normalize_name(name) for name in names if name}
+
+
+def _payer_ids(payer: Dict[str, Any]) -> List[str]:
+    ids = [payer.get("stediId"), payer.get("primaryPayerId")] + list(payer.get("aliases") or [])
+    return [str(payer_id).upper() for payer_id in ids if payer_id]
+
+
+def _payer_hash(payer: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(payer, sort_keys=True).encode()).hexdigest()
+
+
+def fetch_payers() -> List[Dict[str, Any]]:
+    """Download every payer with request_19, following page tokens if the API returns them."""
+    call = stedi_request.build_request(PAYERS_REQUEST_ID)
+    payers: List[Dict[str, Any]] = []
+    params: Dict[str, Any] = dict(call["kwargs"].get("params") or {})
+    while True:
+        response = stedi_client.send(call["method"], call["url"], headers=call["kwargs"]["headers"], params=params)
+        response.raise_for_status()
+        body = response.json()
+        payers.extend(body.get("items", []))
+        next_page_token = body.get("nextPageToken")
+        if not next_page_token:
+            return payers
+        params["pageToken"] = next_page_token
+
+
+class PayerDirectory:
+    """In-process payer index with incremental updates.
+
+    Payers are keyed by stediId. update() compares each payer with the
+    indexed copy and only re-indexes the ones that were added, changed or
+    removed.
+    """
+
+    def __init__(self, payers: Iterable[Dict[str, Any]] = ()):
+        self._payers: Dict[str, Dict[str, Any]] = {}
+        self._hashes: Dict[str, str] = {}
+        self._by_id: Dict[str, Set[str]] = defaultdict(set)
+        self._by_trigram: Dict[str, Set[str]] = defaultdict(set)
+        # Sorted (normalized name, stediId) pairs for prefix search.
+        self._names: List[Tuple[str, str]] = []
+        self._lock = threading.RLock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stop_refresh = threading.Event()
+        self.update(payers)
+
+    def __len__(self) -> int:
+        return len(self._payers)
+
+    def _add(self, stedi_id: str, payer: Dict[str, Any]) -> None:
+        self._payers[stedi_id] = payer
+        self._hashes[stedi_id] = _payer_hash(payer)
+        for payer_id in _payer_ids(payer):
+            self._by_id[payer_id].add(stedi_id)
+        for normalized in _payer_names(payer):
+            bisect.insort(self._names, (normalized, stedi_id))
+            for trigram in trigrams(normalized):
+                self._by_trigram[trigram].add(stedi_id)
+
+    def _remove(self, stedi_id: str) -> None:
+        payer = self._payers.pop(stedi_id)
+        del self._hashes[stedi_id]
+        for payer_id in _payer_ids(payer):
+            self._by_id[payer_id].discard(stedi_id)
+            if not self._by_id[payer_id]:
+                del self._by_id[payer_id]
+        for normalized in _payer_names(payer):
+            index = bisect.bisect_left(self._names, (normalized, stedi_id))
+            if index < len(self._names) and self._names[index] == (normalized, stedi_id):
+                del self._names[index]
+            for trigram in trigrams(normalized):
+                self._by_trigram[trigram].discard(stedi_id)
+                if not self._by_trigram[trigram]:
+                    del self._by_trigram[trigram]
+
+    def update(self, payers: Iterable[Dict[str, Any]], remove_missing: bool = False) -> Dict[str, int]:
+        """Apply a payer list, re-indexing only payers that differ from the indexed copy.
+
+        With ``remove_missing`` the list is treated as complete and payers not
+        in it are dropped. Returns counts of added, changed and removed payers.
+        """
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        with self._lock:
+            seen: Set[str] = set()
+            for payer in payers:
+                stedi_id = payer.get("stediId")
+                if not stedi_id:
+                    continue
+                seen.add(stedi_id)
+                if stedi_id in self._payers:
+                    if self._hashes[stedi_id] == _payer_hash(payer):
+                        continue
+                    self._remove(stedi_id)
+                    counts["changed"] += 1
+                else:
+                    counts["added"] += 1
+                self._add(stedi_id, payer)
+
+            if remove_missing:
+                for stedi_id in set(self._payers) - seen:
+                    self._remove(stedi_id)
+                    counts["removed"] += 1
+        return counts
+
+    def lookup(self, payer_id: str) -> List[Dict[str, Any]]:
+        """Return payers whose stediId, primaryPayerId or alias equals ``payer_id``."""
+        with self._lock:
+            return [self._payers[stedi_id] for stedi_id in sorted(self._by_id.get(payer_id.upper(), ()))]
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Dict[str, Any]]:
+        """Return payers whose names best match ``query``.
+
+        Names starting with the query rank first, followed by the closest
+        trigram matches.
+        """
+        normalized = normalize_name(query)
+        if not normalized:
+            return []
+
+        with self._lock:
+            matches: List[str] = []
+            index = bisect.bisect_left(self._names, (normalized, ""))
+            while index < len(self._names) and self._names[index][0].startswith(normalized) and len(matches) < limit:
+                if self._names[index][1] not in matches:
+                    matches.append(self._names[index][1])
+                index += 1
+
+            if len(matches) < limit:
+                query_trigrams = trigrams(normalized)
+                scores: Dict[str, int] = defaultdict(int)
+                for trigram in query_trigrams:
+                    for stedi_id in self._by_trigram.get(trigram, ()):
+                        scores[stedi_id] += 1
+                ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+                minimum = max(1, len(query_trigrams) // 3)
+                for stedi_id, score in ranked:
+                    if len(matches) >= limit or score < minimum:
+                        break
+                    if stedi_id not in matches:
+                        matches.append(stedi_id)
+
+            return [self._payers[stedi_id] for stedi_id in matches]
+
+    def refresh(self) -> Dict[str, int]:
+        """Download the payer list and apply the differences."""
+        return self.update(fetch_payers(), remove_missing=True)
+
+    def start_background_refresh(self, interval: float = DEFAULT_REFRESH_INTERVAL) -> None:
+        """Refresh every ``interval`` seconds on a daemon thread. Errors keep the current index."""
+        if self._refresh_thread is not None:
+            return
+
+        def run() -> None:
+            while not self._stop_refresh.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Payer directory refresh failed: {e}")
+
+        self._stop_refresh.clear()
+        self._refresh_thread = threading.Thread(target=run, name="payer-directory-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self) -> None:
+        self._stop_refresh.set()
+        self._refresh_thread = None
+
+    def save(self, path: str) -> None:
+        """Write the payer list to a JSON file for a fast start next time."""
+        with self._lock:
+            payers = list(self._payers.values())
+        with open(path, "w") as f:
+            json.dump({"items": payers}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "PayerDirectory":
+        """Build a directory from a file written by save() or a saved /payers response."""
+        with open(path) as f:
+            return cls(json.load(f).get("items", []))
+
+
+def get_directory(cache_path: Optional[str] = None, refresh: bool = False) -> PayerDirectory:
+    """Load the directory from ``cache_path`` if present, downloading it otherwise."""
+    if cache_path and os.path.exists(cache_path) and not refresh:
+        return PayerDirectory.load(cache_path)
+
+    directory = PayerDirectory(fetch_payers())
+    if cache_path:
+        directory.save(cache_path)
+    return directory
+
+
+def print_payer(payer: Dict[str, Any]) -> None:
+    # Rows in the payer list may carry null fields.
+    aliases = ", ".join(str(alias) for alias in payer.get("aliases") or [] if alias)
+    print(f"{payer.get('stediId') or '':8s} {payer.get('primaryPayerId') or '':10s} {payer.get('displayName') or ''}")
+    if aliases:
+        print(f"    aliases: {aliases}")
+
+
+def main():
+    """Main entry point for the payer directory CLI."""
+    parser = argparse.ArgumentParser(
+        description="Look up and search Stedi payers from a local copy of the payer list.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --lookup 60054                # Exact lookup by stediId, payer ID or alias
+  %(prog)s --search "blue cross texas"   # Name search
+  %(prog)s --refresh                     # Download the payer list again
+        """
+    )
+    parser.add_argument("--lookup", metavar="ID", help="Look up payers by stediId, primaryPayerId or alias")
+    parser.add_argument("--search", metavar="NAME", help="Search payers by name")
+    parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Maximum search results")
+    parser.add_argument(
+        "--cache",
+        default="payers.json",
+        help="Local copy of the payer list (default: payers.json)"
+    )
+    parser.add_argument("--refresh", action="store_true", help="Download the payer list even if the local copy exists")
+    parser.add_argument(
+        "--api-key",
+        help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
+    )
+    args = parser.parse_args()
+
+    if args.api_key:
+        stedi_request.set_api_key(args.api_key)
+
+    directory = get_directory(args.cache, refresh=args.refresh)
+    print(f"Payer directory: {len(directory)} payers ({args.cache})")
+
+    if args.lookup:
+        for payer in directory.lookup(args.lookup):
+            print_payer(payer)
+    if args.search:
+        for payer in directory.search(args.search, limit=args.limit):
+            print_payer(payer)
+
+
+if __name__ == "__main__":
+    main()
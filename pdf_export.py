@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Streaming, parallel PDF export downloads
+
+Fetches 1500 claim form PDFs (request_15), 835 ERA PDFs (request_22) or
+1500 PDFs by business identifier (request_14) for many IDs at once. Each
+response is streamed to disk in fixed-size chunks, so memory stays bounded
+no matter how many or how large the PDFs are. Downloads are written to a
+.part file first; an interrupted download resumes from where it stopped
+with an HTTP Range request when the run is repeated.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable
+
+import requests
+
+import stedi_client
+import stedi_request
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_WORKERS = 8
+# Transaction and business IDs; anything else (a "/" or "..") is rejected.
+SAFE_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+# PDF kind -> the request that fetches it and whether the ID is a path or query parameter.
+PDF_KINDS: Dict[str, Dict[str, Any]] = {
+    "1500": {"request_id": 15, "path_param": "transactionId"},
+    "era": {"request_id": 22, "path_param": "transactionId"},
+    "1500-business-id": {"request_id": 14, "query_param": "businessId"},
+}
+
+
+def build_pdf_request(kind: str, pdf_id: str) -> Dict[str, Any]:
+    """Return the request for one PDF of the given kind."""
+    spec = PDF_KINDS[kind]
+    if "path_param" in spec:
+        return stedi_request.build_request(spec["request_id"], path_params={spec["path_param"]: pdf_id})
+    return stedi_request.build_request(spec["request_id"], params={spec["query_param"]: pdf_id})
+
+
+def download_pdf(kind: str, pdf_id: str, output_dir: str, overwrite: bool = False) -> Dict[str, Any]:
+    """Stream one PDF to ``output_dir``, resuming a partial download if one exists.
+
+    Returns a result dict with the ID, path, status, bytes written and
+    elapsed time. HTTP errors are reported in the result rather than raised.
+    """
+    if not SAFE_ID.match(pdf_id):
+        # The ID becomes part of the file name, so it must not reach outside output_dir.
+        return {"id": pdf_id, "path": None, "status": "error", "status_code": None, "bytes": 0, "message": f"Invalid ID: {pdf_id!r}"}
+    path = os.path.join(output_dir, f"{kind}-{pdf_id}.pdf")
+    part_path = path + ".part"
+    result = {"id": pdf_id, "path": path, "status": "success", "status_code": None, "bytes": 0, "resumed": False}
+
+    if os.path.exists(path) and not overwrite:
+        result.update({"status": "skipped", "bytes": os.path.getsize(path)})
+        return result
+
+    call = build_pdf_request(kind, pdf_id)
+    headers = dict(call["kwargs"]["headers"])
+    headers.pop("Content-Type", None)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    start_time = time.time()
+    response = stedi_client.send(
+        call["method"], call["url"], headers=headers, params=call["kwargs"].get("params"), stream=True
+    )
+    with response:
+        result["status_code"] = response.status_code
+        if response.status_code == 416 and offset:
+            # The partial file already holds the whole PDF.
+            os.replace(part_path, path)
+            result.update({"bytes": offset, "resumed": True, "elapsed_time": time.time() - start_time})
+            return result
+        if response.status_code >= 400:
+            result.update({"status": "error", "message": response.text[:500], "elapsed_time": time.time() - start_time})
+            return result
+
+        # 206 means the server honoured the Range header; 200 means start over.
+        resumed = response.status_code == 206
+        with open(part_path, "ab" if resumed else "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                result["bytes"] += len(chunk)
+
+    os.replace(part_path, path)
+    if resumed:
+        result["bytes"] += offset
+    result.update({"resumed": resumed, "elapsed_time": time.time() - start_time})
+    return result
+
+
+def download_pdfs(
+    kind: str,
+    pdf_ids: Iterable[str],
+    output_dir: str,
+    workers: int = DEFAULT_WORKERS,
+    overwrite: bool = False,
+) -> Iterable[Dict[str, Any]]:
+    """Download many PDFs concurrently, yielding each result as it finishes."""
+    if kind not in PDF_KINDS:
+        raise ValueError(f"Unknown PDF kind {kind!r}; expected one of {list(PDF_KINDS)}")
+    os.makedirs(output_dir, exist_ok=True)
+    # Keep enough pooled connections for every worker, without closing the shared session.
+    stedi_client.grow_pool(workers)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(download_pdf, kind, pdf_id, output_dir, overwrite): pdf_id for pdf_id in pdf_ids}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except requests.exceptions.RequestException as e:
+                yield {"id": futures[future], "status": "error", "status_code": None, "bytes": 0, "message": str(e)}
+
+
+def main():
+    """Main entry point for the PDF export CLI."""
+    parser = argparse.ArgumentParser(
+        description="Stream Stedi PDF exports straight to disk, concurrently and resumably.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Kinds:
+  1500              1500 claim form PDF by transactionId (request 15)
+  era               835 ERA PDF by transactionId (request 22)
+  1500-business-id  1500 claim form PDF by business identifier (request 14)
+
+Examples:
+  %(prog)s --kind era b12a1241-3312-a3dc-aed2-1a30ca50cd63
+  %(prog)s --kind 1500 --ids-file transaction_ids.txt --output-dir pdfs --workers 16
+        """
+    )
+    parser.add_argument("ids", nargs="*", help="Transaction IDs (or business IDs for 1500-business-id)")
+    parser.add_argument("--kind", choices=list(PDF_KINDS), default="era", help="Which PDF to download (default: era)")
+    parser.add_argument("--ids-file", help="File with one ID per line")
+    parser.add_argument("--output-dir", "-o", default="pdfs", help="Directory PDFs are written to (default: pdfs)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        metavar="N",
+        help=f"Concurrent downloads (default: {DEFAULT_WORKERS})"
+    )
+    parser.add_argument("--overwrite", action="store_true", help="Download again even if the PDF already exists")
+    parser.add_argument(
+        "--api-key",
+        help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
+    )
+    args = parser.parse_args()
+
+    pdf_ids = stedi_request.read_ids(args.ids, args.ids_file)
+    if not pdf_ids:
+        parser.error("no IDs given")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.api_key:
+        stedi_request.set_api_key(args.api_key)
+
+    counts = {"success": 0, "skipped": 0, "error": 0}
+    total_bytes = 0
+    start_time = time.time()
+    for result in download_pdfs(args.kind, pdf_ids, args.output_dir, workers=args.workers, overwrite=args.overwrite):
+        counts[result["status"]] += 1
+        total_bytes += result["bytes"]
+        if result["status"] == "error":
+            print(f"{result['id']}: error {result.get('status_code')}: {result.get('message', '')}")
+        elif result["status"] == "success":
+            resumed = " (resumed)" if result.get("resumed") else ""
+            print(f"{result['id']}: {result['bytes']} bytes -> {result['path']}{resumed}")
+
+    print(
+        f"\n{len(pdf_ids)} PDFs in {time.time() - start_time:.1f}s: {counts['success']} downloaded, "
+        f"{counts['skipped']} already present, {counts['error']} errors ({total_bytes} bytes)"
+    )
+    if counts["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Asyncio execution engine for Stedi Healthcare API requests
+
+Runs entries of stedi_request.REQUESTS on a single aiohttp session so that
+hundreds of calls can be in flight from one process without a thread each.
+Attempts are timed into stedi_metrics like those of stedi_client.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+import aiohttp
+
+import stedi_cache
+import stedi_metrics
+import stedi_ratelimit
+import stedi_request
+import stedi_retry
+
+DEFAULT_CONCURRENCY = 20
+
+# Failures where the request may not have reached Stedi, worth retrying.
+TRANSIENT_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+# A run_many item is a request ID, a (request ID, payload) pair or a
+# (request ID, payload, path parameters) triple.
+RequestItem = Union[int, Tuple[int, Any], Tuple[int, Any, Dict[str, str]]]
+
+
+class AsyncResponse:
+    """Fully read aiohttp response with the parts of requests.Response we use."""
+
+    def __init__(self, status_code: int, reason: str, headers: Dict[str, str], content: bytes, url: str, elapsed: float):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.elapsed = elapsed
+        self.timings: Dict[str, Any] = {}
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+def _to_aiohttp_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate stedi_client.send() keyword arguments to aiohttp ones."""
+    converted = dict(kwargs)
+    params = converted.get("params")
+    if params:
+        # aiohttp only accepts str/int/float query values; requests sends True as "True".
+        converted["params"] = {
+            key: str(value) if isinstance(value, bool) else value
+            for key, value in params.items()
+        }
+    timeout = converted.pop("timeout", None)
+    if timeout is not None:
+        converted["timeout"] = aiohttp.ClientTimeout(total=timeout)
+    return converted
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Time DNS lookups and new connections into the phases passed as ``trace_request_ctx``.
+
+    aiohttp reports connection setup as a whole, so "connect" includes the
+    TLS handshake here.
+    """
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_dns_start(session, context, params) -> None:
+        context.dns_started = time.perf_counter()
+
+    async def on_dns_end(session, context, params) -> None:
+        context.trace_request_ctx["dns"] += time.perf_counter() - context.dns_started
+
+    async def on_connection_start(session, context, params) -> None:
+        context.connection_started = time.perf_counter()
+        context.dns_before = context.trace_request_ctx["dns"]
+
+    async def on_connection_end(session, context, params) -> None:
+        phases = context.trace_request_ctx
+        dns = phases["dns"] - context.dns_before
+        phases["connect"] += time.perf_counter() - context.connection_started - dns
+
+    trace_config.on_dns_resolvehost_start.append(on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_end)
+    trace_config.on_connection_create_start.append(on_connection_start)
+    trace_config.on_connection_create_end.append(on_connection_end)
+    return trace_config
+
+
+class AsyncStediClient:
+    """Shared aiohttp session with a bounded number of requests in flight.
+
+    Use as an async context manager::
+
+        async with AsyncStediClient(concurrency=100) as client:
+            response = await client.run_request(3)
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "AsyncStediClient":
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency)
+        self._session = aiohttp.ClientSession(connector=connector, trace_configs=[_trace_config()])
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def send(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """Send one request through the response cache and retry policy."""
+        if self._session is None:
+            raise RuntimeError("AsyncStediClient must be used inside 'async with'.")
+
+        cache_key = stedi_cache.cache.key_for(method, url, kwargs)
+        if cache_key:
+            record = stedi_cache.cache.get(cache_key)
+            if record is not None:
+                headers = {**record["headers"], stedi_cache.CACHE_HEADER: "HIT"}
+                return AsyncResponse(record["status_code"], record["reason"], headers, record["content"], url, 0.0)
+
+        response = await self._send_with_retries(method, url, **kwargs)
+        if cache_key:
+            stedi_cache.cache.put(cache_key, {
+                "status_code": response.status_code,
+                "reason": response.reason,
+                "headers": response.headers,
+                "content": response.content,
+            })
+        return response
+
+    async def _send_with_retries(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """Send one request, retrying transient failures according to stedi_retry."""
+        retryable = stedi_retry.registry.prepare(method, url, kwargs)
+        policy = stedi_retry.registry.policy
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self._send_once(method, url, **kwargs)
+            except TRANSIENT_ERRORS:
+                delay = policy.next_delay(attempt, started) if retryable else None
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+
+            if retryable and response.status_code in stedi_retry.RETRYABLE_STATUS_CODES:
+                retry_after = stedi_ratelimit.parse_retry_after(response.headers.get("Retry-After"))
+                delay = policy.next_delay(attempt, started, retry_after)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+            return response
+
+    async def _send_once(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        """Send one attempt, waiting for a free concurrency slot and the rate limiter first."""
+        async with self._semaphore:
+            endpoint = await stedi_ratelimit.limiter.acquire_async(url)
+            phases = {"dns": 0.0, "connect": 0.0, "tls": 0.0}
+            start_time = time.monotonic()
+            try:
+                async with self._session.request(method, url, trace_request_ctx=phases, **_to_aiohttp_kwargs(kwargs)) as response:
+                    headers_after = time.monotonic() - start_time
+                    content = await response.read()
+            except BaseException as e:
+                elapsed = time.monotonic() - start_time
+                if endpoint:
+                    endpoint.release(None, elapsed)
+                stedi_metrics.metrics.record(url, stedi_metrics.attempt_timings(phases, elapsed, elapsed, 0, type(e).__name__))
+                raise
+            result = AsyncResponse(
+                status_code=response.status,
+                reason=response.reason or "",
+                headers=dict(response.headers),
+                content=content,
+                url=str(response.url),
+                elapsed=time.monotonic() - start_time,
+            )
+            if endpoint:
+                endpoint.release(result.status_code, result.elapsed, result.headers.get("Retry-After"))
+            result.timings = stedi_metrics.attempt_timings(phases, result.elapsed, headers_after, len(content), str(result.status_code))
+            stedi_metrics.metrics.record(url, result.timings)
+            return result
+
+    async def run_request(self, request_id: int, payload: Any = None, path_params: Optional[Dict[str, str]] = None) -> AsyncResponse:
+        """Run a registered request, optionally replacing its JSON payload and path parameters."""
+        if request_id not in stedi_request.REQUESTS:
+            raise ValueError(f"Request {request_id} not found.")
+        call = stedi_request.build_request(request_id, payload=payload, path_params=path_params)
+        return await self.send(call["method"], call["url"], **call["kwargs"])
+
+
+def _split_item(item: RequestItem) -> Tuple[int, Any, Optional[Dict[str, str]]]:
+    if isinstance(item, tuple):
+        return (item + (None,))[:3]
+    return item, None, None
+
+
+async def run_request_async(
+    request_id: int,
+    payload: Any = None,
+    client: Optional[AsyncStediClient] = None,
+) -> AsyncResponse:
+    """Run one registered request, on ``client`` if given or a one-off session."""
+    if client is not None:
+        return await client.run_request(request_id, payload=payload)
+    async with AsyncStediClient(concurrency=1) as one_off:
+        return await one_off.run_request(request_id, payload=payload)
+
+
+async def iter_completed(
+    items: Iterable[RequestItem],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: Optional[AsyncStediClient] = None,
+) -> AsyncIterator[Tuple[int, Union[AsyncResponse, BaseException]]]:
+    """Yield (index, response or exception) for each item as soon as it finishes.
+
+    At most ``concurrency`` tasks exist at any time, so very long item lists
+    do not create one pending task per item up front.
+    """
+    if client is None:
+        async with AsyncStediClient(concurrency=concurrency) as own_client:
+            async for result in iter_completed(items, concurrency, own_client):
+                yield result
+        return
+
+    async def run(index: int, item: RequestItem):
+        request_id, payload, path_params = _split_item(item)
+        try:
+            return index, await client.run_request(request_id, payload=payload, path_params=path_params)
+        except Exception as e:
+            return index, e
+
+    pending = set()
+    item_iter = enumerate(items)
+    try:
+        for index, item in item_iter:
+            pending.add(asyncio.ensure_future(run(index, item)))
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def run_many(
+    items: Iterable[RequestItem],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: Optional[AsyncStediClient] = None,
+) -> List[Union[AsyncResponse, BaseException]]:
+    """Run many requests concurrently and return results in input order.
+
+    Like ``asyncio.gather(..., return_exceptions=True)``: a failed request
+    leaves its exception in its slot instead of cancelling the others.
+    """
+    results: Dict[int, Union[AsyncResponse, BaseException]] = {}
+    async for index, result in iter_completed(items, concurrency, client):
+        results[index] = result
+    return [results[index] for index in sorted(results)]
+
+
+async def iter_load(
+    request_ids: List[int],
+    count: Optional[int] = None,
+    duration: Optional[float] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rps: Optional[float] = None,
+    client: Optional[AsyncStediClient] = None,
+) -> AsyncIterator[Tuple[int, float, Union[AsyncResponse, BaseException]]]:
+    """Send ``request_ids`` round-robin and yield (request ID, seconds, response or exception) as each finishes.
+
+    Stops starting requests after ``count`` requests or ``duration`` seconds,
+    whichever comes first. With ``rps``, requests start on a fixed schedule
+    (open loop). Start times are fixed in advance, so when all ``concurrency``
+    slots are busy the missed starts are not skipped: they go out in a burst
+    as soon as slots free up, and the rate averages out to the target again
+    if the backlog clears. Without ``rps``,
+    ``concurrency`` requests are kept in flight at all times.
+    """
+    if count is None and duration is None:
+        raise ValueError("count or duration is required")
+    if client is None:
+        async with AsyncStediClient(concurrency=concurrency) as own_client:
+            async for result in iter_load(request_ids, count, duration, concurrency, rps, own_client):
+                yield result
+        return
+
+    finished: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(request_id: int) -> None:
+        start_time = time.monotonic()
+        try:
+            result = await client.run_request(request_id)
+        except Exception as e:
+            result = e
+        slots.release()
+        finished.put_nowait((request_id, time.monotonic() - start_time, result))
+
+    async def schedule() -> None:
+        started = time.monotonic()
+        running = set()
+        sent = 0
+        try:
+            while count is None or sent < count:
+                if rps:
+                    delay = started + sent / rps - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if duration is not None and time.monotonic() - started >= duration:
+                    break
+                await slots.acquire()
+                task = asyncio.ensure_future(run(request_ids[sent % len(request_ids)]))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                sent += 1
+            await asyncio.gather(*running)
+        finally:
+            for task in running:
+                task.cancel()
+            finished.put_nowait(None)
+
+    scheduler = asyncio.ensure_future(schedule())
+    try:
+        while True:
+            item = await finished.get()
+            if item is None:
+                break
+            yield item
+        await scheduler
+    finally:
+        scheduler.cancel()
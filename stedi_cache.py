@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Response cache for real-time eligibility checks
+
+Eligibility responses (request_3 JSON and request_4 raw X12) are cached under
+a fingerprint of the fields that decide the answer: the API key and, for
+X12, the ISA15 usage indicator, so test and production answers never mix,
+then payer, provider NPI, member ID, date of birth, date of service and
+service type codes. Entries expire after a
+TTL, the in-memory store is a bounded LRU, and an optional SQLite file
+keeps entries across restarts.
+
+Endpoints opt in with a "cache" key on their stedi_request.REQUESTS entry
+naming one of the FINGERPRINTS below.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+import stedi_ratelimit
+
+DEFAULT_TTL = 900.0
+DEFAULT_MAX_ENTRIES = 10000
+CACHE_HEADER = "X-Stedi-Cache"
+
+
+def _normalize_date(value: Any) -> str:
+    return "".join(ch for ch in str(value or "") if ch.isdigit())
+
+
+def _fingerprint(
+    kind: str,
+    api_key: Any,
+    usage_indicator: Any,
+    payer: Any,
+    provider_npi: Any,
+    member_id: Any,
+    date_of_birth: Any,
+    date_of_service: Any,
+    service_type_codes: List[Any],
+) -> str:
+    """Hash the normalized fields that identify one eligibility answer."""
+    normalized = [
+        kind,
+        # Only a digest of the key, so the cache file never holds the key itself.
+        hashlib.sha256(str(api_key or "").encode()).hexdigest(),
+        str(usage_indicator or "").strip().upper(),
+        str(payer or "").strip().upper(),
+        str(provider_npi or "").strip(),
+        str(member_id or "").strip().upper(),
+        _normalize_date(date_of_birth),
+        # Stedi checks eligibility for today when no date of service is sent.
+        _normalize_date(date_of_service) or date.today().strftime("%Y%m%d"),
+        sorted({str(code).strip().upper() for code in service_type_codes}),
+    ]
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+
+def eligibility_fingerprint(payload: Dict[str, Any], api_key: Optional[str] = None) -> Optional[str]:
+    """Fingerprint a request_3 JSON eligibility payload sent with ``api_key``."""
+    subscriber = payload.get("subscriber") or {}
+    if not subscriber.get("memberId"):
+        return None
+    # Dependents are checked under the subscriber's member ID with their own date of birth.
+    patient = (payload.get("dependents") or [subscriber])[0]
+
+    encounter = payload.get("encounter", {})
+    codes = encounter.get("serviceTypeCodes") or ([encounter["serviceTypeCode"]] if encounter.get("serviceTypeCode") else [])
+    return _fingerprint(
+        "eligibility",
+        api_key,
+        # Test and production JSON checks are told apart by the API key.
+        None,
+        payload.get("tradingPartnerServiceId"),
+        (payload.get("provider") or {}).get("npi"),
+        subscriber["memberId"],
+        patient.get("dateOfBirth"),
+        encounter.get("dateOfService") or encounter.get("beginningDateOfService"),
+        codes,
+    )
+
+
+def eligibility_x12_fingerprint(payload: Dict[str, Any], api_key: Optional[str] = None) -> Optional[str]:
+    """Fingerprint a request_4 raw X12 270 payload sent with ``api_key``."""
+    x12 = (payload.get("x12") or "").strip()
+    if not x12.startswith("ISA") or len(x12) < 106:
+        return None
+
+    element_separator = x12[3]
+    segment_terminator = x12[105]
+    usage_indicator = payer = provider_npi = member_id = date_of_birth = date_of_service = None
+    codes: List[str] = []
+    for segment in x12.split(segment_terminator):
+        elements = segment.strip().split(element_separator)
+        tag = elements[0]
+        if tag == "ISA" and len(elements) > 15:
+            usage_indicator = elements[15]
+        elif tag == "NM1" and len(elements) > 9:
+            if elements[1] == "PR":
+                payer = elements[9]
+            elif elements[1] == "1P":
+                provider_npi = elements[9]
+            elif elements[1] == "IL":
+                member_id = elements[9]
+        elif tag == "DMG" and len(elements) > 2 and date_of_birth is None:
+            date_of_birth = elements[2]
+        elif tag == "DTP" and len(elements) > 3 and elements[1] == "291":
+            date_of_service = elements[3].split("-")[0]
+        elif tag == "EQ" and len(elements) > 1:
+            codes.append(elements[1])
+
+    if not member_id:
+        return None
+    return _fingerprint(
+        "eligibility-x12", api_key, usage_indicator, payer, provider_npi, member_id, date_of_birth, date_of_service, codes
+    )
+
+
+FINGERPRINTS: Dict[str, Callable[[Dict[str, Any], Optional[str]], Optional[str]]] = {
+    "eligibility": eligibility_fingerprint,
+    "eligibility-x12": eligibility_x12_fingerprint,
+}
+
+
+def _has_aaa_segment(x12: str) -> bool:
+    """Return True if a raw X12 271 holds an AAA (request validation) segment."""
+    x12 = x12.strip()
+    if not x12.startswith("ISA") or len(x12) < 106:
+        return False
+    element_separator = x12[3]
+    return any(segment.strip().startswith(f"AAA{element_separator}") for segment in x12.split(x12[105]))
+
+
+def is_cacheable(status_code: int, content: bytes) -> bool:
+    """Only cache successful answers; payer errors such as AAA rejections may clear up."""
+    if status_code != 200:
+        return False
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return False
+    if not isinstance(body, dict) or body.get("errors"):
+        return False
+    for patient in [body.get("subscriber") or {}, *(body.get("dependents") or [])]:
+        if isinstance(patient, dict) and patient.get("aaaErrors"):
+            return False
+    return not (isinstance(body.get("x12"), str) and _has_aaa_segment(body["x12"]))
+
+
+class ResponseCache:
+    """TTL + LRU cache of response records, optionally backed by SQLite.
+
+    A record is a dict with status_code, reason, headers and content (bytes),
+    so both the requests and aiohttp transports can rebuild a response from it.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES, sqlite_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional["sqlite3.Connection"] = None
+        self._kinds: Dict[str, str] = {}
+        if sqlite_path:
+            self.open_sqlite(sqlite_path)
+
+    def open_sqlite(self, sqlite_path: str) -> None:
+        """Back the cache with a SQLite file so entries survive restarts."""
+        import sqlite3
+
+        with self._lock:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, "
+                "status_code INTEGER, reason TEXT, headers TEXT, content BLOB)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def configure(self, path: str, kind: str) -> None:
+        """Cache responses for an endpoint path using the named fingerprint."""
+        if kind not in FINGERPRINTS:
+            raise ValueError(f"Unknown cache fingerprint {kind!r}; expected one of {list(FINGERPRINTS)}")
+        self._kinds[path] = kind
+
+    def configure_from_requests(self, requests_registry: Dict[int, Dict[str, Any]]) -> None:
+        """Read the optional "cache" key of every REQUESTS entry."""
+        for req_info in requests_registry.values():
+            if req_info.get("cache"):
+                self.configure(req_info["path"], req_info["cache"])
+
+    def key_for(self, method: str, url: str, kwargs: Dict[str, Any]) -> Optional[str]:
+        """Return the cache key for a send() call, or None if it is not cacheable."""
+        if not self.enabled or method.upper() != "POST" or not isinstance(kwargs.get("json"), dict):
+            return None
+        kind = self._kinds.get(stedi_ratelimit.limiter.endpoint_for(url).path)
+        if kind is None:
+            return None
+        headers = {name.lower(): value for name, value in (kwargs.get("headers") or {}).items()}
+        return FINGERPRINTS[kind](kwargs["json"], headers.get("authorization"))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh record for ``key``, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, record = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return record
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires_at, status_code, reason, headers, content FROM responses "
+                    "WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    record = {"status_code": row[1], "reason": row[2], "headers": json.loads(row[3]), "content": row[4]}
+                    self._store(key, row[0], record)
+                    self.hits += 1
+                    return record
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        """Store a record if it is a cacheable answer."""
+        if not is_cacheable(record["status_code"], record["content"]):
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, record)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, expires_at, record["status_code"], record["reason"], json.dumps(record["headers"]), record["content"]),
+                )
+                self._db.commit()
+
+    def _store(self, key: str, expires_at: float, record: Dict[str, Any]) -> None:
+        self._entries[key] = (expires_at, record)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every cached entry, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+
+# Shared by stedi_client.send() and the asyncio engine.
+cache = ResponseCache()
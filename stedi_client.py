@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for Stedi Healthcare API requests
+
+Every request made by stedi_request.py and app.py goes through send(), which
+uses one keep-alive requests.Session so connections to the healthcare and
+payers hosts are reused instead of paying a TCP+TLS handshake per call. It
+waits for the shared stedi_ratelimit limiter before each attempt, retries
+transient failures according to stedi_retry and answers repeated
+eligibility checks from stedi_cache. Every attempt is timed phase by phase
+into stedi_metrics.
+"""
+
+import socket
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+import stedi_cache
+import stedi_metrics
+import stedi_ratelimit
+import stedi_retry
+
+DEFAULT_POOL_SIZE = 10
+PREWARM_TIMEOUT = 5
+
+_session: Optional[requests.Session] = None
+_pool_size: int = DEFAULT_POOL_SIZE
+_session_lock = threading.Lock()
+
+
+class _TimedConnectionMixin:
+    """Adds DNS lookup and TCP connect time to the current attempt's stedi_metrics phases."""
+
+    def _new_conn(self) -> socket.socket:
+        phases = stedi_metrics.current_phases()
+        if phases is None:
+            return super()._new_conn()
+
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            # Let urllib3 resolve again and raise its usual error.
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        phases["dns"] += resolved - start
+
+        # Connect to the address just resolved instead of looking it up twice.
+        # TLS still verifies self.host.
+        self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        except NewConnectionError:
+            # Fall back to urllib3 trying every address for the host.
+            self._dns_host = host
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+        phases["connect"] += time.perf_counter() - resolved
+        return sock
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self) -> None:
+        phases = stedi_metrics.current_phases()
+        if phases is None:
+            return super().connect()
+
+        before = phases["dns"] + phases["connect"]
+        start = time.perf_counter()
+        super().connect()
+        phases["tls"] += time.perf_counter() - start - (phases["dns"] + phases["connect"] - before)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections record their DNS, connect and TLS time."""
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def _build_session(pool_size: int) -> requests.Session:
+    """Create a session with a per-host connection pool of the given size."""
+    session = requests.Session()
+    # pool_connections is the number of hosts to keep pools for,
+    # pool_maxsize the number of keep-alive connections per host.
+    adapter = _TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_pool(pool_size: int = DEFAULT_POOL_SIZE) -> None:
+    """Set the per-host connection pool size, replacing the shared session."""
+    global _session, _pool_size
+    if pool_size < 1:
+        raise ValueError("pool_size must be at least 1")
+
+    with _session_lock:
+        _pool_size = pool_size
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def grow_pool(pool_size: int) -> None:
+    """Make sure the pool keeps at least ``pool_size`` connections per host.
+
+    Unlike configure_pool(), the session in use is never closed: a larger
+    one replaces it for later requests, and the old one is garbage collected
+    once the requests still using it finish. Does nothing if the pool is
+    already big enough.
+    """
+    global _session, _pool_size
+    with _session_lock:
+        if pool_size <= _pool_size:
+            return
+        _pool_size = pool_size
+        _session = None
+
+
+def get_pool_size() -> int:
+    """Get the configured per-host connection pool size."""
+    return _pool_size
+
+
+def get_session() -> requests.Session:
+    """Return the shared session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session(_pool_size)
+    return _session
+
+
+def close_session() -> None:
+    """Close all pooled connections. The next request opens a new session."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# Failures where the request may not have reached Stedi, worth retrying.
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+def _send_once(method: str, url: str, **kwargs) -> requests.Response:
+    """Send one attempt through the pooled session once the rate limiter allows it.
+
+    The attempt's phase breakdown is recorded in stedi_metrics and attached
+    to the response as ``response.timings``.
+    """
+    endpoint = stedi_ratelimit.limiter.acquire(url)
+    phases, token = stedi_metrics.begin_attempt()
+    start_time = time.monotonic()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except BaseException as e:
+        elapsed = time.monotonic() - start_time
+        if endpoint:
+            endpoint.release(None, elapsed)
+        stedi_metrics.metrics.record(url, stedi_metrics.attempt_timings(phases, elapsed, elapsed, 0, type(e).__name__))
+        raise
+    finally:
+        stedi_metrics.end_attempt(token)
+    elapsed = time.monotonic() - start_time
+    if endpoint:
+        endpoint.release(response.status_code, elapsed, response.headers.get("Retry-After"))
+
+    if kwargs.get("stream"):
+        # The body has not been read yet; count what the server says it will send.
+        headers_after, size = elapsed, int(response.headers.get("Content-Length") or 0)
+    else:
+        # requests stops response.elapsed when the headers arrive, before reading the body.
+        headers_after, size = response.elapsed.total_seconds(), len(response.content)
+    response.timings = stedi_metrics.attempt_timings(phases, elapsed, headers_after, size, str(response.status_code))
+    stedi_metrics.metrics.record(url, response.timings)
+    return response
+
+
+def send(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request through the response cache, retry policy, rate limiter and pooled session."""
+    cache_key = stedi_cache.cache.key_for(method, url, kwargs)
+    if cache_key:
+        record = stedi_cache.cache.get(cache_key)
+        if record is not None:
+            return _response_from_record(record, url)
+
+    response = _send_with_retries(method, url, **kwargs)
+    if cache_key:
+        stedi_cache.cache.put(cache_key, {
+            "status_code": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "content": response.content,
+        })
+    return response
+
+
+def _response_from_record(record: Dict[str, Any], url: str) -> requests.Response:
+    """Rebuild a requests.Response from a stedi_cache record."""
+    response = requests.Response()
+    response.status_code = record["status_code"]
+    response.reason = record["reason"]
+    response.headers = CaseInsensitiveDict(record["headers"])
+    response.headers[stedi_cache.CACHE_HEADER] = "HIT"
+    response._content = record["content"]
+    response.encoding = "utf-8"
+    response.url = url
+    return response
+
+
+def _send_with_retries(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request, retrying transient failures according to stedi_retry."""
+    retryable = stedi_retry.registry.prepare(method, url, kwargs)
+    policy = stedi_retry.registry.policy
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = _send_once(method, url, **kwargs)
+        except TRANSIENT_ERRORS:
+            delay = policy.next_delay(attempt, started) if retryable else None
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+
+        if retryable and response.status_code in stedi_retry.RETRYABLE_STATUS_CODES:
+            retry_after = stedi_ratelimit.parse_retry_after(response.headers.get("Retry-After"))
+            delay = policy.next_delay(attempt, started, retry_after)
+            if delay is not None:
+                response.close()
+                time.sleep(delay)
+                continue
+        return response
+
+
+def prewarm(base_urls: Iterable[str], connections: int = 1, background: bool = False) -> List[threading.Thread]:
+    """Open keep-alive connections to each base URL ahead of the first real request.
+
+    Issues ``connections`` concurrent HEAD requests per host so that many
+    sockets are left idle in the pool. Failures are ignored: pre-warming is
+    best effort and the real request will simply open its own connection.
+    With ``background=True`` the warming threads are returned without
+    waiting for them to finish.
+    """
+    connections = max(1, min(connections, _pool_size))
+
+    def warm(url: str) -> None:
+        try:
+            send("HEAD", url, timeout=PREWARM_TIMEOUT)
+        except requests.exceptions.RequestException:
+            pass
+
+    threads = [
+        threading.Thread(target=warm, args=(url,), daemon=True)
+        for url in base_urls
+        for _ in range(connections)
+    ]
+    for thread in threads:
+        thread.start()
+
+    if not background:
+        for thread in threads:
+            thread.join()
+    return threads
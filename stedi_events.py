@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Streaming iterator over Stedi transaction events
+
+Pages through the processed-transaction events that Stedi also delivers to
+event destinations (GET /polling/transactions on the core API), so 277 and
+835 processing can be driven by new transactions instead of polling each
+report. The next page is fetched on a background thread while the current
+one is consumed, and at most two pages are held in memory.
+
+The position is a (page token, offset) cursor, plus the start time the
+first page was requested with. A checkpoint file records it atomically at every page boundary and when iteration stops, and an event
+only counts as seen once the consumer asks for the next one, so a restart
+resumes with the first event that was not fully processed. A hard kill
+between checkpoints replays at most one page.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional
+
+import stedi_client
+import stedi_request
+
+CORE_BASE_URL = "https://core.us.stedi.com/2023-08-01"
+EVENTS_PATH = "/polling/transactions"
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_CHECKPOINT = "events_checkpoint.json"
+
+
+def transaction_set(event: Dict[str, Any]) -> Optional[str]:
+    """Return the X12 transaction set of an event, such as "835" or "277"."""
+    return event.get("x12", {}).get("metadata", {}).get("transaction", {}).get("transactionSetIdentifier")
+
+
+class EventCheckpoint:
+    """The (page token, offset) cursor of an event stream, saved to a JSON file.
+
+    The start time is saved too: until the first page is finished there is
+    no page token, and the offset only points at the same events if the
+    first page is requested again from the same start time.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.page_token: Optional[str] = None
+        self.offset = 0
+        self.start_date_time: Optional[str] = None
+        self.resumed = False
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.page_token = state.get("pageToken")
+            self.offset = state.get("offset", 0)
+            self.start_date_time = state.get("startDateTime")
+            self.resumed = True
+
+    def use_start_date_time(self, start_date_time: Optional[str]) -> Optional[str]:
+        """Return the start time to request the first page with.
+
+        A resumed checkpoint keeps the start time it was saved with; passing
+        a different one raises ValueError, since the saved cursor would then
+        point into a different page.
+        """
+        if not self.resumed:
+            self.start_date_time = start_date_time
+        elif start_date_time and start_date_time != self.start_date_time:
+            raise ValueError(
+                f"Checkpoint {self.path} was started from {self.start_date_time or 'the earliest events'}, "
+                f"not {start_date_time}; use another checkpoint file to start elsewhere"
+            )
+        return self.start_date_time
+
+    def advance(self, page_token: Optional[str], offset: int) -> None:
+        self.page_token = page_token
+        self.offset = offset
+
+    def save(self) -> None:
+        """Write the cursor, replacing the file atomically so a crash never leaves it half written."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "pageToken": self.page_token,
+                "offset": self.offset,
+                "startDateTime": self.start_date_time,
+                "savedAt": time.time(),
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+def fetch_page(
+    page_token: Optional[str] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    start_date_time: Optional[str] = None,
+    base_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Fetch one page of events: ``{"items": [...], "nextPageToken": ...}``."""
+    params: Dict[str, Any] = {"pageSize": page_size}
+    if page_token:
+        params["pageToken"] = page_token
+    elif start_date_time:
+        params["startDateTime"] = start_date_time
+    response = stedi_client.send(
+        "GET",
+        f"{base_url or CORE_BASE_URL}{EVENTS_PATH}",
+        headers={"Authorization": stedi_request.get_api_key()},
+        params=params,
+        timeout=60,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def iter_events(
+    checkpoint: Optional[EventCheckpoint] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    start_date_time: Optional[str] = None,
+    follow: bool = False,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    base_url: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield events one at a time from the checkpointed cursor onwards.
+
+    The page after the current one is requested as soon as the current page
+    arrives. Without ``follow`` iteration ends on the last page; with it,
+    the last page is fetched again every ``poll_interval`` seconds and only
+    events not seen before are yielded. A resumed checkpoint keeps its own
+    start time, and a conflicting ``start_date_time`` raises ValueError.
+    """
+    checkpoint = checkpoint or EventCheckpoint()
+    start_date_time = checkpoint.use_start_date_time(start_date_time)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stedi-events")
+
+    def request(page_token: Optional[str]) -> Future:
+        return executor.submit(fetch_page, page_token, page_size, start_date_time, base_url)
+
+    page_token = checkpoint.page_token
+    pending = request(page_token)
+    try:
+        while True:
+            page = pending.result()
+            next_page_token = page.get("nextPageToken")
+            # Prefetch while the consumer works through this page.
+            pending = request(next_page_token) if next_page_token else None
+
+            items = page.get("items", [])
+            offset = checkpoint.offset if checkpoint.page_token == page_token else 0
+            for index in range(offset, len(items)):
+                yield items[index]
+                # The consumer came back for more, so this event is done.
+                checkpoint.advance(page_token, index + 1)
+
+            if next_page_token:
+                page_token = next_page_token
+                checkpoint.advance(page_token, 0)
+                checkpoint.save()
+                continue
+
+            checkpoint.advance(page_token, len(items))
+            checkpoint.save()
+            if not follow:
+                return
+            time.sleep(poll_interval)
+            pending = request(page_token)
+    finally:
+        checkpoint.save()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    """Main entry point for the events CLI."""
+    parser = argparse.ArgumentParser(
+        description="Stream Stedi transaction events as JSON lines, resuming from a checkpoint.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s > events.jsonl
+  %(prog)s --transaction-set 835 --ids-only > era_transaction_ids.txt
+  %(prog)s --transaction-set 835 --ids-only --follow --checkpoint era_events.json
+  %(prog)s --start-date-time 2024-01-01T00:00:00Z --checkpoint backfill.json
+        """
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=DEFAULT_CHECKPOINT,
+        help=f"File the stream cursor is saved to and resumed from (default: {DEFAULT_CHECKPOINT})"
+    )
+    parser.add_argument(
+        "--start-date-time",
+        help="Start from events at this ISO 8601 time; a checkpoint keeps the time it was started with"
+    )
+    parser.add_argument("--transaction-set", help="Only output events for this X12 transaction set, e.g. 835 or 277")
+    parser.add_argument("--ids-only", action="store_true", help="Output transaction IDs instead of whole events")
+    parser.add_argument("--follow", action="store_true", help="Keep polling for new events after the last page")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        metavar="SECONDS",
+        help=f"Seconds between polls with --follow (default: {DEFAULT_POLL_INTERVAL})"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help=f"Events per page (default: {DEFAULT_PAGE_SIZE})"
+    )
+    parser.add_argument("--base-url", help=f"Core API base URL (default: {CORE_BASE_URL})")
+    parser.add_argument(
+        "--api-key",
+        help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
+    )
+    args = parser.parse_args()
+
+    if args.page_size < 1:
+        parser.error("--page-size must be at least 1")
+    if args.api_key:
+        stedi_request.set_api_key(args.api_key)
+
+    checkpoint = EventCheckpoint(args.checkpoint)
+    try:
+        checkpoint.use_start_date_time(args.start_date_time)
+    except ValueError as e:
+        parser.error(str(e))
+    events = iter_events(
+        checkpoint,
+        page_size=args.page_size,
+        start_date_time=args.start_date_time,
+        follow=args.follow,
+        poll_interval=args.poll_interval,
+        base_url=args.base_url,
+    )
+    try:
+        for event in events:
+            if args.transaction_set and transaction_set(event) != args.transaction_set:
+                continue
+            print(event.get("transactionId") if args.ids_only else json.dumps(event), flush=args.follow)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        events.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Per-request latency breakdown and OpenMetrics export for Stedi API requests
+
+stedi_client and stedi_async time every attempt in phases: DNS lookup, TCP
+connect, TLS handshake, time to first byte (Stedi and payer processing) and
+download, together with the response size and status. Each attempt is
+labeled with its REQUESTS id and path template and added to histograms,
+which render as OpenMetrics text for a file or a local /metrics endpoint.
+
+Phases skipped on a reused keep-alive connection are recorded as 0. The
+aiohttp path cannot separate the TLS handshake, so it is counted in
+"connect" there.
+"""
+
+import bisect
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import stedi_ratelimit
+
+PHASES = ("dns", "connect", "tls", "ttfb", "download", "total")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Connection phases of the attempt running in the current thread or task,
+# filled in by stedi_client's timed connections.
+_connection_phases: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "stedi_connection_phases", default=None
+)
+
+
+def begin_attempt() -> Tuple[Dict[str, float], contextvars.Token]:
+    """Start collecting connection phases for one attempt. Pass the token to end_attempt()."""
+    phases = {"dns": 0.0, "connect": 0.0, "tls": 0.0}
+    return phases, _connection_phases.set(phases)
+
+
+def end_attempt(token: contextvars.Token) -> None:
+    _connection_phases.reset(token)
+
+
+def current_phases() -> Optional[Dict[str, float]]:
+    """Return the connection phases of the current attempt, or None outside one."""
+    return _connection_phases.get()
+
+
+def attempt_timings(phases: Dict[str, float], total: float, headers_after: float, size: int, status: str) -> Dict[str, Any]:
+    """Combine connection phases with response timings into one attempt's breakdown.
+
+    ``headers_after`` is the time from sending to receiving the response
+    headers, ``total`` the time until the body was read.
+    """
+    connection = phases["dns"] + phases["connect"] + phases["tls"]
+    return {
+        "dns": phases["dns"],
+        "connect": phases["connect"],
+        "tls": phases["tls"],
+        "ttfb": max(0.0, headers_after - connection),
+        "download": max(0.0, total - headers_after),
+        "total": total,
+        "bytes": size,
+        "status": status,
+    }
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus/OpenMetrics sense."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Return (le, count) pairs, ending with +Inf."""
+        pairs = []
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            pairs.append((_format_number(bound), running))
+        pairs.append(("+Inf", self.count))
+        return pairs
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class RequestMetrics:
+    """Histograms of attempt phases and response sizes, and counts by status."""
+
+    def __init__(self):
+        self.enabled = True
+        self._request_ids: Dict[str, str] = {}
+        self._latency: Dict[Tuple[str, str, str], Histogram] = {}
+        self._sizes: Dict[Tuple[str, str], Histogram] = {}
+        self._statuses: Dict[Tuple[str, str, str], int] = {}
+        self._created = time.time()
+        self._lock = threading.Lock()
+
+    def configure_from_requests(self, requests_registry: Dict[int, Dict[str, Any]]) -> None:
+        """Label attempts with the id of the REQUESTS entry whose path they match."""
+        self._request_ids = {req_info["path"]: str(request_id) for request_id, req_info in requests_registry.items()}
+
+    def labels_for(self, url: str) -> Tuple[str, str]:
+        """Return the (request id, path template) labels for a URL."""
+        path = stedi_ratelimit.limiter.endpoint_for(url).path
+        return self._request_ids.get(path, ""), path
+
+    def record(self, url: str, timings: Dict[str, Any]) -> None:
+        """Add one attempt's attempt_timings() to the histograms."""
+        if not self.enabled:
+            return
+        request_id, path = self.labels_for(url)
+        with self._lock:
+            for phase in PHASES:
+                key = (request_id, path, phase)
+                histogram = self._latency.get(key)
+                if histogram is None:
+                    histogram = self._latency[key] = Histogram(LATENCY_BUCKETS)
+                histogram.observe(timings[phase])
+
+            histogram = self._sizes.get((request_id, path))
+            if histogram is None:
+                histogram = self._sizes[(request_id, path)] = Histogram(SIZE_BUCKETS)
+            histogram.observe(timings["bytes"])
+
+            key = (request_id, path, str(timings["status"]))
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._latency.clear()
+            self._sizes.clear()
+            self._statuses.clear()
+            self._created = time.time()
+
+    def render(self) -> str:
+        """Return all metrics in the OpenMetrics text format."""
+        lines = []
+        with self._lock:
+            lines += [
+                "# TYPE stedi_request_phase_seconds histogram",
+                "# UNIT stedi_request_phase_seconds seconds",
+                "# HELP stedi_request_phase_seconds Time spent in each phase of a request attempt.",
+            ]
+            for (request_id, path, phase), histogram in sorted(self._latency.items()):
+                self._render_histogram(lines, "stedi_request_phase_seconds", [("request_id", request_id), ("path", path), ("phase", phase)], histogram)
+
+            lines += [
+                "# TYPE stedi_response_size_bytes histogram",
+                "# UNIT stedi_response_size_bytes bytes",
+                "# HELP stedi_response_size_bytes Response body size per request attempt.",
+            ]
+            for (request_id, path), histogram in sorted(self._sizes.items()):
+                self._render_histogram(lines, "stedi_response_size_bytes", [("request_id", request_id), ("path", path)], histogram)
+
+            lines += [
+                "# TYPE stedi_requests counter",
+                "# HELP stedi_requests Request attempts by status code, or exception name when there was no response.",
+            ]
+            for (request_id, path, status), count in sorted(self._statuses.items()):
+                labels = _labels([("request_id", request_id), ("path", path), ("status", status)])
+                lines.append(f"stedi_requests_total{labels} {count}")
+                lines.append(f"stedi_requests_created{labels} {self._created:.3f}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def _render_histogram(self, lines: List[str], name: str, labels: List[Tuple[str, str]], histogram: Histogram) -> None:
+        for bound, count in histogram.cumulative():
+            lines.append(f"{name}_bucket{_labels(labels + [('le', bound)])} {count}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.sum!r}")
+        lines.append(f"{name}_created{_labels(labels)} {self._created:.3f}")
+
+    def write(self, path: str) -> None:
+        """Write render() to ``path``, replacing it atomically so scrapers never see a partial file."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Serve render() at http://host:port/metrics from a background thread and return the server."""
+        # Imported here so clients that never serve metrics do not pay for http.server.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="stedi-metrics", daemon=True).start()
+        return server
+
+
+# Shared by every call path in stedi_client.py and stedi_async.py.
+metrics = RequestMetrics()
+
+
+def get_metrics() -> RequestMetrics:
+    """Return the process-wide request metrics."""
+    return metrics
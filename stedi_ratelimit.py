@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Client-side rate limiting for Stedi Healthcare API requests
+
+Each endpoint path in stedi_request.REQUESTS gets a token bucket (requests
+per second plus burst) and an adaptive concurrency limit. A 429 or a
+Retry-After header halves both and pauses the endpoint; they ramp back up
+again one step at a time while latency and error rate stay healthy.
+
+The limiter is shared by the threaded path (stedi_client.send) and the
+asyncio path (stedi_async), so waiting is split into a non-blocking
+try_acquire() and a sync or async sleep loop around it.
+"""
+
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+DEFAULT_MAX_CONCURRENCY = 20
+MIN_RATE = 0.5
+DEFAULT_BACKOFF = 1.0
+MAX_WAIT = 0.25
+
+# Error-rate and latency thresholds for ramping back up.
+EWMA_ALPHA = 0.2
+ERROR_RATE_THRESHOLD = 0.1
+LATENCY_THRESHOLD = 2.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the Retry-After header as seconds to wait, or None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP-date form; email.utils is only imported when a server actually sends one.
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class EndpointLimiter:
+    """Token bucket and adaptive concurrency limit for one endpoint path."""
+
+    def __init__(self, path: str, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.path = path
+        self.max_rate = float(rate)
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+
+        self.rate = self.max_rate
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._error_rate = 0.0
+        self._latency: Optional[float] = None
+        self._baseline_latency: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Take a concurrency slot and a token, or return how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.concurrency_limit):
+                return MAX_WAIT / 10
+
+            self._refill(now)
+            if self._tokens < 1:
+                return min(MAX_WAIT, (1 - self._tokens) / self.rate)
+
+            self._tokens -= 1
+            self.in_flight += 1
+            return 0.0
+
+    def release(self, status_code: Optional[int], latency: float, retry_after: Optional[str] = None) -> None:
+        """Return the concurrency slot and adapt limits to the response.
+
+        ``status_code`` is None when the request failed without a response.
+        """
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            delay = parse_retry_after(retry_after)
+
+            if status_code == 429 or delay is not None:
+                self._back_off(delay if delay is not None else DEFAULT_BACKOFF)
+                return
+
+            failed = status_code is None or status_code >= 500
+            self._error_rate += EWMA_ALPHA * ((1.0 if failed else 0.0) - self._error_rate)
+            if failed:
+                if self._error_rate > ERROR_RATE_THRESHOLD:
+                    self._decrease()
+                return
+
+            self._latency = latency if self._latency is None else self._latency + EWMA_ALPHA * (latency - self._latency)
+            if self._baseline_latency is None or self._latency < self._baseline_latency:
+                self._baseline_latency = self._latency
+            if self._error_rate <= ERROR_RATE_THRESHOLD and self._latency <= self._baseline_latency * LATENCY_THRESHOLD:
+                self._increase()
+
+    def _back_off(self, delay: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self._decrease()
+        self._tokens = min(self._tokens, 0.0)
+
+    def _decrease(self) -> None:
+        self.rate = max(MIN_RATE, self.rate / 2)
+        self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+
+    def _increase(self) -> None:
+        # Additive increase: about one extra slot, and one extra request
+        # per second, for every "limit" healthy responses.
+        self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+        self.rate = min(self.max_rate, self.rate + 1 / max(1.0, self.rate))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current limits, for display and debugging."""
+        with self._lock:
+            return {
+                "path": self.path,
+                "rate": round(self.rate, 2),
+                "max_rate": self.max_rate,
+                "concurrency_limit": int(self.concurrency_limit),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            }
+
+
+def _path_pattern(path: str) -> Pattern:
+    """Compile a REQUESTS path template such as /payer/{stediId} into a URL regex."""
+    parts = re.split(r"\{[^}]+\}", path)
+    return re.compile("[^/?]+".join(re.escape(part) for part in parts) + r"(?:\?.*)?$")
+
+
+class RateLimiter:
+    """Per-endpoint limiters, looked up by matching request URLs against path templates."""
+
+    def __init__(self):
+        self.enabled = True
+        self._endpoints: Dict[str, EndpointLimiter] = {}
+        self._patterns: List[Tuple[Pattern, str]] = []
+        self._default = EndpointLimiter("*")
+        self._lock = threading.Lock()
+
+    def configure(self, path: str, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> None:
+        """Set the limits for an endpoint path template."""
+        with self._lock:
+            if path not in self._endpoints:
+                self._patterns.append((_path_pattern(path), path))
+                # Match the longest templates first so /payers/csv wins over /payers.
+                self._patterns.sort(key=lambda item: len(item[1]), reverse=True)
+            self._endpoints[path] = EndpointLimiter(path, rate, burst, max_concurrency)
+
+    def override(self, path: str, rate: Optional[float] = None, max_concurrency: Optional[int] = None) -> None:
+        """Change the rate and/or concurrency cap of a configured endpoint, e.g. from CLI flags.
+
+        The burst grows with the rate so a higher rate is not held back by
+        the bucket size.
+        """
+        current = self._endpoints[path]
+        rate = rate or current.max_rate
+        self.configure(
+            path,
+            rate=rate,
+            burst=max(current.burst, int(rate)),
+            max_concurrency=max_concurrency or current.max_concurrency,
+        )
+
+    def configure_from_requests(self, requests_registry: Dict[int, Dict[str, Any]]) -> None:
+        """Configure every path in a REQUESTS registry, using its optional "rate_limit" entry."""
+        for req_info in requests_registry.values():
+            self.configure(req_info["path"], **req_info.get("rate_limit", {}))
+
+    def endpoint_for(self, url: str) -> EndpointLimiter:
+        """Return the limiter for the endpoint a URL belongs to."""
+        for pattern, path in self._patterns:
+            if pattern.search(url):
+                return self._endpoints[path]
+        return self._default
+
+    def acquire(self, url: str) -> Optional[EndpointLimiter]:
+        """Block until a request to ``url`` may be sent. Release the returned limiter afterwards."""
+        if not self.enabled:
+            return None
+        endpoint = self.endpoint_for(url)
+        wait = endpoint.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = endpoint.try_acquire()
+        return endpoint
+
+    async def acquire_async(self, url: str) -> Optional[EndpointLimiter]:
+        """Async version of acquire() that sleeps without blocking the event loop."""
+        # Imported here so the synchronous CLI does not pay for asyncio at startup.
+        import asyncio
+
+        if not self.enabled:
+            return None
+        endpoint = self.endpoint_for(url)
+        wait = endpoint.try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = endpoint.try_acquire()
+        return endpoint
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Return the current limits for every configured endpoint."""
+        return [self._endpoints[path].snapshot() for path in sorted(self._endpoints)]
+
+
+# Shared by every call path in stedi_request.py, stedi_async.py and app.py.
+limiter = RateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide rate limiter."""
+    return limiter
@@ -4,12 +4,23 @@ Sample requests for Stedi Healthcare API
 Generated from OpenAPI specification
 """
 
-import requests
 import json
 import argparse
 import sys
 import os
-from typing import Dict, Callable, Any, Optional
+from typing import TYPE_CHECKING, Dict, Callable, Any, List, Optional
+
+import stedi_cache
+import stedi_metrics
+import stedi_ratelimit
+import stedi_retry
+import x12_builder
+
+if TYPE_CHECKING:
+    import requests
+
+# stedi_client (and with it requests) is imported on first use, so metadata
+# commands such as --list and --info start without loading the HTTP stack.
 
 API_REFERENCE_URL = "https://www.stedi.com/docs/healthcare/api-reference"
 HEALTHCARE_OPENAPI_URL = "https://raw.githubusercontent.com/Stedi/openApi/main/healthcare.json"
@@ -20,18 +31,25 @@ BASE_URL = HEALTHCARE_BASE_URL
 
 # Global variable to store API key (set by Streamlit or CLI)
 _api_key: Optional[str] = None
-
-def get_api_key() -> str:
-    """Get API key from Streamlit secrets, environment variable, or global variable."""
-    global _api_key
-    
-    # Try Streamlit secrets first (when running in Streamlit)
-    try:
-        import streamlit as st
-        if "STEDI_API_KEY" in st.secrets:
-            return st.secrets["STEDI_API_KEY"]
-    except (ImportError, RuntimeError):
-        pass  # Not running in Streamlit
+# The key get_api_key() settled on; resolved once per process.
+_resolved_api_key: Optional[str] = None
+
+def set_api_key(value: Optional[str]) -> None:
+    """Set the API key used when Streamlit secrets and STEDI_API_KEY are not available."""
+    global _api_key, _resolved_api_key
+    _api_key = value
+    _resolved_api_key = None
+
+def _resolve_api_key() -> Optional[str]:
+    # Try Streamlit secrets first, but only when running in Streamlit:
+    # importing it from the CLI would cost more than the request itself.
+    if "streamlit" in sys.modules:
+        st = sys.modules["streamlit"]
+        try:
+            if "STEDI_API_KEY" in st.secrets:
+                return st.secrets["STEDI_API_KEY"]
+        except (RuntimeError, FileNotFoundError):
+            pass  # No secrets file
     
     # Try environment variable
     env_key = os.getenv("STEDI_API_KEY")
@@ -39,8 +57,15 @@ def get_api_key() -> str:
         return env_key
     
     # Use global variable if set
-    if _api_key:
-        return _api_key
+    return _api_key
+
+def get_api_key() -> str:
+    """Get API key from Streamlit secrets, environment variable, or global variable."""
+    global _resolved_api_key
+    if _resolved_api_key is None:
+        _resolved_api_key = _resolve_api_key()
+    if _resolved_api_key:
+        return _resolved_api_key
     
     # Fallback for CLI usage
     raise ValueError("API key not found. Set STEDI_API_KEY environment variable or use --api-key flag.")
@@ -59,30 +84,44 @@ def get_usage_indicator() -> str:
 
 # Registry of all available requests
 REQUESTS: Dict[int, Dict[str, Any]] = {
-    1: {"func": None, "method": "POST", "path": "/change/medicalnetwork/claimstatus/v2", "description": "Submit a 276/277 real-time claim status check in JSON format"},
-    2: {"func": None, "method": "POST", "path": "/change/medicalnetwork/claimstatus/v2/raw-x12", "description": "Submit a 276/277 real-time claim status check in raw X12 EDI format"},
-    3: {"func": None, "method": "POST", "path": "/change/medicalnetwork/eligibility/v3", "description": "Submit a real-time 270/271 eligibility check in JSON format"},
-    4: {"func": None, "method": "POST", "path": "/change/medicalnetwork/eligibility/v3/raw-x12", "description": "Submit a real-time 270/271 eligibility check in raw X12 EDI format"},
-    5: {"func": None, "method": "POST", "path": "/change/medicalnetwork/institutionalclaims/v1/raw-x12-submission", "description": "Submit an 837I institutional claim in raw X12 EDI format"},
-    6: {"func": None, "method": "POST", "path": "/change/medicalnetwork/institutionalclaims/v1/submission", "description": "Submit an 837I institutional claim in JSON format"},
-    7: {"func": None, "method": "POST", "path": "/change/medicalnetwork/professionalclaims/v3/raw-x12-submission", "description": "Submit an 837P professional claim in raw X12 EDI format"},
-    8: {"func": None, "method": "POST", "path": "/change/medicalnetwork/professionalclaims/v3/submission", "description": "Submit an 837P professional claim in JSON format"},
-    9: {"func": None, "method": "GET", "path": "/change/medicalnetwork/reports/v2/{transactionId}/277", "path_params": {"transactionId": "d567c2ae-f073-4725-8b8c-06c473b738a6"}, "description": "Get 277 claim acknowledgment report"},
-    10: {"func": None, "method": "GET", "path": "/change/medicalnetwork/reports/v2/{transactionId}/835", "path_params": {"transactionId": "d567c2ae-f073-4725-8b8c-06c473b738a6"}, "description": "Get 835 ERA report"},
-    11: {"func": None, "method": "POST", "path": "/coordination-of-benefits", "description": "Submit coordination of benefits check"},
-    12: {"func": None, "method": "POST", "path": "/dental-claims/raw-x12-submission", "description": "Submit dental claim in raw X12 EDI format"},
-    13: {"func": None, "method": "POST", "path": "/dental-claims/submission", "description": "Submit dental claim in JSON format"},
-    14: {"func": None, "method": "GET", "path": "/export/pdf", "description": "Export PDF"},
-    15: {"func": None, "method": "GET", "path": "/export/{transactionId}/1500/pdf", "path_params": {"transactionId": "a10b1111-7233-484c-8dee-b240c590c767"}, "description": "Export 1500 form PDF"},
-    16: {"func": None, "method": "POST", "path": "/insurance-discovery/check/v1", "description": "Submit insurance discovery check"},
-    17: {"func": None, "method": "GET", "path": "/insurance-discovery/check/v1/{discoveryId}", "path_params": {"discoveryId": "12345678-abcd-4321-efgh-987654321abc"}, "description": "Get insurance discovery check result"},
-    18: {"func": None, "method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payer/{stediId}", "path_params": {"stediId": "QDTRP"}, "description": "Get payer information"},
-    19: {"func": None, "method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payers", "description": "List all payers"},
-    20: {"func": None, "method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payers/csv", "description": "Export payers as CSV"},
-    21: {"func": None, "method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payers/search", "description": "Search payers"},
-    22: {"func": None, "method": "GET", "path": "/electronic-remittance-advice/{transactionId}/pdf", "path_params": {"transactionId": "b12a1241-3312-a3dc-aed2-1a30ca50cd63"}, "description": "Get 835 ERA PDF"},
+    1: {"method": "POST", "path": "/change/medicalnetwork/claimstatus/v2", "description": "Submit a 276/277 real-time claim status check in JSON format", "retry": "safe"},
+    2: {"method": "POST", "path": "/change/medicalnetwork/claimstatus/v2/raw-x12", "description": "Submit a 276/277 real-time claim status check in raw X12 EDI format", "retry": "safe"},
+    3: {"method": "POST", "path": "/change/medicalnetwork/eligibility/v3", "description": "Submit a real-time 270/271 eligibility check in JSON format", "retry": "safe", "cache": "eligibility"},
+    4: {"method": "POST", "path": "/change/medicalnetwork/eligibility/v3/raw-x12", "description": "Submit a real-time 270/271 eligibility check in raw X12 EDI format", "retry": "safe", "cache": "eligibility-x12"},
+    5: {"method": "POST", "path": "/change/medicalnetwork/institutionalclaims/v1/raw-x12-submission", "description": "Submit an 837I institutional claim in raw X12 EDI format", "retry": "idempotency-key"},
+    6: {"method": "POST", "path": "/change/medicalnetwork/institutionalclaims/v1/submission", "description": "Submit an 837I institutional claim in JSON format", "retry": "idempotency-key"},
+    7: {"method": "POST", "path": "/change/medicalnetwork/professionalclaims/v3/raw-x12-submission", "description": "Submit an 837P professional claim in raw X12 EDI format", "retry": "idempotency-key"},
+    8: {"method": "POST", "path": "/change/medicalnetwork/professionalclaims/v3/submission", "description": "Submit an 837P professional claim in JSON format", "retry": "idempotency-key"},
+    9: {"method": "GET", "path": "/change/medicalnetwork/reports/v2/{transactionId}/277", "path_params": {"transactionId": "d567c2ae-f073-4725-8b8c-06c473b738a6"}, "description": "Get 277 claim acknowledgment report", "retry": "safe"},
+    10: {"method": "GET", "path": "/change/medicalnetwork/reports/v2/{transactionId}/835", "path_params": {"transactionId": "d567c2ae-f073-4725-8b8c-06c473b738a6"}, "description": "Get 835 ERA report", "retry": "safe"},
+    11: {"method": "POST", "path": "/coordination-of-benefits", "description": "Submit coordination of benefits check", "retry": "safe"},
+    12: {"method": "POST", "path": "/dental-claims/raw-x12-submission", "description": "Submit dental claim in raw X12 EDI format", "retry": "idempotency-key"},
+    13: {"method": "POST", "path": "/dental-claims/submission", "description": "Submit dental claim in JSON format", "retry": "idempotency-key"},
+    14: {"method": "GET", "path": "/export/pdf", "params": {"businessId": "123456789"}, "description": "Export PDF", "retry": "safe"},
+    15: {"method": "GET", "path": "/export/{transactionId}/1500/pdf", "path_params": {"transactionId": "a10b1111-7233-484c-8dee-b240c590c767"}, "description": "Export 1500 form PDF", "retry": "safe"},
+    16: {"method": "POST", "path": "/insurance-discovery/check/v1", "description": "Submit insurance discovery check", "retry": "idempotency-key"},
+    17: {"method": "GET", "path": "/insurance-discovery/check/v1/{discoveryId}", "path_params": {"discoveryId": "12345678-abcd-4321-efgh-987654321abc"}, "description": "Get insurance discovery check result", "retry": "safe"},
+    18: {"method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payer/{stediId}", "path_params": {"stediId": "QDTRP"}, "description": "Get payer information", "retry": "safe"},
+    19: {"method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payers", "description": "List all payers", "retry": "safe"},
+    20: {"method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payers/csv", "description": "Export payers as CSV", "retry": "safe"},
+    21: {"method": "GET", "base_url": PAYERS_BASE_URL, "path": "/payers/search", "description": "Search payers", "retry": "safe"},
+    22: {"method": "GET", "path": "/electronic-remittance-advice/{transactionId}/pdf", "path_params": {"transactionId": "b12a1241-3312-a3dc-aed2-1a30ca50cd63"}, "params": {"logo": True}, "description": "Get 835 ERA PDF", "retry": "safe"},
 }
 
+# Entries describe the whole request: "method", "path", optional "base_url",
+# sample "path_params" and query "params", extra "headers", and the JSON body
+# as either "payload" (a dict, attached below next to each request),
+# "payload_factory" (a function, for X12 bodies with fresh control numbers) or
+# "payload_file" (a JSON fixture read on first use, see load_registry()).
+# Each entry may set "rate_limit": {"rate": ..., "burst": ..., "max_concurrency": ...}
+# to override the stedi_ratelimit defaults for its path. "retry" is one of
+# stedi_retry.RETRY_CLASSES: "safe", "idempotency-key" or "unsafe". "cache"
+# names a stedi_cache.FINGERPRINTS entry used to cache eligibility answers.
+stedi_ratelimit.limiter.configure_from_requests(REQUESTS)
+stedi_retry.registry.configure_from_requests(REQUESTS)
+stedi_cache.cache.configure_from_requests(REQUESTS)
+stedi_metrics.metrics.configure_from_requests(REQUESTS)
+
 
 REQUEST_DOC_PATHS: Dict[int, str] = {
     1: "/docs/healthcare/api-reference/post-healthcare-claim-status",
@@ -124,154 +163,277 @@ def get_request_url(request_id: int, resolve_examples: bool = False) -> str:
 
 def get_request_docs_url(request_id: int) -> str:
     """Return the Stedi documentation page for a registered request."""
+    if request_id not in REQUEST_DOC_PATHS:
+        return API_REFERENCE_URL
     return f"{DOCS_BASE_URL}{REQUEST_DOC_PATHS[request_id]}"
 
 
-# Request 1: POST /change/medicalnetwork/claimstatus/v2
-def request_1():
-    """"""
-    url = f"{BASE_URL}/change/medicalnetwork/claimstatus/v2"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
+def set_base_urls(healthcare: Optional[str] = None, payers: Optional[str] = None) -> None:
+    """Send requests to other hosts, such as a local mock_stedi_server."""
+    global BASE_URL, HEALTHCARE_BASE_URL, PAYERS_BASE_URL
+    if payers:
+        for req_info in REQUESTS.values():
+            if req_info.get("base_url") == PAYERS_BASE_URL:
+                req_info["base_url"] = payers
+        PAYERS_BASE_URL = payers
+    if healthcare:
+        BASE_URL = HEALTHCARE_BASE_URL = healthcare
+
+
+def load_registry(path: str) -> Dict[int, Dict[str, Any]]:
+    """Read a registry module written by generate_sample_requests.py into REQUESTS-style entries.
+
+    Only the metadata table is imported; each "payload_file" is resolved
+    against the module's fixtures directory and read by
+    get_default_payload() the first time that payload is used.
+    """
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("_stedi_generated_registry", path)
+    if spec is None:
+        raise ValueError(f"{path} is not a Python module")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(path)), module.FIXTURES_DIR)
+    registry = {}
+    for request_id, entry in module.REQUESTS.items():
+        req_info = dict(entry)
+        if req_info.get("base_url") == HEALTHCARE_BASE_URL:
+            # Follow BASE_URL, so set_base_urls() also redirects these.
+            del req_info["base_url"]
+        if "payload_file" in req_info:
+            req_info["payload_file"] = os.path.join(fixtures_dir, req_info["payload_file"])
+        registry[request_id] = req_info
+    return registry
+
+
+def use_registry(registry: Dict[int, Dict[str, Any]]) -> None:
+    """Replace REQUESTS with another registry, such as one from load_registry()."""
+    REQUESTS.clear()
+    REQUESTS.update(registry)
+    # The documentation pages are those of the built-in request IDs.
+    REQUEST_DOC_PATHS.clear()
+    stedi_ratelimit.limiter.configure_from_requests(REQUESTS)
+    stedi_retry.registry.configure_from_requests(REQUESTS)
+    stedi_cache.cache.configure_from_requests(REQUESTS)
+    stedi_metrics.metrics.configure_from_requests(REQUESTS)
+
+
+def read_ids(ids: List[str], ids_file: Optional[str]) -> List[str]:
+    """Combine IDs from the command line and an optional file with one ID per line, dropping duplicates."""
+    all_ids = list(ids)
+    if ids_file:
+        with open(ids_file) as f:
+            all_ids.extend(line.strip() for line in f if line.strip())
+    return list(dict.fromkeys(all_ids))
+
+
+def get_request_function(request_id: int) -> Optional[Callable[[], Any]]:
+    """Return the request_N function for a registered request."""
+    return globals().get(f"request_{request_id}")
+
+
+def _copy_payload(value: Any) -> Any:
+    """Copy a JSON-shaped value; several times faster than copy.deepcopy."""
+    if type(value) is dict:
+        return {key: _copy_payload(item) for key, item in value.items()}
+    if type(value) is list:
+        return [_copy_payload(item) for item in value]
+    return value
+
+
+def get_default_payload(request_id: int) -> Any:
+    """Return a fresh copy of the sample JSON body for a request, or None if it has none."""
+    req_info = REQUESTS[request_id]
+    if "payload_factory" in req_info:
+        return req_info["payload_factory"]()
+    if "payload_file" in req_info and "payload" not in req_info:
+        with open(req_info["payload_file"]) as f:
+            req_info["payload"] = json.load(f)
+    if "payload" in req_info:
+        return _copy_payload(req_info["payload"])
+    return None
+
+
+def build_request(
+    request_id: int,
+    payload: Any = None,
+    path_params: Optional[Dict[str, str]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Return the method, URL and send() keyword arguments for a registered request.
+
+    A non-None ``payload`` replaces the sample JSON body, ``path_params``
+    replace the sample path parameters, and ``params`` and ``headers`` are
+    merged into the registered query parameters and headers.
+    """
+    if request_id not in REQUESTS:
+        raise ValueError(f"Request {request_id} not found.")
+    req_info = REQUESTS[request_id]
+
+    url = get_request_url(request_id)
+    for name, value in {**req_info.get("path_params", {}), **(path_params or {})}.items():
+        url = url.replace(f"{{{name}}}", str(value))
+
+    kwargs: Dict[str, Any] = {
+        "headers": {
+            "Authorization": get_api_key(),
+            "Content-Type": "application/json",
+            **req_info.get("headers", {}),
+            **(headers or {}),
+        }
     }
-    payload = {
-        "encounter": {
-                "beginningDateOfService": "20250630",
-                "endDateOfService": "20250702"
-        },
-        "providers": [
-                {
-                        "providerType": "BillingProvider",
-                        "npi": "1999999984",
-                        "organizationName": "Provider Name"
-                }
-        ],
-        "subscriber": {
-                "dateOfBirth": "19710101",
-                "firstName": "Jane",
-                "lastName": "Doe",
-                "memberId": "UHC123456"
+    if payload is None:
+        payload = get_default_payload(request_id)
+    if payload is not None:
+        kwargs["json"] = payload
+    if req_info.get("params") or params:
+        kwargs["params"] = {**req_info.get("params", {}), **(params or {})}
+    return {"method": req_info["method"], "url": url, "kwargs": kwargs}
+
+
+def execute_request(request_id: int, **overrides: Any) -> Any:
+    """Send a registered request; ``overrides`` are passed to build_request()."""
+    import stedi_client
+
+    call = build_request(request_id, **overrides)
+    return stedi_client.send(call["method"], call["url"], **call["kwargs"])
+
+
+def prewarm_connections(connections: int = 1, background: bool = False) -> None:
+    """Open pooled keep-alive connections to the healthcare and payers hosts."""
+    import stedi_client
+
+    stedi_client.prewarm([HEALTHCARE_BASE_URL, PAYERS_BASE_URL], connections=connections, background=background)
+
+
+# Request 1: POST /change/medicalnetwork/claimstatus/v2
+REQUESTS[1]["payload"] = {
+    "encounter": {
+        "beginningDateOfService": "20250630",
+        "endDateOfService": "20250702",
+    },
+    "providers": [
+        {
+            "providerType": "BillingProvider",
+            "npi": "1999999984",
+            "organizationName": "Provider Name",
         },
-        "tradingPartnerServiceId": "87726"
+    ],
+    "subscriber": {
+        "dateOfBirth": "19710101",
+        "firstName": "Jane",
+        "lastName": "Doe",
+        "memberId": "UHC123456",
+    },
+    "tradingPartnerServiceId": "87726",
 }
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+
+
+def request_1():
+    """"""
+    return execute_request(1)
 
 
 # Request 2: POST /change/medicalnetwork/claimstatus/v2/raw-x12
+def _request_2_payload() -> Dict[str, Any]:
+    # X12 276 Health Care Claim Status Request from the current Stedi spec.
+    transaction = x12_builder.build_276(
+        payer={"name": "UNITEDHEALTHCARE", "id": "87726"},
+        information_receiver={"organizationName": "PROVIDER NAME", "taxId": "123456789"},
+        provider={"organizationName": "PROVIDER NAME", "npi": "1999999984"},
+        subscriber={"lastName": "DOE", "firstName": "JANE", "memberId": "UHC123456", "dateOfBirth": "19710101"},
+        trace_number="123456789",
+        beginning_date_of_service="20250630",
+        end_date_of_service="20250702",
+        reference="ABC276XXX",
+    )
+    x12_content = x12_builder.build_interchange(
+        "276",
+        [transaction],
+        sender_id="SENDER",
+        receiver_id="RECEIVER",
+        application_sender_id="SENDERGS",
+        application_receiver_id="RECEIVERGS",
+        usage_indicator=get_usage_indicator(),
+    )
+    return {"x12": x12_content}
+
+
+REQUESTS[2]["payload_factory"] = _request_2_payload
+
+
 def request_2():
     """"""
-    url = f"{BASE_URL}/change/medicalnetwork/claimstatus/v2/raw-x12"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    # X12 276 Health Care Claim Status Request from the current Stedi spec.
-    x12_content = """ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECEIVER       *250916*2048*^*00501*000000001*0*T*>~
-GS*HR*SENDERGS*RECEIVERGS*20250916*204811*1*X*005010X212~
-ST*276*0001*005010X212~
-BHT*0010*13*ABC276XXX*20250915*1425~
-HL*1**20*1~
-NM1*PR*2*UNITEDHEALTHCARE*****PI*87726~
-HL*2*1*21*1~
-NM1*41*2*PROVIDER NAME*****46*123456789~
-HL*3*2*19*1~
-NM1*1P*2*PROVIDER NAME*****XX*1999999984~
-HL*4*3*22*0~
-DMG*D8*19710101~
-NM1*IL*1*DOE*JANE****MI*UHC123456~
-TRN*1*123456789~
-DTP*472*RD8*20250630-20250702~
-SE*14*0001~
-GE*1*1~
-IEA*1*000000001~"""
-    
-    payload = {
-        "x12": x12_content
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+    return execute_request(2)
 
 
 # Request 3: POST /change/medicalnetwork/eligibility/v3
+REQUESTS[3]["payload"] = {
+    "encounter": {
+        "serviceTypeCodes": [
+            "MH",
+        ],
+    },
+    "externalPatientId": "UAA111222333",
+    "provider": {
+        "npi": "1999999984",
+        "organizationName": "ACME Health Services",
+    },
+    "subscriber": {
+        "dateOfBirth": "19000101",
+        "firstName": "Jane",
+        "lastName": "Doe",
+        "memberId": "123456789",
+    },
+    "tradingPartnerServiceId": "AHS",
+}
+
+
 def request_3():
     """"""
-    url = f"{BASE_URL}/change/medicalnetwork/eligibility/v3"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "encounter": {
-                "serviceTypeCodes": [
-                        "MH"
-                ]
-        },
-        "externalPatientId": "UAA111222333",
-        "provider": {
-                "npi": "1999999984",
-                "organizationName": "ACME Health Services"
-        },
-        "subscriber": {
-                "dateOfBirth": "19000101",
-                "firstName": "Jane",
-                "lastName": "Doe",
-                "memberId": "123456789",
-        },
-        "tradingPartnerServiceId": "AHS"
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+    return execute_request(3)
 
 
 # Request 4: POST /change/medicalnetwork/eligibility/v3/raw-x12
+def _request_4_payload() -> Dict[str, Any]:
+    # X12 270 Health Care Eligibility Benefit Inquiry from the current Stedi spec.
+    transaction = x12_builder.build_270(
+        payer={"name": "ABCDE", "id": "11122"},
+        provider={"organizationName": "ACME HEALTH SERVICES", "npi": "1999999984", "idQualifier": "SV"},
+        subscriber={"lastName": "JANE", "firstName": "DOE", "memberId": "123456789", "dateOfBirth": "19000101"},
+        service_type_codes=["MH"],
+        date_of_service="20240108",
+        trace_number="11122-12345",
+        trace_originator="1234567890",
+        reference="10001234",
+    )
+    x12_content = x12_builder.build_interchange(
+        "270",
+        [transaction],
+        sender_id="SENDER",
+        receiver_id="RECEIVER",
+        application_sender_id="SENDERGS",
+        application_receiver_id="RECEIVERGS",
+        usage_indicator=get_usage_indicator(),
+    )
+    return {"x12": x12_content}
+
+
+REQUESTS[4]["payload_factory"] = _request_4_payload
+
+
 def request_4():
     """"""
-    url = f"{BASE_URL}/change/medicalnetwork/eligibility/v3/raw-x12"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    # X12 270 Health Care Eligibility Benefit Inquiry from the current Stedi spec.
-    x12_content = """ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECEIVER       *231106*1406*^*00501*000000001*0*T*>~
-GS*HS*SENDERGS*RECEIVERGS*20231106*140631*000000001*X*005010X279A1~
-ST*270*1234*005010X279A1~
-BHT*0022*13*10001234*20240321*1319~
-HL*1**20*1~
-NM1*PR*2*ABCDE*****PI*11122~
-HL*2*1*21*1~
-NM1*1P*2*ACME HEALTH SERVICES*****SV*1999999984~
-HL*3*2*22*0~
-TRN*1*11122-12345*1234567890~
-NM1*IL*1*JANE*DOE****MI*123456789~
-DMG*D8*19000101~
-DTP*291*D8*20240108~
-EQ*MH~
-SE*13*1234~
-GE*1*000000001~
-IEA*1*000000001~"""
-    
-    payload = {
-        "x12": x12_content
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+    return execute_request(4)
 
 
 # Request 5: POST /change/medicalnetwork/institutionalclaims/v1/raw-x12-submission
-def request_5():
-    """"""
-    url = f"{BASE_URL}/change/medicalnetwork/institutionalclaims/v1/raw-x12-submission"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    # Basic X12 837I Institutional Claim
-    x12_content = """ISA*00*          *00*          *ZZ*STEDI          *01*123456789      *250101*1200*^*00501*000000001*0*P*:~
-GS*HC*STEDI*123456789*20250101*1200*1*X*005010X223A2~
-ST*837*0001*005010X223A2~
-BHT*0019*00*TEST123456*20250101*1200*CH~
+def _request_5_payload() -> Dict[str, Any]:
+    # Basic X12 837I Institutional Claim. The envelope and SE count are generated.
+    transaction = """BHT*0019*00*TEST123456*20250101*1200*CH~
 NM1*41*2*EXAMPLE RECEIVER*****46*10379~
 PER*IC*CONTACT*TE*5551234567~
 NM1*40*2*EXAMPLE SUBMITTER*****46*123456789~
@@ -288,147 +450,146 @@ N3*456 PATIENT ST~
 N4*CITY*ST*12345~
 DMG*D8*19800101*M~
 NM1*PR*2*10379*****PI*10379~
-CLM*123456*100.00***11:A:1**A*Y*Y~
+CLM*123456*100.00***11>A>1**A*Y*Y~
 DTP*434*RD8*20250101-20250101~
 DTP*435*D8*20250101~
 CL1*1*1*01~
 REF*D9*123456~
-HI*BK:Z0000~
+HI*BK>Z0000~
 LX*1~
-SV2*0450*HC:99213*100.00*UN*1~
-DTP*472*D8*20250101~
-SE*28*0001~
-GE*1*1~
-IEA*1*000000001~"""
-    
-    payload = {
-        "x12": x12_content
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+SV2*0450*HC>99213*100.00*UN*1~
+DTP*472*D8*20250101~"""
+    x12_content = x12_builder.build_interchange(
+        "837I",
+        [transaction],
+        sender_id="STEDI",
+        receiver_id="123456789",
+        receiver_qualifier="01",
+        usage_indicator=get_usage_indicator(),
+    )
+    return {"x12": x12_content}
 
 
-# Request 6: POST /change/medicalnetwork/institutionalclaims/v1/submission
-def request_6():
+REQUESTS[5]["payload_factory"] = _request_5_payload
+
+
+def request_5():
     """"""
-    url = f"{BASE_URL}/change/medicalnetwork/institutionalclaims/v1/submission"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    payload = {
+    return execute_request(5)
+
+
+# Request 6: POST /change/medicalnetwork/institutionalclaims/v1/submission
+def _request_6_payload() -> Dict[str, Any]:
+    return {
         "usageIndicator": get_usage_indicator(),
         "tradingPartnerName": "EXAMPLE PAYER",
         "tradingPartnerServiceId": "10379",
         "submitter": {
-                "organizationName": "EXAMPLE",
-                "contactInformation": {
-                        "name": "EXAMPLE CONTACT",
-                        "phoneNumber": "5551234567"
-                },
-                "taxId": "123456789"
+            "organizationName": "EXAMPLE",
+            "contactInformation": {
+                "name": "EXAMPLE CONTACT",
+                "phoneNumber": "5551234567",
+            },
+            "taxId": "123456789",
         },
         "receiver": {
-                "organizationName": "EXAMPLE"
+            "organizationName": "EXAMPLE",
         },
         "subscriber": {
-                "memberId": "123456789",
-                "paymentResponsibilityLevelCode": "P",
-                "firstName": "EXAMPLE",
-                "lastName": "EXAMPLE",
-                "gender": "M",
-                "dateOfBirth": "19800101",
-                "address": {
-                        "address1": "123 MAIN ST",
-                        "city": "ANYTOWN",
-                        "state": "NY",
-                        "postalCode": "100011234"
-                }
+            "memberId": "123456789",
+            "paymentResponsibilityLevelCode": "P",
+            "firstName": "EXAMPLE",
+            "lastName": "EXAMPLE",
+            "gender": "M",
+            "dateOfBirth": "19800101",
+            "address": {
+                "address1": "123 MAIN ST",
+                "city": "ANYTOWN",
+                "state": "NY",
+                "postalCode": "100011234",
+            },
         },
         "claimInformation": {
-                "claimFilingCode": "ZZ",
-                "patientControlNumber": "123456",
-                "claimChargeAmount": "100.00",
-                "placeOfServiceCode": "11",
-                "claimFrequencyCode": "0",
-                "planParticipationCode": "C",
-                "benefitsAssignmentCertificationIndicator": "Y",
-                "releaseInformationCode": "Y",
-                "principalDiagnosis": {
-                        "qualifierCode": "ABK",
-                        "principalDiagnosisCode": "Z0000"
-                },
-                "serviceLines": [
-                        {
-                                "assignedNumber": "0",
-                                "serviceDate": "20240101",
-                                "serviceDateEnd": "20240101",
-                                "lineItemControlNumber": "111222333",
-                                "institutionalService": {
-                                        "serviceLineRevenueCode": "0450",
-                                        "lineItemChargeAmount": "100.00",
-                                        "measurementUnit": "UN",
-                                        "serviceUnitCount": "1",
-                                        "procedureIdentifier": "HC",
-                                        "procedureCode": "99213"
-                                }
-                        }
-                ],
-                "claimCodeInformation": {
-                        "admissionTypeCode": "1",
-                        "admissionSourceCode": "7",
-                        "patientStatusCode": "01"
+            "claimFilingCode": "ZZ",
+            "patientControlNumber": "123456",
+            "claimChargeAmount": "100.00",
+            "placeOfServiceCode": "11",
+            "claimFrequencyCode": "0",
+            "planParticipationCode": "C",
+            "benefitsAssignmentCertificationIndicator": "Y",
+            "releaseInformationCode": "Y",
+            "principalDiagnosis": {
+                "qualifierCode": "ABK",
+                "principalDiagnosisCode": "Z0000",
+            },
+            "serviceLines": [
+                {
+                    "assignedNumber": "0",
+                    "serviceDate": "20240101",
+                    "serviceDateEnd": "20240101",
+                    "lineItemControlNumber": "111222333",
+                    "institutionalService": {
+                        "serviceLineRevenueCode": "0450",
+                        "lineItemChargeAmount": "100.00",
+                        "measurementUnit": "UN",
+                        "serviceUnitCount": "1",
+                        "procedureIdentifier": "HC",
+                        "procedureCode": "99213",
+                    },
                 },
-                "claimDateInformation": {
-                        "admissionDateAndHour": "202401010800",
-                        "statementBeginDate": "20240101",
-                        "statementEndDate": "20240101"
-                }
+            ],
+            "claimCodeInformation": {
+                "admissionTypeCode": "1",
+                "admissionSourceCode": "7",
+                "patientStatusCode": "01",
+            },
+            "claimDateInformation": {
+                "admissionDateAndHour": "202401010800",
+                "statementBeginDate": "20240101",
+                "statementEndDate": "20240101",
+            },
         },
         "providers": [
-                {
-                        "providerType": "BillingProvider",
-                        "npi": "1932808896",
-                        "employerId": "123456789",
-                        "organizationName": "EXAMPLE BILLING PROVIDER",
-                        "address": {
-                                "address1": "123 BILLING ST",
-                                "city": "ANYTOWN",
-                                "state": "NY",
-                                "postalCode": "100011234"
-                        },
-                        "contactInformation": {
-                                "name": "EXAMPLE BILLING PROVIDER",
-                                "phoneNumber": "5551234567"
-                        }
+            {
+                "providerType": "BillingProvider",
+                "npi": "1932808896",
+                "employerId": "123456789",
+                "organizationName": "EXAMPLE BILLING PROVIDER",
+                "address": {
+                    "address1": "123 BILLING ST",
+                    "city": "ANYTOWN",
+                    "state": "NY",
+                    "postalCode": "100011234",
                 },
-                {
-                        "providerType": "AttendingProvider",
-                        "npi": "1003000126",
-                        "firstName": "JANE",
-                        "lastName": "DOE",
-                        "contactInformation": {
-                                "name": "JANE DOE"
-                        }
-                }
-        ]
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+                "contactInformation": {
+                    "name": "EXAMPLE BILLING PROVIDER",
+                    "phoneNumber": "5551234567",
+                },
+            },
+            {
+                "providerType": "AttendingProvider",
+                "npi": "1003000126",
+                "firstName": "JANE",
+                "lastName": "DOE",
+                "contactInformation": {
+                    "name": "JANE DOE",
+                },
+            },
+        ],
+    }
 
 
-# Request 7: POST /change/medicalnetwork/professionalclaims/v3/raw-x12-submission
-def request_7():
+REQUESTS[6]["payload_factory"] = _request_6_payload
+
+
+def request_6():
     """"""
-    url = f"{BASE_URL}/change/medicalnetwork/professionalclaims/v3/raw-x12-submission"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    x12_content = """ISA*00*          *00*          *ZZ*574183004559   *ZZ*STEDITEST      *260213*2039*^*00501*000000039*0*T*>~
-GS*HC*574183004559*STEDITEST*20260213*203918*39*X*005010X222A1~
-ST*837*0001*005010X222A1~
-BHT*0019*00*01KHCBK84E40QQYJVXA5VVXG54*20260213*2038*CH~
+    return execute_request(6)
+
+
+# Request 7: POST /change/medicalnetwork/professionalclaims/v3/raw-x12-submission
+def _request_7_payload() -> Dict[str, Any]:
+    transaction = """BHT*0019*00*01KHCBK84E40QQYJVXA5VVXG54*20260213*2038*CH~
 NM1*41*2*Test Data Health Services, Inc.*****46*123435~
 PER*IC**TE*5552223333~
 NM1*40*2*Cigna*****46*6400~
@@ -454,175 +615,154 @@ N4*A City*NY*123450000~
 LX*1~
 SV1*HC>90837>95*109.2*UN*1***1~
 DTP*472*D8*20240101~
-REF*6R*111222333~
-SE*29*0001~
-GE*1*39~
-IEA*1*000000039~"""
-    payload = {
-        "x12": x12_content
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+REF*6R*111222333~"""
+    x12_content = x12_builder.build_interchange(
+        "837P",
+        [transaction],
+        sender_id="574183004559",
+        receiver_id="STEDITEST",
+        usage_indicator=get_usage_indicator(),
+    )
+    return {"x12": x12_content}
 
 
-# Request 8: POST /change/medicalnetwork/professionalclaims/v3/submission
-def request_8():
+REQUESTS[7]["payload_factory"] = _request_7_payload
+
+
+def request_7():
     """"""
-    url = f"{BASE_URL}/change/medicalnetwork/professionalclaims/v3/submission"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    payload = {
+    return execute_request(7)
+
+
+# Request 8: POST /change/medicalnetwork/professionalclaims/v3/submission
+def _request_8_payload() -> Dict[str, Any]:
+    return {
         "billing": {
-                "npi": "1932808896",
-                "organizationName": "EXAMPLE BILLING PROVIDER",
-                "employerId": "123456789",
-                "address": {
-                        "address1": "123 BILLING ST",
-                        "city": "ANYTOWN",
-                        "state": "NY",
-                        "postalCode": "10001"
-                }
+            "npi": "1932808896",
+            "organizationName": "EXAMPLE BILLING PROVIDER",
+            "employerId": "123456789",
+            "address": {
+                "address1": "123 BILLING ST",
+                "city": "ANYTOWN",
+                "state": "NY",
+                "postalCode": "10001",
+            },
         },
         "claimInformation": {
-                "benefitsAssignmentCertificationIndicator": "N",
-                "claimChargeAmount": "100.00",
-                "claimFilingCode": "11",
-                "claimFrequencyCode": "1",
-                "healthCareCodeInformation": [
-                        {
-                                "diagnosisCode": "Z0000",
-                                "diagnosisTypeCode": "BK"
-                        }
-                ],
-                "patientControlNumber": "123456",
-                "placeOfServiceCode": "01",
-                "planParticipationCode": "A",
-                "releaseInformationCode": "I",
-                "serviceLines": [
-                        {
-                                "professionalService": {
-                                        "compositeDiagnosisCodePointers": {
-                                                "diagnosisCodePointers": [
-                                                        "1"
-                                                ]
-                                        },
-                                        "lineItemChargeAmount": "100.00",
-                                        "measurementUnit": "UN",
-                                        "procedureCode": "99213",
-                                        "procedureIdentifier": "ER",
-                                        "serviceUnitCount": "1"
-                                },
-                                "serviceDate": "20240101"
-                        }
-                ],
-                "signatureIndicator": "N"
+            "benefitsAssignmentCertificationIndicator": "N",
+            "claimChargeAmount": "100.00",
+            "claimFilingCode": "11",
+            "claimFrequencyCode": "1",
+            "healthCareCodeInformation": [
+                {
+                    "diagnosisCode": "Z0000",
+                    "diagnosisTypeCode": "BK",
+                },
+            ],
+            "patientControlNumber": "123456",
+            "placeOfServiceCode": "01",
+            "planParticipationCode": "A",
+            "releaseInformationCode": "I",
+            "serviceLines": [
+                {
+                    "professionalService": {
+                        "compositeDiagnosisCodePointers": {
+                            "diagnosisCodePointers": [
+                                "1",
+                            ],
+                        },
+                        "lineItemChargeAmount": "100.00",
+                        "measurementUnit": "UN",
+                        "procedureCode": "99213",
+                        "procedureIdentifier": "ER",
+                        "serviceUnitCount": "1",
+                    },
+                    "serviceDate": "20240101",
+                },
+            ],
+            "signatureIndicator": "N",
         },
         "receiver": {
-                "organizationName": "EXAMPLE"
+            "organizationName": "EXAMPLE",
         },
         "submitter": {
-                "organizationName": "EXAMPLE SUBMITTER",
-                "contactInformation": {
-                        "name": "EXAMPLE CONTACT",
-                        "phoneNumber": "5551234567"
-                }
+            "organizationName": "EXAMPLE SUBMITTER",
+            "contactInformation": {
+                "name": "EXAMPLE CONTACT",
+                "phoneNumber": "5551234567",
+            },
         },
         "subscriber": {
-                "firstName": "JOHN",
-                "lastName": "DOE",
-                "memberId": "123456789",
-                "dateOfBirth": "19800101",
-                "gender": "M",
-                "address": {
-                        "address1": "123 MAIN ST",
-                        "city": "ANYTOWN",
-                        "state": "NY",
-                        "postalCode": "10001"
-                }
+            "firstName": "JOHN",
+            "lastName": "DOE",
+            "memberId": "123456789",
+            "dateOfBirth": "19800101",
+            "gender": "M",
+            "address": {
+                "address1": "123 MAIN ST",
+                "city": "ANYTOWN",
+                "state": "NY",
+                "postalCode": "10001",
+            },
         },
         "tradingPartnerServiceId": "10379",
-        "usageIndicator": get_usage_indicator()
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+        "usageIndicator": get_usage_indicator(),
+    }
+
+
+REQUESTS[8]["payload_factory"] = _request_8_payload
+
+
+def request_8():
+    """"""
+    return execute_request(8)
 
 
 # Request 9: GET /change/medicalnetwork/reports/v2/{transactionId}/277
 def request_9():
     """"""
-    # Replace this with the processed 277 transactionId from Stedi.
-    transaction_id = "d567c2ae-f073-4725-8b8c-06c473b738a6"
-    url = f"{BASE_URL}/change/medicalnetwork/reports/v2/{transaction_id}/277"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(9)
 
 
 # Request 10: GET /change/medicalnetwork/reports/v2/{transactionId}/835
 def request_10():
     """"""
-    # Replace this with the processed 835 transactionId from Stedi.
-    transaction_id = "d567c2ae-f073-4725-8b8c-06c473b738a6"
-    url = f"{BASE_URL}/change/medicalnetwork/reports/v2/{transaction_id}/835"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(10)
 
 
 # Request 11: POST /coordination-of-benefits
+REQUESTS[11]["payload"] = {
+    "dependent": {
+        "dateOfBirth": "2002-12-31",
+        "firstName": "Jordan",
+        "lastName": "Doe",
+    },
+    "encounter": {
+        "dateOfService": "2024-08-02",
+        "serviceTypeCode": "30",
+    },
+    "provider": {
+        "npi": "1932808896",
+        "organizationName": "ACME Health Services",
+    },
+    "subscriber": {
+        "dateOfBirth": "1985-05-27",
+        "firstName": "John",
+        "lastName": "Doe",
+        "memberId": "W000000000",
+    },
+    "tradingPartnerServiceId": "SOMEID",
+}
+
+
 def request_11():
     """"""
-    url = f"{BASE_URL}/coordination-of-benefits"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "dependent": {
-                "dateOfBirth": "2002-12-31",
-                "firstName": "Jordan",
-                "lastName": "Doe"
-        },
-        "encounter": {
-                "dateOfService": "2024-08-02",
-                "serviceTypeCode": "30"
-        },
-        "provider": {
-                "npi": "1932808896",
-                "organizationName": "ACME Health Services"
-        },
-        "subscriber": {
-                "dateOfBirth": "1985-05-27",
-                "firstName": "John",
-                "lastName": "Doe",
-                "memberId": "W000000000"
-        },
-        "tradingPartnerServiceId": "SOMEID"
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+    return execute_request(11)
 
 
 # Request 12: POST /dental-claims/raw-x12-submission
-def request_12():
-    """"""
-    url = f"{BASE_URL}/dental-claims/raw-x12-submission"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    x12_content = """ISA*00*          *00*          *ZZ*574183004559   *ZZ*STEDITEST      *260213*2050*^*00501*000000042*0*T*>~
-GS*HC*574183004559*STEDITEST*20260213*205048*42*X*005010X224A2~
-ST*837*0001*005010X224A2~
-BHT*0019*00*01KHCCA4V6K00NFPX588G859SJ*20260213*2050*CH~
+def _request_12_payload() -> Dict[str, Any]:
+    transaction = """BHT*0019*00*01KHCCA4V6K00NFPX588G859SJ*20260213*2050*CH~
 NM1*41*2*ABA Inc*****46*1234567~
 PER*IC*BILLING DEPARTMENT*TE*3131234567~
 NM1*40*2*United HealthCare Dental*****46*52133~
@@ -654,216 +794,167 @@ TOO*JP*3*M>O~
 DTP*472*D8*20230428~
 REF*6R*a0UDo000000dd2dMAA~
 NM1*82*1*Doe*Jane****XX*1999999992~
-PRV*PE*PXC*122300000X~
-SE*35*0001~
-GE*1*42~
-IEA*1*000000042~"""
-    payload = {
-        "x12": x12_content
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+PRV*PE*PXC*122300000X~"""
+    x12_content = x12_builder.build_interchange(
+        "837D",
+        [transaction],
+        sender_id="574183004559",
+        receiver_id="STEDITEST",
+        usage_indicator=get_usage_indicator(),
+    )
+    return {"x12": x12_content}
+
+
+REQUESTS[12]["payload_factory"] = _request_12_payload
+
+
+def request_12():
+    """"""
+    return execute_request(12)
 
 
 # Request 13: POST /dental-claims/submission
+REQUESTS[13]["payload"] = {
+    "billing": {},
+    "claimInformation": {
+        "benefitsAssignmentCertificationIndicator": "N",
+        "claimChargeAmount": "example",
+        "claimFrequencyCode": "1",
+        "patientControlNumber": "123456",
+        "placeOfServiceCode": "01",
+        "releaseInformationCode": "I",
+        "serviceLines": [
+            {
+                "dentalService": {
+                    "lineItemChargeAmount": "example",
+                    "procedureCode": "example",
+                },
+            },
+        ],
+        "signatureIndicator": "N",
+    },
+    "receiver": {
+        "organizationName": "EXAMPLE",
+    },
+    "submitter": {
+        "contactInformation": {},
+    },
+    "subscriber": {
+        "firstName": "JOHN",
+        "lastName": "DOE",
+        "memberId": "123456789",
+    },
+    "tradingPartnerServiceId": "10379",
+}
+
+
 def request_13():
     """"""
-    url = f"{BASE_URL}/dental-claims/submission"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "billing": {},
-        "claimInformation": {
-                "benefitsAssignmentCertificationIndicator": "N",
-                "claimChargeAmount": "example",
-                "claimFrequencyCode": "1",
-                "patientControlNumber": "123456",
-                "placeOfServiceCode": "01",
-                "releaseInformationCode": "I",
-                "serviceLines": [
-                        {
-                                "dentalService": {
-                                        "lineItemChargeAmount": "example",
-                                        "procedureCode": "example"
-                                }
-                        }
-                ],
-                "signatureIndicator": "N"
-        },
-        "receiver": {
-                "organizationName": "EXAMPLE"
-        },
-        "submitter": {
-                "contactInformation": {}
-        },
-        "subscriber": {
-                "firstName": "JOHN",
-                "lastName": "DOE",
-                "memberId": "123456789"
-        },
-        "tradingPartnerServiceId": "10379"
-}
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+    return execute_request(13)
 
 
 # Request 14: GET /export/pdf
 def request_14():
     """"""
-    url = f"{BASE_URL}/export/pdf"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    params = {
-        "businessId": "123456789"
-}
-    response = requests.get(url, headers=headers, params=params)
-    return response
+    return execute_request(14)
 
 
 # Request 15: GET /export/{transactionId}/1500/pdf
 def request_15():
     """"""
-    # Replace this with the processed professional claim transactionId from Stedi.
-    transaction_id = "a10b1111-7233-484c-8dee-b240c590c767"
-    url = f"{BASE_URL}/export/{transaction_id}/1500/pdf"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(15)
 
 
 # Request 16: POST /insurance-discovery/check/v1
-def request_16():
-    """"""
-    url = f"{BASE_URL}/insurance-discovery/check/v1"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "encounter": {
-                "beginningDateOfService": "20240326",
-                "endDateOfService": "20240326"
+REQUESTS[16]["payload"] = {
+    "encounter": {
+        "beginningDateOfService": "20240326",
+        "endDateOfService": "20240326",
+    },
+    "provider": {
+        "npi": "1999999984",
+    },
+    "subscriber": {
+        "address": {
+            "address1": "123 Main St",
+            "city": "Springfield",
+            "postalCode": "62701",
+            "state": "IL",
         },
-        "provider": {
-                "npi": "1999999984"
-        },
-        "subscriber": {
-                "address": {
-                        "address1": "123 Main St",
-                        "city": "Springfield",
-                        "postalCode": "62701",
-                        "state": "IL"
-                },
-                "dateOfBirth": "19800101",
-                "firstName": "John",
-                "gender": "M",
-                "lastName": "Smith",
-                "middleName": "Robert",
-                "ssn": "123456789"
-        }
+        "dateOfBirth": "19800101",
+        "firstName": "John",
+        "gender": "M",
+        "lastName": "Smith",
+        "middleName": "Robert",
+        "ssn": "123456789",
+    },
 }
-    response = requests.post(url, headers=headers, json=payload)
-    return response
+
+
+def request_16():
+    """"""
+    return execute_request(16)
 
 
 # Request 17: GET /insurance-discovery/check/v1/{discoveryId}
 def request_17():
     """"""
-    discovery_id = "12345678-abcd-4321-efgh-987654321abc"
-    url = f"{BASE_URL}/insurance-discovery/check/v1/{discovery_id}"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(17)
 
 
 # Request 18: GET /payer/{stediId}
 def request_18():
     """"""
-    stedi_id = "QDTRP"
-    url = f"{PAYERS_BASE_URL}/payer/{stedi_id}"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(18)
 
 
 # Request 19: GET /payers
 def request_19():
     """"""
-    url = f"{PAYERS_BASE_URL}/payers"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(19)
 
 
 # Request 20: GET /payers/csv
 def request_20():
     """"""
-    url = f"{PAYERS_BASE_URL}/payers/csv"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(20)
 
 
 # Request 21: GET /payers/search
 def request_21():
     """"""
-    url = f"{PAYERS_BASE_URL}/payers/search"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    response = requests.get(url, headers=headers)
-    return response
+    return execute_request(21)
 
 
 # Request 22: GET /electronic-remittance-advice/{transactionId}/pdf
 def request_22():
     """"""
-    # Replace this with the processed 835 ERA transactionId from Stedi.
-    transaction_id = "b12a1241-3312-a3dc-aed2-1a30ca50cd63"
-    url = f"{BASE_URL}/electronic-remittance-advice/{transaction_id}/pdf"
-    headers = {
-        "Authorization": get_api_key(),
-        "Content-Type": "application/json"
-    }
-    params = {
-        "logo": True
-}
-    response = requests.get(url, headers=headers, params=params)
-    return response
+    return execute_request(22)
 
 
-def print_response(response: requests.Response, verbose: bool = False) -> None:
+def print_response(response: "requests.Response", verbose: bool = False) -> None:
     """Print formatted response."""
     print(f"\n{'='*80}")
     print(f"Status Code: {response.status_code} {response.reason}")
     print(f"{'='*80}")
     
     if verbose:
+        timings = getattr(response, "timings", None)
+        if timings:
+            print(
+                f"Timing: dns {timings['dns']:.3f}s, connect {timings['connect']:.3f}s, tls {timings['tls']:.3f}s, "
+                f"ttfb {timings['ttfb']:.3f}s, download {timings['download']:.3f}s, {timings['bytes']} bytes"
+            )
         print("\nHeaders:")
         for key, value in response.headers.items():
             print(f"  {key}: {value}")
     
     print("\nResponse Body:")
+    content_type = response.headers.get("Content-Type", "")
+    if "pdf" in content_type or "octet-stream" in content_type:
+        print(f"Binary response ({content_type}, {len(response.content)} bytes).")
+        print("Use pdf_export.py to stream PDFs straight to disk.")
+        return
     try:
         response_json = response.json()
         print(json.dumps(response_json, indent=2))
@@ -891,7 +982,6 @@ def get_request_info(request_id: int) -> None:
         return
     
     req_info = REQUESTS[request_id]
-    func = req_info['func']
     
     print(f"\nRequest {request_id}: {req_info['method']} {req_info['path']}")
     print("="*80)
@@ -901,16 +991,13 @@ def get_request_info(request_id: int) -> None:
     print(f"Request URL: {get_request_url(request_id, resolve_examples=True)}")
     if req_info.get("path_params"):
         print(f"Template URL: {get_request_url(request_id)}")
+    if req_info.get("params"):
+        print(f"Query Parameters: {json.dumps(req_info['params'])}")
     
-    if func:
-        # Try to get payload info by calling the function (but don't actually make request)
-        import inspect
-        source = inspect.getsource(func)
-        # Extract payload if it exists
-        if 'payload' in source:
-            print("\nSample Payload:")
-            # This is a simplified extraction - in practice, you'd parse the function better
-            print("  (See function definition for full payload)")
+    payload = get_default_payload(request_id)
+    if payload is not None:
+        print("\nSample Payload:")
+        print(json.dumps(payload, indent=2))
     
     print()
 
@@ -922,23 +1009,21 @@ def run_request(request_id: int, verbose: bool = False, dry_run: bool = False) -
         sys.exit(1)
     
     req_info = REQUESTS[request_id]
-    func = req_info['func']
-    
-    if not func:
-        print(f"Error: Request function {request_id} not initialized.")
-        sys.exit(1)
     
     print(f"\nRunning Request {request_id}: {req_info['method']} {req_info['path']}")
     print(f"Description: {req_info.get('description', 'N/A')}")
     
     if dry_run:
         print("\n[DRY RUN] Would execute:")
-        print(f"  Function: {func.__name__}")
-        print(f"  URL: {get_request_url(request_id, resolve_examples=True)}")
+        print(f"  {req_info['method']} {get_request_url(request_id, resolve_examples=True)}")
+        if req_info.get("params"):
+            print(f"  Query Parameters: {json.dumps(req_info['params'])}")
         return
     
+    import requests
+
     try:
-        response = func()
+        response = execute_request(request_id)
         print_response(response, verbose)
     except requests.exceptions.RequestException as e:
         print(f"\nError making request: {e}")
@@ -950,6 +1035,156 @@ def run_request(request_id: int, verbose: bool = False, dry_run: bool = False) -
         sys.exit(1)
 
 
+def run_many_requests(request_ids: List[int], concurrency: int, verbose: bool = False) -> None:
+    """Run several requests concurrently on the asyncio engine and print a summary."""
+    import asyncio
+    import stedi_async
+
+    for request_id in request_ids:
+        if request_id not in REQUESTS:
+            print(f"Error: Request {request_id} not found. Use --list to see all requests.")
+            sys.exit(1)
+
+    print(f"\nRunning {len(request_ids)} requests with concurrency {concurrency}")
+    results = asyncio.run(stedi_async.run_many(request_ids, concurrency=concurrency))
+
+    failed = 0
+    for request_id, result in zip(request_ids, results):
+        req_info = REQUESTS[request_id]
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f"{request_id:2d}. {req_info['method']:6s} {req_info['path']}: error: {result}")
+            continue
+        if result.status_code >= 400:
+            failed += 1
+        print(f"{request_id:2d}. {req_info['method']:6s} {req_info['path']}: {result.status_code} ({result.elapsed:.2f}s)")
+        if verbose:
+            print_response(result, verbose)
+
+    if failed:
+        sys.exit(1)
+
+
+LOAD_PROGRESS_INTERVAL = 5.0
+
+
+def _load_outcome(result: Any) -> str:
+    return type(result).__name__ if isinstance(result, BaseException) else str(result.status_code)
+
+
+def _is_error(outcome: str) -> bool:
+    return not (outcome.isdigit() and int(outcome) < 400)
+
+
+def run_load_test(
+    request_ids: List[int],
+    count: Optional[int],
+    duration: Optional[float],
+    concurrency: int,
+    rps: Optional[float] = None,
+) -> None:
+    """Send sustained load on the asyncio engine, then report latency, errors and throughput.
+
+    Uses the test usage indicator and bypasses the eligibility cache, so every
+    request reaches Stedi without touching production traffic.
+    """
+    import asyncio
+    import time
+    import stedi_async
+
+    for request_id in request_ids:
+        if request_id not in REQUESTS:
+            print(f"Error: Request {request_id} not found. Use --list to see all requests.")
+            sys.exit(1)
+
+    set_usage_indicator("T")
+    stedi_cache.cache.enabled = False
+    limits = [f"{count} requests" if count else "", f"{duration:g}s" if duration else ""]
+    print(
+        f"\nLoad test: requests {','.join(map(str, request_ids))} for {' or '.join(limit for limit in limits if limit)}, "
+        f"concurrency {concurrency}, {f'target {rps:g} req/s' if rps else 'no rate target'}, usage indicator T"
+    )
+
+    samples: List[tuple] = []
+
+    async def collect() -> None:
+        next_progress = time.monotonic() + LOAD_PROGRESS_INTERVAL
+        async for request_id, elapsed, result in stedi_async.iter_load(request_ids, count, duration, concurrency, rps):
+            samples.append((request_id, elapsed, _load_outcome(result)))
+            now = time.monotonic()
+            if now >= next_progress:
+                next_progress = now + LOAD_PROGRESS_INTERVAL
+                errors = sum(1 for sample in samples if _is_error(sample[2]))
+                print(f"  {now - started:6.1f}s: {len(samples)} done, {len(samples) / (now - started):.1f} req/s, {errors} errors")
+
+    started = time.monotonic()
+    try:
+        asyncio.run(collect())
+    except KeyboardInterrupt:
+        print("\nInterrupted, reporting the requests that finished.")
+    print_load_report(samples, time.monotonic() - started, rps)
+
+
+def print_load_report(samples: List[tuple], wall_time: float, rps: Optional[float] = None) -> None:
+    """Print throughput, a latency histogram and outcome counts for (request ID, seconds, outcome) samples."""
+    if not samples:
+        print("\nNo requests finished.")
+        return
+
+    latencies = sorted(elapsed for _, elapsed, _ in samples)
+    target = f" (target {rps:g} req/s)" if rps else ""
+    print(f"\nCompleted {len(samples)} requests in {wall_time:.2f}s: {len(samples) / wall_time:.1f} req/s{target}")
+    print(
+        f"Latency: mean {sum(latencies) / len(latencies):.3f}s, p50 {stedi_metrics.percentile(latencies, 50):.3f}s, "
+        f"p90 {stedi_metrics.percentile(latencies, 90):.3f}s, p99 {stedi_metrics.percentile(latencies, 99):.3f}s, "
+        f"max {latencies[-1]:.3f}s"
+    )
+
+    histogram = stedi_metrics.Histogram(stedi_metrics.LATENCY_BUCKETS)
+    for elapsed in latencies:
+        histogram.observe(elapsed)
+    used = [index for index, bucket_count in enumerate(histogram.counts) if bucket_count]
+    widest = max(histogram.counts)
+    print("\nLatency histogram:")
+    for index in range(used[0], used[-1] + 1):
+        label = f"<= {histogram.buckets[index]:g}s" if index < len(histogram.buckets) else f">  {histogram.buckets[-1]:g}s"
+        bucket_count = histogram.counts[index]
+        print(f"  {label:<10s} {bucket_count:7d}  {'#' * round(40 * bucket_count / widest)}")
+
+    outcomes: Dict[str, int] = {}
+    for _, _, outcome in samples:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    errors = sum(bucket_count for outcome, bucket_count in outcomes.items() if _is_error(outcome))
+    print("\nOutcomes:")
+    for outcome, outcome_count in sorted(outcomes.items(), key=lambda item: -item[1]):
+        print(f"  {outcome:24s} {outcome_count:7d} {outcome_count / len(samples):7.1%}")
+    print(f"Errors: {errors} ({errors / len(samples):.1%})")
+
+    request_ids = sorted({request_id for request_id, _, _ in samples})
+    if len(request_ids) > 1:
+        print("\nBy request:")
+        for request_id in request_ids:
+            req_info = REQUESTS[request_id]
+            mine = sorted(elapsed for rid, elapsed, _ in samples if rid == request_id)
+            my_errors = sum(1 for rid, _, outcome in samples if rid == request_id and _is_error(outcome))
+            print(
+                f"  {request_id:2d}. {req_info['method']:6s} {req_info['path']}: {len(mine)} done, "
+                f"p50 {stedi_metrics.percentile(mine, 50):.3f}s, p99 {stedi_metrics.percentile(mine, 99):.3f}s, {my_errors} errors"
+            )
+
+
+def wait_for_interrupt(message: str) -> None:
+    """Print ``message`` and block until Ctrl+C."""
+    import time
+
+    print(message)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
 def main():
     """Main entry point for the CLI."""
     parser = argparse.ArgumentParser(
@@ -962,6 +1197,9 @@ Examples:
   %(prog)s --run 1                   # Run request 1
   %(prog)s --run 1 --verbose         # Run request 1 with verbose output
   %(prog)s --run 1 --dry-run         # Show what would be executed without making request
+  %(prog)s --run-many 3,9,19         # Run several requests concurrently
+  %(prog)s --load 3 --duration 60 --rps 20   # Load test eligibility checks for a minute
+  %(prog)s --registry sample_registry.py --list   # Use a registry generated from the OpenAPI specs
         """
     )
     
@@ -985,6 +1223,89 @@ Examples:
         help="Run a specific request by ID"
     )
     
+    parser.add_argument(
+        "--run-many",
+        type=lambda value: [int(part) for part in value.split(",") if part.strip()],
+        metavar="IDS",
+        help="Run a comma-separated list of request IDs concurrently"
+    )
+    
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=20,
+        metavar="N",
+        help="Maximum requests in flight for --run-many and --load (default: 20)"
+    )
+    
+    parser.add_argument(
+        "--load",
+        type=lambda value: [int(part) for part in value.split(",") if part.strip()],
+        metavar="IDS",
+        help="Load test: send the comma-separated request IDs round-robin with the test usage indicator"
+    )
+    
+    parser.add_argument(
+        "--count",
+        type=int,
+        metavar="N",
+        help="Total requests to send with --load"
+    )
+    
+    parser.add_argument(
+        "--duration",
+        type=float,
+        metavar="SECONDS",
+        help="How long to keep sending with --load"
+    )
+    
+    parser.add_argument(
+        "--rps",
+        type=float,
+        metavar="N",
+        help="Target requests per second for --load (default: as fast as --concurrency allows)"
+    )
+    
+    parser.add_argument(
+        "--no-rate-limit",
+        action="store_true",
+        help="Turn off the client-side rate limiter, e.g. to find Stedi's own limits with --load"
+    )
+    
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=stedi_retry.DEFAULT_MAX_ATTEMPTS,
+        metavar="N",
+        help=f"Attempts per request for transient failures, 1 disables retries (default: {stedi_retry.DEFAULT_MAX_ATTEMPTS})"
+    )
+    
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=stedi_cache.DEFAULT_TTL,
+        metavar="SECONDS",
+        help=f"How long eligibility responses are cached (default: {stedi_cache.DEFAULT_TTL:.0f})"
+    )
+    
+    parser.add_argument(
+        "--cache-db",
+        metavar="PATH",
+        help="SQLite file that keeps cached eligibility responses across runs"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always send eligibility checks instead of using cached responses"
+    )
+    
+    parser.add_argument(
+        "--registry",
+        metavar="PATH",
+        help="Use the requests of a registry module written by generate_sample_requests.py instead of the built-in ones"
+    )
+    
     parser.add_argument(
         "--verbose", "-v",
         action="store_true",
@@ -1002,30 +1323,87 @@ Examples:
         help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
     )
     
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        metavar="N",
+        help="Keep-alive connections per host (default: 10)"
+    )
+    
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="Write per-request latency histograms to PATH in OpenMetrics format when done"
+    )
+    
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="Serve latency histograms on http://127.0.0.1:PORT/metrics, and keep serving until Ctrl+C when done"
+    )
+    
     args = parser.parse_args()
     
     # Override API key if provided
-    global _api_key
     if args.api_key:
-        _api_key = args.api_key
+        set_api_key(args.api_key)
+    
+    if args.registry:
+        try:
+            use_registry(load_registry(args.registry))
+        except (OSError, ValueError, SyntaxError, AttributeError) as e:
+            parser.error(f"cannot load registry {args.registry}: {e}")
     
-    # Initialize request functions
-    for req_id in REQUESTS:
-        func_name = f"request_{req_id}"
-        REQUESTS[req_id]["func"] = globals().get(func_name)
+    if args.pool_size is not None:
+        if args.pool_size < 1:
+            parser.error("--pool-size must be at least 1")
+        import stedi_client
+        stedi_client.configure_pool(args.pool_size)
+    if args.max_attempts < 1:
+        parser.error("--max-attempts must be at least 1")
+    stedi_retry.configure_policy(max_attempts=args.max_attempts)
+    stedi_cache.cache.ttl = args.cache_ttl
+    stedi_cache.cache.enabled = not args.no_cache
+    stedi_ratelimit.limiter.enabled = not args.no_rate_limit
+    if args.cache_db:
+        stedi_cache.cache.open_sqlite(args.cache_db)
+    
+    if args.metrics_port is not None:
+        stedi_metrics.metrics.serve(args.metrics_port)
     
     # Handle commands
-    if args.list:
-        list_requests()
-    elif args.info:
-        get_request_info(args.info)
-    elif args.run:
-        run_request(args.run, verbose=args.verbose, dry_run=args.dry_run)
-    else:
-        # Default: show help and list requests
-        parser.print_help()
-        print("\n")
-        list_requests()
+    try:
+        if args.list:
+            list_requests()
+        elif args.info:
+            get_request_info(args.info)
+        elif args.run:
+            run_request(args.run, verbose=args.verbose, dry_run=args.dry_run)
+        elif args.run_many:
+            if args.concurrency < 1:
+                parser.error("--concurrency must be at least 1")
+            run_many_requests(args.run_many, args.concurrency, verbose=args.verbose)
+        elif args.load:
+            if args.count is None and args.duration is None:
+                parser.error("--load needs --count or --duration")
+            if args.concurrency < 1 or (args.count is not None and args.count < 1):
+                parser.error("--concurrency and --count must be at least 1")
+            if (args.duration is not None and args.duration <= 0) or (args.rps is not None and args.rps <= 0):
+                parser.error("--duration and --rps must be positive")
+            run_load_test(args.load, args.count, args.duration, args.concurrency, args.rps)
+        else:
+            # Default: show help and list requests
+            parser.print_help()
+            print("\n")
+            list_requests()
+    finally:
+        # Also on sys.exit(1) from a failed request, whose timings matter most.
+        if args.metrics_file:
+            stedi_metrics.metrics.write(args.metrics_file)
+            print(f"Metrics written to {args.metrics_file}")
+        if args.metrics_port is not None:
+            wait_for_interrupt(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics (Ctrl+C to stop)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Retry policy for Stedi Healthcare API requests
+
+Each entry in stedi_request.REQUESTS declares how it may be retried with a
+"retry" key:
+
+- "safe": reads and inquiries (reports, payer lookups, eligibility) that can
+  be repeated freely.
+- "idempotency-key": submissions (claims, insurance discovery) that are only
+  safe to repeat with the same Idempotency-Key header, which is added
+  automatically and reused for every attempt.
+- "unsafe": never retried.
+
+Transient failures (connection errors, timeouts, 429 and 5xx responses) are
+retried with exponential backoff and full jitter, within a total deadline.
+"""
+
+import random
+import time
+from typing import Any, Dict, Optional
+
+import stedi_ratelimit
+
+SAFE = "safe"
+IDEMPOTENCY_KEY = "idempotency-key"
+UNSAFE = "unsafe"
+RETRY_CLASSES = (SAFE, IDEMPOTENCY_KEY, UNSAFE)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 8.0
+DEFAULT_DEADLINE = 60.0
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by attempts and a total deadline."""
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        deadline: float = DEFAULT_DEADLINE,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt: int) -> float:
+        """Return a jittered delay after the given (1-based) attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def next_delay(self, attempt: int, started: float, retry_after: Optional[float] = None) -> Optional[float]:
+        """Return how long to wait before the next attempt, or None to give up.
+
+        ``started`` is the time.monotonic() of the first attempt. A server
+        Retry-After is honoured as a minimum delay.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() - started + delay > self.deadline:
+            return None
+        return delay
+
+
+class RetryRegistry:
+    """Retry classification per endpoint path, plus the shared policy."""
+
+    def __init__(self, policy: Optional[RetryPolicy] = None):
+        self.policy = policy or RetryPolicy()
+        self._classes: Dict[str, str] = {}
+
+    def configure(self, path: str, retry: str) -> None:
+        """Set the retry classification for an endpoint path template."""
+        if retry not in RETRY_CLASSES:
+            raise ValueError(f"Unknown retry classification {retry!r}; expected one of {RETRY_CLASSES}")
+        self._classes[path] = retry
+
+    def configure_from_requests(self, requests_registry: Dict[int, Dict[str, Any]]) -> None:
+        """Read the "retry" key of every REQUESTS entry."""
+        for req_info in requests_registry.values():
+            self.configure(req_info["path"], req_info.get("retry", UNSAFE))
+
+    def classify(self, method: str, url: str) -> str:
+        """Return the retry classification for a request URL.
+
+        URLs outside the registry are safe to retry only for read methods.
+        """
+        path = stedi_ratelimit.limiter.endpoint_for(url).path
+        if path in self._classes:
+            return self._classes[path]
+        return SAFE if method.upper() in SAFE_METHODS else UNSAFE
+
+    def prepare(self, method: str, url: str, kwargs: Dict[str, Any]) -> bool:
+        """Return whether a request may be retried, adding an Idempotency-Key if it needs one.
+
+        ``kwargs`` are the send() keyword arguments; headers are copied
+        rather than modified in place.
+        """
+        retry = self.classify(method, url)
+        if retry == IDEMPOTENCY_KEY:
+            import uuid
+
+            headers = dict(kwargs.get("headers") or {})
+            headers.setdefault(IDEMPOTENCY_HEADER, str(uuid.uuid4()))
+            kwargs["headers"] = headers
+        return retry != UNSAFE
+
+
+# Shared by stedi_client.send() and the asyncio engine.
+registry = RetryRegistry()
+
+
+def configure_policy(**kwargs) -> None:
+    """Replace the shared retry policy, e.g. configure_policy(max_attempts=1) to disable retries."""
+    registry.policy = RetryPolicy(**kwargs)
@@ -1,11 +1,34 @@
 #!/usr/bin/env python3
 """Local verification for the Stedi request runner migration."""
 
-from unittest.mock import MagicMock
-
-import requests
+import contextlib
+import functools
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
 
+import bulk_eligibility
+import era_ingest
+import generate_sample_requests
+import mock_stedi_server
+import payer_directory
+import pdf_export
+import stedi_cache
+import stedi_client
+import stedi_events
+import stedi_metrics
+import stedi_ratelimit
 import stedi_request
+import stedi_retry
+import x12_parser
 
 
 EXPECTED_REQUESTS = {
@@ -41,40 +64,403 @@ def assert_request_registry() -> None:
     }
     assert actual == EXPECTED_REQUESTS, f"REQUESTS drifted:\nactual={actual}"
 
+    for request_id, request in stedi_request.REQUESTS.items():
+        assert request.get("retry") in stedi_retry.RETRY_CLASSES, f"request {request_id} has no retry classification"
+        if "submission" in request["path"]:
+            assert request["retry"] == stedi_retry.IDEMPOTENCY_KEY, f"claim submission {request_id} must use an idempotency key"
+
+
+def assert_build_request_from_registry() -> None:
+    stedi_request.get_api_key = MagicMock(return_value="test_key")
+    call = stedi_request.build_request(3, payload={"tradingPartnerServiceId": "OVERRIDE"})
+    assert call["method"] == "POST"
+    assert call["url"].endswith("/change/medicalnetwork/eligibility/v3")
+    assert call["kwargs"]["json"] == {"tradingPartnerServiceId": "OVERRIDE"}
+    assert call["kwargs"]["headers"]["Authorization"] == "test_key"
+
+    call = stedi_request.build_request(22, path_params={"transactionId": "abc"}, params={"logo": False})
+    assert call["url"].endswith("/electronic-remittance-advice/abc/pdf")
+    assert call["kwargs"]["params"] == {"logo": False}
+    assert "json" not in call["kwargs"], "GET requests must not send a body"
+
+    payload = stedi_request.get_default_payload(3)
+    payload["tradingPartnerServiceId"] = "CHANGED"
+    assert stedi_request.get_default_payload(3)["tradingPartnerServiceId"] == "AHS", "sample payloads are shared, not copied"
+
+
+def assert_json_claims_follow_usage_indicator() -> None:
+    stedi_request.set_usage_indicator("P")
+    try:
+        for request_id in (6, 8):
+            payload = stedi_request.get_default_payload(request_id)
+            assert payload["usageIndicator"] == "P", f"request_{request_id} ignores the production usage indicator"
+    finally:
+        stedi_request.set_usage_indicator("T")
+    assert stedi_request.get_default_payload(6)["usageIndicator"] == "T"
+
+
+def assert_x12_envelopes() -> None:
+    stedi_request.get_api_key = MagicMock(return_value="test_key")
+    for request_id in (2, 4, 5, 7, 12):
+        x12 = stedi_request.build_request(request_id)["kwargs"]["json"]["x12"]
+        segments = [segment.strip() for segment in x12.split("~") if segment.strip()]
+        assert len(segments[0]) == 105, f"request_{request_id} ISA is not fixed width"
+        start = next(i for i, segment in enumerate(segments) if segment.startswith("ST*"))
+        end = next(i for i, segment in enumerate(segments) if segment.startswith("SE*"))
+        assert int(segments[end].split("*")[1]) == end - start + 1, f"request_{request_id} SE count is wrong"
+        assert segments[-1].split("*")[2] == segments[0].split("*")[13], f"request_{request_id} IEA does not match ISA"
+
+
+def assert_x12_parser_streams() -> None:
+    isa = "ISA*00*          *00*          *ZZ*PAYER          *ZZ*PROVIDER       *240101*1200*^*00501*000000001*0*T*>~"
+    era = isa + "\nST*835*0001~BPR*I*150*C*ACH~TRN*1*12345~CLP*PCN1*1*200*150~CAS*PR*1*20~SVC*HC>99213*200*150~CAS*CO*45*30~CLP*PCN2*4*50*0~SE*8*0001~"
+    # Three-byte chunks split the ISA header and most segments.
+    chunks = (era[i:i + 3].encode() for i in range(0, len(era), 3))
+    claims = list(x12_parser.iter_835_claims(x12_parser.tokenize(chunks)))
+    assert [claim["patientControlNumber"] for claim in claims] == ["PCN1", "PCN2"]
+    assert claims[0]["checkOrEftTraceNumber"] == "12345"
+    assert claims[0]["adjustments"][0]["reasonCode"] == "1"
+    assert claims[0]["serviceLines"][0]["procedureCode"] == "99213"
+    assert claims[0]["serviceLines"][0]["adjustments"][0]["amount"] == "30"
+
+    # The mock server answers request_10 with a JSON report, which needs a clear error.
+    result = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import sys, mock_stedi_server, stedi_request, x12_parser\n"
+            "url = mock_stedi_server.MockStediServer('fixed:0').start(); stedi_request.set_base_urls(url, url)\n"
+            "sys.argv = ['x12_parser.py', '--type', '835', '--transaction-id', 'T1', '--api-key', 'test']\n"
+            "x12_parser.main()",
+        ],
+        capture_output=True, text=True,
+    )
+    assert result.returncode == 1 and "needs raw X12" in result.stderr, result.stderr
+
+
+def assert_metadata_commands_stay_light() -> None:
+    # A fresh interpreter, since this one already imported the HTTP stack.
+    loaded = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import sys, stedi_request; stedi_request.get_request_url(3); stedi_request.get_default_payload(5); "
+            "print(' '.join(m for m in ('requests', 'streamlit', 'asyncio', 'stedi_client') if m in sys.modules))",
+        ],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    assert not loaded, f"importing stedi_request for metadata loaded {loaded}"
+
+
+def assert_benchmark_runs_against_mock_server() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "bench.json")
+        subprocess.run(
+            [
+                sys.executable, "benchmark.py", "--requests", str(len(EXPECTED_REQUESTS)),
+                "--modes", "pooled,async", "--latency", "fixed:0", "--output", output,
+            ],
+            capture_output=True, text=True, check=True,
+        )
+        with open(output) as f:
+            results = json.load(f)["results"]
+    for result in results:
+        assert result["requests"] == len(EXPECTED_REQUESTS), result
+        assert result["outcomes"] == {"200": len(EXPECTED_REQUESTS)}, f"{result['mode']}: {result['outcomes']}"
+
+
+def assert_load_mode_reports() -> None:
+    output = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import mock_stedi_server, stedi_request; server = mock_stedi_server.MockStediServer('fixed:0'); "
+            "url = server.start(); stedi_request.set_base_urls(url, url); stedi_request.set_api_key('test'); "
+            "stedi_request.run_load_test([3, 19], count=30, duration=None, concurrency=5, rps=200)",
+        ],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    assert "Completed 30 requests" in output, output
+    assert "Errors: 0 (0.0%)" in output, output
+    assert "19. GET    /payers: 15 done" in output, output
+
+
+def assert_discovery_jobs_poll_to_completion() -> None:
+    output = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import asyncio, mock_stedi_server, stedi_async, stedi_request, insurance_discovery\n"
+            "server = mock_stedi_server.MockStediServer('fixed:0', discovery_delay=0.3)\n"
+            "url = server.start(); stedi_request.set_base_urls(url, url); stedi_request.set_api_key('test')\n"
+            "async def main():\n"
+            "    async with stedi_async.AsyncStediClient(concurrency=5) as client:\n"
+            "        jobs = insurance_discovery.DiscoveryJobs(client, initial_delay=0.1)\n"
+            "        for key in range(10):\n"
+            "            jobs.submit(stedi_request.get_default_payload(16), key=key)\n"
+            "        return await jobs.run()\n"
+            "finished = asyncio.run(main())\n"
+            "print(sorted(job['key'] for job in finished), {job['status'] for job in finished}, min(job['polls'] for job in finished))",
+        ],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    assert output.startswith(f"{list(range(10))} {{'COMPLETE'}}"), output
+    assert int(output.split()[-1]) >= 1, output
+
+    # A roster row that could not be read is an error row; the rest of the run carries on.
+    output = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import asyncio, io, mock_stedi_server, stedi_request, insurance_discovery\n"
+            "url = mock_stedi_server.MockStediServer('fixed:0', discovery_delay=0.1).start()\n"
+            "stedi_request.set_base_urls(url, url); stedi_request.set_api_key('test')\n"
+            "roster = [ValueError('Invalid JSON'), {'firstName': 'A', 'lastName': 'B', 'dateOfBirth': '2000-01-01'}]\n"
+            "print(asyncio.run(insurance_discovery.run_discovery(iter(roster), io.StringIO(), [])))",
+        ],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    assert output.strip() == "{'ERROR': 1, 'COMPLETE': 1}", output
+
+
+def assert_era_ingest_loads_sqlite() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "eras.db")
+        code = (
+            "import sys, mock_stedi_server, stedi_request, era_ingest\n"
+            "server = mock_stedi_server.MockStediServer('fixed:0')\n"
+            "url = server.start(); stedi_request.set_base_urls(url, url)\n"
+            "sys.argv = ['era_ingest.py', 'T1', 'T2', 'T3', '--api-key', 'test', '--db', sys.argv[1], '--batch-size', '4']\n"
+            "era_ingest.main()"
+        )
+        subprocess.run([sys.executable, "-c", code, db], capture_output=True, text=True, check=True)
+        output = subprocess.run([sys.executable, "-c", code, db], capture_output=True, text=True, check=True).stdout
+        assert "3 already loaded" in output, output
+
+        connection = sqlite3.connect(db)
+        counts = [connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in era_ingest.TABLES]
+        connection.close()
+        assert counts == [3, 6, 6, 12], counts
+
+        # A failed --refetch keeps the error row only, not the claims of the earlier load.
+        store = era_ingest.EraStore(db)
+        store.add_error("T1", "HTTP 500")
+        store.close()
+        connection = sqlite3.connect(db)
+        counts = [connection.execute(f"SELECT COUNT(*) FROM {table} WHERE transaction_id = 'T1'").fetchone()[0] for table in era_ingest.TABLES]
+        status = connection.execute("SELECT status FROM era_transactions WHERE transaction_id = 'T1'").fetchone()[0]
+        connection.close()
+        assert counts == [1, 0, 0, 0] and status == "error", (counts, status)
+
+    # Null lists and objects read as empty; a report that is not an object is rejected cleanly.
+    report = {"transactions": [{"payer": None, "detailInfo": [{"paymentInfo": [{"claimPaymentInfo": None, "serviceLines": None}]}]}, {"detailInfo": None}]}
+    claims = list(era_ingest.iter_report_claims(json.dumps(report).encode()))
+    assert len(claims) == 1 and claims[0]["payerName"] is None and claims[0]["serviceLines"] == [], claims
+    try:
+        era_ingest.iter_report_claims(b"[]")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a JSON array was accepted as an 835 report")
+
+
+def assert_events_resume_from_checkpoint() -> None:
+    server = mock_stedi_server.MockStediServer("fixed:0", events=95)
+    url = server.start()
+    stedi_request.set_api_key("test")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "checkpoint.json")
+            seen = []
+            events = stedi_events.iter_events(stedi_events.EventCheckpoint(path), page_size=20, base_url=url)
+            for event in events:
+                seen.append(event["transactionId"])
+                if len(seen) == 50:
+                    break
+            events.close()
+            # The 50th event was still being handled when the loop stopped, so it comes again.
+            seen.pop()
+            seen += [event["transactionId"] for event in stedi_events.iter_events(stedi_events.EventCheckpoint(path), page_size=20, base_url=url)]
+            assert seen == [f"mock-{index:06d}" for index in range(95)], seen
+
+            server.events = 97
+            new = [event["transactionId"] for event in stedi_events.iter_events(stedi_events.EventCheckpoint(path), page_size=20, base_url=url)]
+            assert new == ["mock-000095", "mock-000096"], new
+
+            # Stopping inside the first page keeps the start time, which a resume reuses or must match.
+            path = os.path.join(tmp, "start.json")
+            events = stedi_events.iter_events(stedi_events.EventCheckpoint(path), page_size=20, start_date_time="2024-01-01T00:00:00Z", base_url=url)
+            next(events)
+            events.close()
+            resumed = stedi_events.EventCheckpoint(path)
+            assert (resumed.page_token, resumed.start_date_time) == (None, "2024-01-01T00:00:00Z"), vars(resumed)
+            assert resumed.use_start_date_time(None) == "2024-01-01T00:00:00Z"
+            try:
+                next(stedi_events.iter_events(resumed, start_date_time="2025-01-01T00:00:00Z", base_url=url))
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("a conflicting start time was accepted on resume")
+    finally:
+        server.stop()
+        stedi_request.set_api_key(None)
+
+
+def assert_spec_cache_revalidates() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "spec.json"), "w") as f:
+            json.dump({"servers": [{"url": "https://example.com"}], "paths": {"/a": {"get": {}}}}, f)
+        class QuietHandler(SimpleHTTPRequestHandler):
+            def log_message(self, format, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=tmp))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/spec.json"
+        cache_dir = os.path.join(tmp, "cache")
+        try:
+            statuses = [generate_sample_requests.fetch_spec(url, cache_dir)[1] for _ in range(2)]
+        finally:
+            server.shutdown()
+            server.server_close()
+        spec, status = generate_sample_requests.fetch_spec(url, cache_dir, offline=True)
+        assert statuses + [status] == ["downloaded", "not modified", "cached"], statuses + [status]
+        assert "/a" in spec["paths"]
+
+
+def assert_sample_refs_are_memoized() -> None:
+    def body(ref: str) -> dict:
+        return {"requestBody": {"content": {"application/json": {"schema": {"$ref": ref}}}}}
+
+    generator = generate_sample_requests.SampleRequestGenerator(spec_name="test")
+    generator.set_spec({
+        "paths": {"/a": {"post": body("#/components/schemas/A")}, "/node": {"post": body("#/components/schemas/Node")}},
+        "components": {"schemas": {
+            "A": {"type": "object", "required": ["id", "b"], "properties": {"id": {"type": "string"}, "b": {"$ref": "#/components/schemas/B"}}},
+            "B": {"type": "object", "required": ["a"], "properties": {"a": {"$ref": "#/components/schemas/A"}}},
+            "Node": {"type": "object", "required": ["children"], "properties": {"children": {"type": "array", "items": {"$ref": "#/components/schemas/Node"}}}},
+        }},
+    })
+    a, node = [request["body"] for request in generator.generate_all_requests()]
+    assert a == {"id": "123456789", "b": {"a": None}}, a
+    assert node == {"children": [None]}, node
+    assert generator.generate_sample_value({"$ref": "#/components/schemas/A"}) is generator.generate_sample_value({"$ref": "#/components/schemas/A"})
+
+
+def assert_incremental_regeneration() -> None:
+    spec = {
+        "paths": {
+            "/a": {"post": {"requestBody": {"content": {"application/json": {"schema": {"$ref": "#/components/schemas/A"}}}}}},
+            "/b": {"get": {"summary": "B"}},
+        },
+        "components": {"schemas": {"A": {"type": "object", "required": ["id"], "properties": {"id": {"$ref": "#/components/schemas/Id"}}}, "Id": {"type": "string"}}},
+    }
+    generator = generate_sample_requests.SampleRequestGenerator(spec_name="test")
+    generator.set_spec(spec)
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "sample_requests.json")
+        requests_list, operations, regenerated = generator.generate_changed_requests({})
+        assert regenerated == 2
+        with open(output, "w") as f:
+            json.dump(requests_list, f)
+        generate_sample_requests.save_manifest(output, operations)
+
+        # A change two $refs deep only regenerates the operation that uses it.
+        spec["components"]["schemas"]["Id"]["example"] = "CHANGED"
+        generator.set_spec(spec)
+        requests_list, _, regenerated = generator.generate_changed_requests(generate_sample_requests.load_manifest(output))
+        assert regenerated == 1, regenerated
+        assert requests_list[0]["body"] == {"id": "CHANGED"}, requests_list[0]
+
+        # NDJSON output has one compact request per line.
+        ndjson = os.path.join(tmp, "sample_requests.jsonl")
+        assert generator.save_to_ndjson(generator.iter_all_requests(), ndjson) == 2
+        with open(ndjson) as f:
+            lines = f.read().splitlines()
+        assert [json.loads(line) for line in lines] == generator.generate_all_requests()
+        assert ", " not in lines[0] and ": " not in lines[0], lines[0]
+
+
+def assert_generated_registry_loads_lazily() -> None:
+    generator = generate_sample_requests.SampleRequestGenerator(spec_name="test")
+    generator.set_spec({
+        "servers": [{"url": stedi_request.HEALTHCARE_BASE_URL}],
+        "paths": {
+            "/claims/submission": {"post": {"summary": "Submit", "requestBody": {"content": {"application/json": {"example": {"claim": 1}}}}}},
+            "/reports/{transactionId}": {"get": {"parameters": [{"in": "path", "name": "transactionId", "example": "abc"}]}},
+            "/change/medicalnetwork/eligibility/v3": {"post": {"summary": "Eligibility"}},
+            "/insurance-discovery/check/v1": {"post": {"summary": "Discovery"}},
+        },
+    })
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = os.path.join(tmp, "sample_registry.py")
+        generator.generate_registry_module(generator.generate_all_requests(), registry)
+        # Known endpoints keep the retry and cache classes stedi_request gives them.
+        entries = {entry["path"]: entry for entry in stedi_request.load_registry(registry).values()}
+        eligibility = entries["/change/medicalnetwork/eligibility/v3"]
+        assert (eligibility["retry"], eligibility.get("cache")) == ("safe", "eligibility"), eligibility
+        assert entries["/insurance-discovery/check/v1"]["retry"] == "idempotency-key", entries
+        output = subprocess.run(
+            [
+                sys.executable, "-c",
+                "import sys, stedi_request\n"
+                "stedi_request.use_registry(stedi_request.load_registry(sys.argv[1]))\n"
+                "print('payload' in stedi_request.REQUESTS[1], stedi_request.REQUESTS[1]['retry'])\n"
+                "stedi_request.set_api_key('test')\n"
+                "print(stedi_request.build_request(1)['kwargs']['json'], stedi_request.build_request(2)['url'])",
+                registry,
+            ],
+            capture_output=True, text=True, check=True,
+        ).stdout.splitlines()
+    assert output[0] == "False idempotency-key", output
+    assert output[1] == f"{{'claim': 1}} {stedi_request.HEALTHCARE_BASE_URL}/reports/abc", output
+
+
+def assert_metrics_render_openmetrics() -> None:
+    metrics = stedi_metrics.RequestMetrics()
+    metrics.configure_from_requests(stedi_request.REQUESTS)
+    timings = stedi_metrics.attempt_timings({"dns": 0.01, "connect": 0.02, "tls": 0.03}, 0.5, 0.3, 2048, "200")
+    assert round(timings["ttfb"], 6) == 0.24 and round(timings["download"], 6) == 0.2, timings
+    metrics.record(stedi_request.get_request_url(3), timings)
+
+    text = metrics.render()
+    labels = 'request_id="3",path="/change/medicalnetwork/eligibility/v3"'
+    assert f'stedi_request_phase_seconds_bucket{{{labels},phase="ttfb",le="0.25"}} 1' in text, text
+    assert f'stedi_request_phase_seconds_bucket{{{labels},phase="ttfb",le="0.1"}} 0' in text, text
+    assert f'stedi_response_size_bytes_count{{{labels}}} 1' in text, text
+    assert f'stedi_requests_total{{{labels},status="200"}} 1' in text, text
+    assert text.endswith("# EOF\n")
+
+
+def mock_send() -> MagicMock:
+    stedi_client.send = MagicMock(return_value=MagicMock(status_code=200, json=lambda: {}))
+    return stedi_client.send
+
 
 def assert_all_request_functions_execute() -> None:
-    requests.get = MagicMock(return_value=MagicMock(status_code=200, json=lambda: {}))
-    requests.post = MagicMock(return_value=MagicMock(status_code=200, json=lambda: {}))
+    send = mock_send()
     stedi_request.get_api_key = MagicMock(return_value="test_key")
 
     for request_id, (method, _) in EXPECTED_REQUESTS.items():
         func = getattr(stedi_request, f"request_{request_id}")
         func()
-        if method == "GET":
-            assert requests.get.called, f"request_{request_id} did not call requests.get"
-            requests.get.reset_mock()
-        else:
-            assert requests.post.called, f"request_{request_id} did not call requests.post"
-            _, kwargs = requests.post.call_args
+        assert send.called, f"request_{request_id} did not go through stedi_client.send"
+        args, kwargs = send.call_args
+        assert args[0] == method, f"request_{request_id} sent {args[0]} instead of {method}"
+        if method == "POST":
             assert kwargs.get("json"), f"request_{request_id} did not send a JSON payload"
-            requests.post.reset_mock()
+        send.reset_mock()
 
 
 def assert_migrated_examples() -> None:
-    requests.post = MagicMock(return_value=MagicMock(status_code=200, json=lambda: {}))
+    send = mock_send()
     stedi_request.get_api_key = MagicMock(return_value="test_key")
 
     stedi_request.request_3()
-    _, kwargs = requests.post.call_args
+    _, kwargs = send.call_args
     eligibility_payload = kwargs["json"]
     assert eligibility_payload["provider"]["npi"] == "1999999984"
     assert eligibility_payload["provider"]["organizationName"] == "ACME Health Services"
     assert eligibility_payload["tradingPartnerServiceId"] == "AHS"
 
-    requests.get = MagicMock(return_value=MagicMock(status_code=200, json=lambda: {}))
     stedi_request.request_22()
-    args, kwargs = requests.get.call_args
-    assert "/electronic-remittance-advice/" in args[0]
+    args, kwargs = send.call_args
+    assert "/electronic-remittance-advice/" in args[1]
     assert kwargs["params"] == {"logo": True}
 
     assert (
@@ -90,15 +476,320 @@ def assert_migrated_examples() -> None:
         == "https://payers.us.stedi.com/2024-04-01/payers"
     )
     stedi_request.request_19()
-    args, _ = requests.get.call_args
-    assert args[0] == "https://payers.us.stedi.com/2024-04-01/payers"
+    args, _ = send.call_args
+    assert args[1] == "https://payers.us.stedi.com/2024-04-01/payers"
+
+
+def assert_roster_rows_fail_individually() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        roster = os.path.join(tmp, "roster.jsonl")
+        with open(roster, "w") as f:
+            f.write('{"memberId": "1"}\n{"memberId": \n[1, 2]\n\n{"memberId": "2"}\n')
+        rows = list(bulk_eligibility.read_roster(roster))
+    assert [type(row).__name__ for row in rows] == ["dict", "ValueError", "ValueError", "dict"], rows
+    assert bulk_eligibility.parse_service_type_codes(30) == ["30"]
+
+
+def assert_eligibility_cache() -> None:
+    def key(request_id: int, payload: dict, api_key: str = "key-1") -> str:
+        call = stedi_request.build_request(request_id, payload=payload, headers={"Authorization": api_key})
+        return cache.key_for(call["method"], call["url"], call["kwargs"])
+
+    def record(status_code: int = 200, body: object = None) -> dict:
+        return {"status_code": status_code, "reason": "OK", "headers": {}, "content": json.dumps(body or {"subscriber": {}}).encode()}
+
+    stedi_request.set_api_key("key-1")
+    cache = stedi_cache.ResponseCache(max_entries=2)
+    cache.configure_from_requests(stedi_request.REQUESTS)
+    payload = stedi_request.get_default_payload(3)
+    base = key(3, payload)
+    assert base and base == key(3, stedi_request.get_default_payload(3)), "identical checks must share a key"
+    changed = [
+        key(3, payload, api_key="key-2"),
+        key(3, {**payload, "tradingPartnerServiceId": "OTHER"}),
+        key(3, {**payload, "provider": {**payload["provider"], "npi": "1234567893"}}),
+        key(3, {**payload, "subscriber": {**payload["subscriber"], "memberId": "OTHER"}}),
+        key(3, {**payload, "subscriber": {**payload["subscriber"], "dateOfBirth": "19800101"}}),
+        key(3, {**payload, "encounter": {"dateOfService": "20200101"}}),
+        key(3, {**payload, "encounter": {"serviceTypeCodes": ["30"]}}),
+    ]
+    assert len({base, *changed}) == len(changed) + 1, "every key field must change the key"
+
+    x12 = stedi_request.get_default_payload(4)
+    stedi_request.set_usage_indicator("P")
+    try:
+        production = stedi_request.get_default_payload(4)
+    finally:
+        stedi_request.set_usage_indicator("T")
+    other_provider = {"x12": x12["x12"].replace("*SV*1999999984~", "*SV*1234567893~")}
+    assert len({key(4, x12), key(4, production), key(4, other_provider)}) == 3, "ISA15 and NM1*1P must change the key"
+
+    assert cache.get(base) is None and cache.misses == 1
+    cache.put(base, record())
+    assert cache.get(base)["status_code"] == 200 and cache.hits == 1
+    for not_cached in (record(500), record(body={"errors": [{"code": "42"}]}), record(body={"subscriber": {"aaaErrors": [{"code": "72"}]}}),
+                       record(body={"x12": x12["x12"].replace("TRN*", "AAA*Y**72*C~TRN*", 1)})):
+        cache.put(changed[0], not_cached)
+        assert cache.get(changed[0]) is None, not_cached
+
+    # Least recently used entries go first.
+    cache.put(changed[1], record())
+    cache.get(base)
+    cache.put(changed[2], record())
+    assert cache.get(changed[1]) is None and cache.get(base) is not None and cache.get(changed[2]) is not None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.db")
+        stored = stedi_cache.ResponseCache(ttl=0.2, sqlite_path=path)
+        stored.put(base, record())
+        stored._db.close()
+        reloaded = stedi_cache.ResponseCache(ttl=0.2, sqlite_path=path)
+        assert reloaded.get(base) is not None, "entry was not reloaded from SQLite"
+        time.sleep(0.25)
+        assert reloaded.get(base) is None, "expired entry was returned"
+        reloaded._db.close()
+
+
+def assert_rate_limiter_adapts() -> None:
+    # Token bucket: the burst goes out at once, then requests are paced at the rate.
+    limiter = stedi_ratelimit.RateLimiter()
+    limiter.configure("/paced", rate=20, burst=2, max_concurrency=100)
+    start = time.monotonic()
+    for _ in range(7):
+        limiter.acquire("https://example.com/paced").release(200, 0.01)
+    elapsed = time.monotonic() - start
+    assert 0.2 <= elapsed < 0.6, f"7 requests at 20/s with a burst of 2 took {elapsed:.2f}s"
+
+    # 429 with Retry-After: pause the endpoint and halve rate and concurrency.
+    endpoint = stedi_ratelimit.EndpointLimiter("/limited", rate=8, burst=8, max_concurrency=8)
+    assert endpoint.try_acquire() == 0
+    endpoint.release(429, 0.1, retry_after="2")
+    assert (endpoint.rate, endpoint.concurrency_limit) == (4, 4), endpoint.snapshot()
+    assert 1.5 < endpoint.try_acquire() <= 2, endpoint.snapshot()
+
+    # Healthy responses ramp back up additively, never past the configured maximum.
+    endpoint.blocked_until = 0.0
+    endpoint.release(200, 0.1)
+    assert (endpoint.rate, endpoint.concurrency_limit) == (4.25, 4.25), endpoint.snapshot()
+    for _ in range(200):
+        endpoint.release(200, 0.1)
+    assert (endpoint.rate, endpoint.concurrency_limit) == (8, 8), endpoint.snapshot()
+
+    # A run of server errors also cuts the limits; --concurrency and --rate override them.
+    for _ in range(2):
+        endpoint.release(503, 0.1)
+    assert endpoint.concurrency_limit < 8, endpoint.snapshot()
+    limiter.override("/paced", rate=50, max_concurrency=40)
+    assert limiter.endpoint_for("https://example.com/paced").snapshot()["max_concurrency"] == 40
+
+
+def assert_retries_follow_policy() -> None:
+    import requests
+
+    def response(status_code: int, retry_after: str = None) -> "requests.Response":
+        result = requests.Response()
+        result.status_code = status_code
+        result.raw = io.BytesIO(b"")
+        if retry_after:
+            result.headers["Retry-After"] = retry_after
+        return result
+
+    def send(url: str, *answers, method: str = "POST", **kwargs):
+        """Run _send_with_retries against canned answers; return the result, attempts and sleeps."""
+        with patch.object(stedi_client, "_send_once", side_effect=list(answers)) as send_once, \
+                patch.object(stedi_client.time, "sleep") as sleep:
+            try:
+                result = stedi_client._send_with_retries(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                result = e
+        return result, send_once.call_args_list, [call.args[0] for call in sleep.call_args_list]
+
+    safe_url = stedi_request.get_request_url(3)
+    result, attempts, _ = send(safe_url, response(503), response(200))
+    assert result.status_code == 200 and len(attempts) == 2, attempts
+    result, attempts, _ = send(safe_url, requests.exceptions.ConnectionError(), response(200))
+    assert result.status_code == 200 and len(attempts) == 2, attempts
+
+    # POSTs outside the registry are unsafe: sent exactly once, whatever happens.
+    result, attempts, _ = send("https://example.com/unregistered", response(503), response(200))
+    assert result.status_code == 503 and len(attempts) == 1, attempts
+    result, attempts, _ = send("https://example.com/unregistered", requests.exceptions.ConnectionError(), response(200))
+    assert isinstance(result, requests.exceptions.ConnectionError) and len(attempts) == 1, attempts
+
+    headers = {"Authorization": "test"}
+    result, attempts, _ = send(stedi_request.get_request_url(6), response(502), response(503), response(200), headers=headers)
+    keys = {call.kwargs["headers"][stedi_retry.IDEMPOTENCY_HEADER] for call in attempts}
+    assert result.status_code == 200 and len(attempts) == 3 and len(keys) == 1, attempts
+    assert stedi_retry.IDEMPOTENCY_HEADER not in headers, "the caller's headers were modified"
+
+    _, attempts, sleeps = send(safe_url, response(429, retry_after="7"), response(200))
+    assert len(attempts) == 2 and sleeps[0] >= 7, sleeps
+
+    try:
+        stedi_retry.configure_policy(max_attempts=3)
+        result, attempts, sleeps = send(safe_url, *[response(503)] * 5)
+        assert result.status_code == 503 and len(attempts) == 3 and len(sleeps) == 2, attempts
+        stedi_retry.configure_policy(deadline=5)
+        # Waiting 30 seconds would pass the 5 second deadline, so give up at once.
+        result, attempts, sleeps = send(safe_url, response(503, retry_after="30"), response(200))
+        assert result.status_code == 503 and len(attempts) == 1 and not sleeps, attempts
+    finally:
+        stedi_retry.configure_policy()
+
+
+def assert_payer_directory_indexes() -> None:
+    directory = payer_directory.PayerDirectory([
+        {"stediId": "AHS01", "primaryPayerId": "11122", "displayName": "Acme Health Services", "aliases": ["ACME", "60054"]},
+        {"stediId": "BCBTX", "primaryPayerId": "84980", "displayName": "Blue Cross Blue Shield of Texas", "names": ["BCBS Texas"]},
+        {"stediId": "BCBIL", "primaryPayerId": None, "displayName": "Blue Cross Blue Shield of Illinois", "aliases": None},
+    ])
+    assert [payer["stediId"] for payer in directory.lookup("60054")] == ["AHS01"]
+    assert [payer["stediId"] for payer in directory.lookup("acme")] == ["AHS01"]
+    assert directory.lookup("99999") == []
+    # Prefix matches come first, then trigram matches that tolerate typos.
+    assert [payer["stediId"] for payer in directory.search("blue cross blue shield of t")] == ["BCBTX", "BCBIL"]
+    assert [payer["stediId"] for payer in directory.search("acme helth", limit=1)] == ["AHS01"]
+
+    counts = directory.update([
+        {"stediId": "AHS01", "primaryPayerId": "11122", "displayName": "Acme Health Services", "aliases": ["ACME", "60054"]},
+        {"stediId": "BCBTX", "primaryPayerId": "84980", "displayName": "BCBS of Texas", "names": ["BCBS Texas"]},
+        {"stediId": "NEW01", "primaryPayerId": "12345", "displayName": "New Payer"},
+    ], remove_missing=True)
+    assert counts == {"added": 1, "changed": 1, "removed": 1}, counts
+    assert directory.lookup("BCBIL") == [] and directory.search("blue cross") == []
+    assert [payer["stediId"] for payer in directory.search("bcbs of")] == ["BCBTX"]
+
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        payer_directory.print_payer({"stediId": None, "primaryPayerId": None, "displayName": None, "aliases": [None, "X"]})
+    assert "aliases: X" in output.getvalue(), output.getvalue()
+
+
+def assert_pdf_downloads_resume() -> None:
+    import requests
+
+    def response(status_code: int, content: bytes) -> "requests.Response":
+        result = requests.Response()
+        result.status_code = status_code
+        result.raw = io.BytesIO(content)
+        return result
+
+    stedi_request.set_api_key("test")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            part_path = os.path.join(tmp, "1500-T1.pdf.part")
+            # 206: the server honoured the Range header, so the part file is extended.
+            with open(part_path, "wb") as f:
+                f.write(b"%PDF-1")
+            with patch.object(stedi_client, "send", return_value=response(206, b"234")) as send:
+                result = pdf_export.download_pdf("1500", "T1", tmp)
+            assert send.call_args.kwargs["headers"]["Range"] == "bytes=6-", send.call_args
+            assert (result["status"], result["resumed"], result["bytes"]) == ("success", True, 9), result
+            with open(result["path"], "rb") as f:
+                assert f.read() == b"%PDF-1234"
+
+            # 200: the server sent the whole PDF, so the part file is replaced.
+            with open(os.path.join(tmp, "1500-T2.pdf.part"), "wb") as f:
+                f.write(b"stale")
+            with patch.object(stedi_client, "send", return_value=response(200, b"%PDF-new")):
+                result = pdf_export.download_pdf("1500", "T2", tmp)
+            assert (result["resumed"], result["bytes"]) == (False, 8), result
+            with open(result["path"], "rb") as f:
+                assert f.read() == b"%PDF-new"
+
+            with patch.object(stedi_client, "send") as send:
+                for pdf_id in ("../escape", "a/b", ".."):
+                    assert pdf_export.download_pdf("1500", pdf_id, tmp)["status"] == "error", pdf_id
+            assert not send.called and not os.path.exists(os.path.join(os.path.dirname(tmp), "1500-escape.pdf"))
+    finally:
+        stedi_request.set_api_key(None)
+
+
+APP_CHECK = """
+import json, re
+import app, stedi_request
+from streamlit.testing.v1 import AppTest
+
+def masked(text):
+    # Control numbers and timestamps differ between two builds of the same X12 sample.
+    return None if text is None else re.sub(r"[0-9]+", "0", text)
+
+templates = {}
+for usage_indicator in ("T", "P"):
+    stedi_request.set_usage_indicator(usage_indicator)
+    templates[usage_indicator] = app.get_request_templates.__wrapped__(usage_indicator)
+    for req_id, template in templates[usage_indicator].items():
+        default = stedi_request.get_default_payload(req_id)
+        expected = None if default is None else json.dumps(default, indent=2)
+        assert masked(template["payload_json"]) == masked(expected), (usage_indicator, req_id)
+        assert template["display_url"] == stedi_request.get_request_url(req_id, resolve_examples=True), req_id
+stedi_request.set_usage_indicator("T")
+for req_id in (4, 6, 8):
+    assert templates["T"][req_id]["payload_json"] != templates["P"][req_id]["payload_json"], req_id
+
+at = AppTest.from_file("app.py", default_timeout=60).run()
+default = at.text_area(key="payload_text_1").value
+at = at.text_area(key="payload_text_1").input(json.dumps({**json.loads(default), "edited": True})).run()
+assert at.session_state.edited_payloads["payload_1"]["edited"] is True
+at = at.text_area(key="payload_text_1").input(default).run()
+assert "payload_1" not in at.session_state.edited_payloads, at.session_state.edited_payloads
+
+# A Run All sweep against the mock server stores a result for every request.
+import mock_stedi_server
+url = mock_stedi_server.MockStediServer("fixed:0").start()
+stedi_request.set_base_urls(url, url)
+at = at.radio[0].set_value("All Requests").run()
+at = next(button for button in at.button if "Run All" in button.label).click().run()
+assert sorted(at.session_state.request_results) == sorted(stedi_request.REQUESTS), sorted(at.session_state.request_results)
+assert not at.exception, at.exception
+print("ok")
+"""
+
+
+def assert_app_templates_match_defaults() -> None:
+    result = subprocess.run(
+        [sys.executable, "-c", APP_CHECK],
+        capture_output=True, text=True, env={**os.environ, "STEDI_API_KEY": "test"},
+    )
+    assert result.stdout.strip() == "ok", result.stderr[-2000:]
+
+
+def assert_session_is_pooled() -> None:
+    stedi_client.configure_pool(4)
+    session = stedi_client.get_session()
+    assert session is stedi_client.get_session(), "session is not shared between calls"
+    adapter = session.get_adapter(stedi_request.HEALTHCARE_BASE_URL)
+    assert adapter._pool_maxsize == 4, "pool size was not applied to the shared session"
+    stedi_client.close_session()
 
 
 def main() -> None:
     assert_request_registry()
+    assert_session_is_pooled()
+    assert_eligibility_cache()
+    assert_rate_limiter_adapts()
+    assert_retries_follow_policy()
+    assert_payer_directory_indexes()
+    assert_pdf_downloads_resume()
+    assert_app_templates_match_defaults()
+    assert_build_request_from_registry()
+    assert_json_claims_follow_usage_indicator()
+    assert_x12_envelopes()
+    assert_x12_parser_streams()
+    assert_metadata_commands_stay_light()
+    assert_benchmark_runs_against_mock_server()
+    assert_metrics_render_openmetrics()
+    assert_load_mode_reports()
+    assert_discovery_jobs_poll_to_completion()
+    assert_roster_rows_fail_individually()
+    assert_era_ingest_loads_sqlite()
+    assert_events_resume_from_checkpoint()
+    assert_spec_cache_revalidates()
+    assert_sample_refs_are_memoized()
+    assert_incremental_regeneration()
+    assert_generated_registry_loads_lazily()
     assert_all_request_functions_execute()
     assert_migrated_examples()
-    print("Verification passed: request registry, request functions, and migrated examples are current.")
+    print("Verification passed: request registry, pooled client, request functions, and migrated examples are current.")
 
 
 if __name__ == "__main__":
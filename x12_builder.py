@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+X12 construction for 270, 276 and 837 transactions
+
+Builds transaction sets from structured inputs, using the same field names
+as the Stedi JSON payloads (memberId, firstName, organizationName, npi,
+...), and wraps them in ISA/GS/ST envelopes. Segment counts and control
+numbers are computed, so callers never hand-maintain SE, GE or IEA
+trailers. Everything is plain string joining, which keeps rendering fast
+enough for thousands of interchanges per second in bulk submissions.
+"""
+
+import itertools
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+ELEMENT_SEPARATOR = "*"
+COMPONENT_SEPARATOR = ">"
+REPETITION_SEPARATOR = "^"
+SEGMENT_TERMINATOR = "~"
+
+# Transaction type -> (ST01 transaction set code, GS01 functional group, implementation version)
+TRANSACTION_TYPES = {
+    "270": ("270", "HS", "005010X279A1"),
+    "276": ("276", "HR", "005010X212"),
+    "837P": ("837", "HC", "005010X222A1"),
+    "837I": ("837", "HC", "005010X223A2"),
+    "837D": ("837", "HC", "005010X224A2"),
+}
+
+Segments = List[str]
+
+
+class ControlNumbers:
+    """Thread-safe interchange, group and transaction control number counters.
+
+    Counters start from a time-based value so separate runs do not reuse
+    the same interchange control numbers.
+    """
+
+    def __init__(self, start: Optional[int] = None):
+        if start is None:
+            start = int(time.time()) % 900000000 + 1
+        self._counter = itertools.count(start)
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            return next(self._counter) % 1000000000 or 1
+
+
+control_numbers = ControlNumbers()
+
+
+def segment(*elements: Any) -> str:
+    """Join elements into one segment, dropping trailing empty elements."""
+    values = ["" if element is None else str(element) for element in elements]
+    while values and values[-1] == "":
+        values.pop()
+    return ELEMENT_SEPARATOR.join(values)
+
+
+def composite(*components: Any) -> str:
+    """Join components of a composite element, dropping trailing empty ones."""
+    values = ["" if component is None else str(component) for component in components]
+    while values and values[-1] == "":
+        values.pop()
+    return COMPONENT_SEPARATOR.join(values)
+
+
+def _name_segment(entity_code: str, entity: Dict[str, Any], id_qualifier: str, identifier: Any) -> str:
+    """NM1 for a person (lastName/firstName) or an organization (organizationName)."""
+    if entity.get("organizationName") or entity.get("name"):
+        return segment("NM1", entity_code, "2", entity.get("organizationName") or entity.get("name"), "", "", "", "", id_qualifier, identifier)
+    return segment(
+        "NM1", entity_code, "1", entity.get("lastName"), entity.get("firstName"), entity.get("middleName"),
+        "", "", id_qualifier, identifier,
+    )
+
+
+def _address_segments(address: Optional[Dict[str, Any]]) -> Segments:
+    if not address:
+        return []
+    return [
+        segment("N3", address.get("address1"), address.get("address2")),
+        segment("N4", address.get("city"), address.get("state"), address.get("postalCode")),
+    ]
+
+
+def _bht(purpose: str, transaction_type: str, reference: Any, created: datetime, claim_or_encounter: str = "") -> str:
+    return segment("BHT", purpose, transaction_type, reference, created.strftime("%Y%m%d"), created.strftime("%H%M"), claim_or_encounter)
+
+
+def build_270(
+    payer: Dict[str, Any],
+    provider: Dict[str, Any],
+    subscriber: Dict[str, Any],
+    service_type_codes: Sequence[str] = ("30",),
+    date_of_service: Optional[str] = None,
+    trace_number: Optional[str] = None,
+    trace_originator: Optional[str] = None,
+    reference: Optional[str] = None,
+    created: Optional[datetime] = None,
+) -> Segments:
+    """Build a 270 eligibility inquiry body (BHT through EQ) for one subscriber.
+
+    ``payer`` has name and id, ``provider`` organizationName (or
+    lastName/firstName), npi and an optional idQualifier (default XX).
+    """
+    created = created or datetime.now()
+    trace_number = trace_number or str(control_numbers.next())
+    segments = [
+        _bht("0022", "13", reference or trace_number, created),
+        segment("HL", "1", "", "20", "1"),
+        _name_segment("PR", payer, "PI", payer["id"]),
+        segment("HL", "2", "1", "21", "1"),
+        _name_segment("1P", provider, provider.get("idQualifier", "XX"), provider["npi"]),
+        segment("HL", "3", "2", "22", "0"),
+        segment("TRN", "1", trace_number, trace_originator),
+        _name_segment("IL", subscriber, "MI", subscriber["memberId"]),
+    ]
+    if subscriber.get("dateOfBirth"):
+        segments.append(segment("DMG", "D8", subscriber["dateOfBirth"], subscriber.get("gender")))
+    if date_of_service:
+        segments.append(segment("DTP", "291", "D8", date_of_service))
+    segments.extend(segment("EQ", code) for code in service_type_codes)
+    return segments
+
+
+def build_276(
+    payer: Dict[str, Any],
+    information_receiver: Dict[str, Any],
+    provider: Dict[str, Any],
+    subscriber: Dict[str, Any],
+    trace_number: str,
+    beginning_date_of_service: str,
+    end_date_of_service: Optional[str] = None,
+    reference: Optional[str] = None,
+    created: Optional[datetime] = None,
+) -> Segments:
+    """Build a 276 claim status request body (BHT through DTP) for one claim.
+
+    ``information_receiver`` has organizationName and taxId (ETIN).
+    """
+    created = created or datetime.now()
+    if end_date_of_service and end_date_of_service != beginning_date_of_service:
+        service_dates = segment("DTP", "472", "RD8", f"{beginning_date_of_service}-{end_date_of_service}")
+    else:
+        service_dates = segment("DTP", "472", "D8", beginning_date_of_service)
+    segments = [
+        _bht("0010", "13", reference or trace_number, created),
+        segment("HL", "1", "", "20", "1"),
+        _name_segment("PR", payer, "PI", payer["id"]),
+        segment("HL", "2", "1", "21", "1"),
+        _name_segment("41", information_receiver, "46", information_receiver["taxId"]),
+        segment("HL", "3", "2", "19", "1"),
+        _name_segment("1P", provider, provider.get("idQualifier", "XX"), provider["npi"]),
+        segment("HL", "4", "3", "22", "0"),
+    ]
+    if subscriber.get("dateOfBirth"):
+        segments.append(segment("DMG", "D8", subscriber["dateOfBirth"], subscriber.get("gender")))
+    segments.extend([
+        _name_segment("IL", subscriber, "MI", subscriber["memberId"]),
+        segment("TRN", "1", trace_number),
+        service_dates,
+    ])
+    return segments
+
+
+def _claim_segments(kind: str, claim: Dict[str, Any]) -> Segments:
+    """CLM through the service lines for an 837P, 837I or 837D claim."""
+    frequency = claim.get("claimFrequencyCode", "1")
+    diagnosis_codes = claim.get("diagnosisCodes", [])
+
+    if kind == "837I":
+        segments = [
+            segment(
+                "CLM", claim["patientControlNumber"], claim["claimChargeAmount"], "", "",
+                composite(claim["facilityCode"], "A", frequency), "", "A", "Y", "Y",
+            ),
+        ]
+        if claim.get("statementFromDate"):
+            segments.append(segment("DTP", "434", "RD8", f"{claim['statementFromDate']}-{claim.get('statementToDate', claim['statementFromDate'])}"))
+        if claim.get("admissionTypeCode"):
+            segments.append(segment("CL1", claim["admissionTypeCode"], claim.get("admissionSourceCode"), claim.get("patientStatusCode")))
+        if diagnosis_codes:
+            segments.append(segment("HI", composite("ABK", diagnosis_codes[0]), *(composite("ABF", code) for code in diagnosis_codes[1:])))
+    else:
+        segments = [
+            segment(
+                "CLM", claim["patientControlNumber"], claim["claimChargeAmount"], "", "",
+                composite(claim["placeOfServiceCode"], "B", frequency), "Y", "A", "Y", "Y",
+            ),
+        ]
+        if diagnosis_codes:
+            segments.append(segment("HI", composite("ABK", diagnosis_codes[0]), *(composite("ABF", code) for code in diagnosis_codes[1:])))
+
+    for number, line in enumerate(claim.get("serviceLines", []), start=1):
+        segments.append(segment("LX", number))
+        procedure = composite("AD" if kind == "837D" else "HC", line["procedureCode"], *line.get("modifiers", []))
+        if kind == "837P":
+            pointers = composite(*line.get("diagnosisPointers", ["1"]))
+            segments.append(segment("SV1", procedure, line["chargeAmount"], "UN", line.get("units", "1"), "", "", pointers))
+        elif kind == "837I":
+            segments.append(segment("SV2", line["revenueCode"], procedure, line["chargeAmount"], "UN", line.get("units", "1")))
+        else:
+            segments.append(segment("SV3", procedure, line["chargeAmount"], "", "", "", line.get("units", "1")))
+            if line.get("toothNumber"):
+                segments.append(segment("TOO", "JP", line["toothNumber"]))
+        segments.append(segment("DTP", "472", "D8", line["serviceDate"]))
+    return segments
+
+
+def build_837(
+    kind: str,
+    submitter: Dict[str, Any],
+    receiver: Dict[str, Any],
+    billing: Dict[str, Any],
+    subscriber: Dict[str, Any],
+    payer: Dict[str, Any],
+    claim: Dict[str, Any],
+    reference: Optional[str] = None,
+    created: Optional[datetime] = None,
+) -> Segments:
+    """Build an 837P, 837I or 837D claim body (BHT through the last service line).
+
+    The subscriber is the patient. ``claim`` has patientControlNumber,
+    claimChargeAmount, claimFilingCode, diagnosisCodes and serviceLines,
+    plus placeOfServiceCode (837P/837D) or facilityCode (837I).
+    """
+    if kind not in ("837P", "837I", "837D"):
+        raise ValueError(f"Unknown 837 kind {kind!r}; expected 837P, 837I or 837D")
+    created = created or datetime.now()
+    contact = submitter.get("contactInformation", {})
+    segments = [
+        _bht("0019", "00", reference or claim["patientControlNumber"], created, "CH"),
+        _name_segment("41", submitter, "46", submitter["id"]),
+        segment("PER", "IC", contact.get("name"), "TE", contact.get("phoneNumber")),
+        _name_segment("40", receiver, "46", receiver["id"]),
+        segment("HL", "1", "", "20", "1"),
+    ]
+    if billing.get("taxonomyCode"):
+        segments.append(segment("PRV", "BI", "PXC", billing["taxonomyCode"]))
+    segments.append(_name_segment("85", billing, "XX", billing["npi"]))
+    segments.extend(_address_segments(billing.get("address")))
+    segments.append(segment("REF", "EI", billing["employerId"]))
+    segments.extend([
+        segment("HL", "2", "1", "22", "0"),
+        segment("SBR", "P", "18", subscriber.get("groupNumber"), "", "", "", "", "", claim.get("claimFilingCode", "CI")),
+        _name_segment("IL", subscriber, "MI", subscriber["memberId"]),
+    ])
+    segments.extend(_address_segments(subscriber.get("address")))
+    if subscriber.get("dateOfBirth"):
+        segments.append(segment("DMG", "D8", subscriber["dateOfBirth"], subscriber.get("gender")))
+    segments.append(_name_segment("PR", payer, "PI", payer["id"]))
+    segments.extend(_claim_segments(kind, claim))
+    return segments
+
+
+def _split_segments(body: Union[str, Iterable[str]]) -> Segments:
+    """Accept a body as a list of segments or as X12 text separated by the segment terminator."""
+    if isinstance(body, str):
+        return [part.strip() for part in body.split(SEGMENT_TERMINATOR) if part.strip()]
+    return list(body)
+
+
+def build_interchange(
+    transaction_type: str,
+    bodies: Iterable[Union[str, Iterable[str]]],
+    sender_id: str,
+    receiver_id: str,
+    usage_indicator: str = "T",
+    sender_qualifier: str = "ZZ",
+    receiver_qualifier: str = "ZZ",
+    application_sender_id: Optional[str] = None,
+    application_receiver_id: Optional[str] = None,
+    created: Optional[datetime] = None,
+    numbers: Optional[ControlNumbers] = None,
+    separator: str = "\n",
+) -> str:
+    """Wrap transaction bodies (BHT onwards) in ST/SE, GS/GE and ISA/IEA envelopes.
+
+    All bodies go into one functional group. SE01, GE01 and IEA01 counts
+    and the control numbers are computed. ``separator`` is written after
+    each segment terminator; use "" for compact output.
+    """
+    transaction_set, functional_id, version = TRANSACTION_TYPES[transaction_type]
+    created = created or datetime.now()
+    numbers = numbers or control_numbers
+    interchange_number = numbers.next()
+    group_number = numbers.next()
+
+    segments = [
+        segment(
+            "ISA", "00", " " * 10, "00", " " * 10,
+            sender_qualifier, f"{sender_id:<15.15}", receiver_qualifier, f"{receiver_id:<15.15}",
+            created.strftime("%y%m%d"), created.strftime("%H%M"), REPETITION_SEPARATOR, "00501",
+            f"{interchange_number:09d}", "0", usage_indicator, COMPONENT_SEPARATOR,
+        ),
+        segment(
+            "GS", functional_id, application_sender_id or sender_id, application_receiver_id or receiver_id,
+            created.strftime("%Y%m%d"), created.strftime("%H%M%S"), group_number, "X", version,
+        ),
+    ]
+
+    transaction_count = 0
+    for transaction_count, body in enumerate(bodies, start=1):
+        control_number = f"{transaction_count:04d}"
+        body_segments = _split_segments(body)
+        segments.append(segment("ST", transaction_set, control_number, version))
+        segments.extend(body_segments)
+        # SE01 counts every segment from ST to SE inclusive.
+        segments.append(segment("SE", len(body_segments) + 2, control_number))
+
+    segments.append(segment("GE", transaction_count, group_number))
+    segments.append(segment("IEA", "1", f"{interchange_number:09d}"))
+    return (SEGMENT_TERMINATOR + separator).join(segments) + SEGMENT_TERMINATOR
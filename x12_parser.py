@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Incremental streaming parser for 277 and 835 X12
+
+tokenize() turns an iterable of text or byte chunks (a streamed HTTP
+response, a file read in blocks) into segments one at a time, reading the
+delimiters from the ISA header. The loop walkers on top of it yield one
+record per claim: iter_835_claims() for ERA claim payments (CLP with
+its CAS adjustments and SVC service lines) and iter_277_claims() for claim
+status (TRN with its STC statuses). Only the claim being built is held
+in memory, so multi-megabyte ERAs are processed in constant space.
+"""
+
+import argparse
+import codecs
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+import stedi_client
+import stedi_request
+
+ISA_LENGTH = 106
+CHUNK_SIZE = 64 * 1024
+
+Segment = List[str]
+
+# HL03 hierarchical level codes used by the 276/277 family.
+HL_LEVELS = {
+    "20": "payer",
+    "21": "receiver",
+    "19": "provider",
+    "22": "subscriber",
+    "23": "dependent",
+}
+
+
+def tokenize(chunks: Iterable[Union[str, bytes]]) -> Iterator[Segment]:
+    """Yield each segment as a list of elements, reading ``chunks`` incrementally.
+
+    Segments may be split across chunks, and line breaks after segment
+    terminators are ignored. Composite elements are left as strings; the
+    component separator is ISA16 (``segment[16]`` of the first segment).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    element_separator = segment_terminator = None
+
+    for chunk in chunks:
+        buffer += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        if segment_terminator is None:
+            buffer = buffer.lstrip()
+            if len(buffer) < ISA_LENGTH:
+                continue
+            if not buffer.startswith("ISA"):
+                raise ValueError("X12 data must start with an ISA segment")
+            element_separator = buffer[3]
+            segment_terminator = buffer[ISA_LENGTH - 1]
+
+        *complete, buffer = buffer.split(segment_terminator)
+        for text in complete:
+            text = text.strip()
+            if text:
+                yield text.split(element_separator)
+
+    buffer += decoder.decode(b"", final=True)
+    if segment_terminator is None:
+        if buffer.strip():
+            raise ValueError("X12 data is shorter than an ISA segment")
+        return
+    if buffer.strip():
+        yield buffer.strip().split(element_separator)
+
+
+def _element(segment: Segment, position: int) -> Optional[str]:
+    """Return an element by its X12 position (1-based), or None if absent or empty."""
+    if position < len(segment) and segment[position] != "":
+        return segment[position]
+    return None
+
+
+def _adjustments(segment: Segment) -> List[Dict[str, Any]]:
+    """Expand a CAS segment into one dict per reason/amount/quantity triplet."""
+    group = _element(segment, 1)
+    adjustments = []
+    for position in range(2, len(segment), 3):
+        reason = _element(segment, position)
+        if reason:
+            adjustments.append({
+                "groupCode": group,
+                "reasonCode": reason,
+                "amount": _element(segment, position + 1),
+                "quantity": _element(segment, position + 2),
+            })
+    return adjustments
+
+
+def iter_835_claims(segments: Iterable[Segment]) -> Iterator[Dict[str, Any]]:
+    """Yield one claim payment record per CLP loop of an 835.
+
+    Each record carries the check (BPR/TRN) and payer context, the claim
+    amounts, claim-level CAS adjustments and its SVC service lines with
+    their own adjustments.
+    """
+    component_separator = ">"
+    payment: Dict[str, Any] = {}
+    claim: Optional[Dict[str, Any]] = None
+    service_line: Optional[Dict[str, Any]] = None
+
+    for segment in segments:
+        tag = segment[0]
+        if tag == "ISA":
+            component_separator = _element(segment, 16) or component_separator
+        elif tag in ("CLP", "SE", "PLB", "LX"):
+            if claim is not None:
+                yield claim
+                claim = service_line = None
+            if tag == "CLP":
+                claim = {
+                    **payment,
+                    "patientControlNumber": _element(segment, 1),
+                    "claimStatusCode": _element(segment, 2),
+                    "chargeAmount": _element(segment, 3),
+                    "paymentAmount": _element(segment, 4),
+                    "patientResponsibilityAmount": _element(segment, 5),
+                    "claimFilingIndicatorCode": _element(segment, 6),
+                    "payerClaimControlNumber": _element(segment, 7),
+                    "adjustments": [],
+                    "serviceLines": [],
+                }
+            elif tag == "SE":
+                payment = {}
+        elif tag == "BPR":
+            payment = {
+                "totalPaymentAmount": _element(segment, 2),
+                "paymentMethodCode": _element(segment, 4),
+                "paymentDate": _element(segment, 16),
+            }
+        elif tag == "TRN" and claim is None:
+            payment["checkOrEftTraceNumber"] = _element(segment, 2)
+        elif tag == "N1" and claim is None and _element(segment, 1) in ("PR", "PE"):
+            key = "payerName" if segment[1] == "PR" else "payeeName"
+            payment[key] = _element(segment, 2)
+        elif claim is None:
+            continue
+        elif tag == "NM1" and _element(segment, 1) == "QC":
+            claim["patientLastName"] = _element(segment, 3)
+            claim["patientFirstName"] = _element(segment, 4)
+            claim["patientMemberId"] = _element(segment, 9)
+        elif tag == "SVC":
+            procedure = (_element(segment, 1) or "").split(component_separator)
+            service_line = {
+                "procedureQualifier": procedure[0],
+                "procedureCode": procedure[1] if len(procedure) > 1 else None,
+                "procedureModifiers": procedure[2:],
+                "chargeAmount": _element(segment, 2),
+                "paymentAmount": _element(segment, 3),
+                "units": _element(segment, 5),
+                "adjustments": [],
+            }
+            claim["serviceLines"].append(service_line)
+        elif tag == "CAS":
+            target = service_line if service_line is not None else claim
+            target["adjustments"].extend(_adjustments(segment))
+        elif tag == "DTM" and _element(segment, 1) in ("472", "150") and service_line is not None:
+            service_line["serviceDate"] = _element(segment, 2)
+        elif tag == "DTM" and _element(segment, 1) == "232":
+            claim["claimStatementPeriodStart"] = _element(segment, 2)
+
+    if claim is not None:
+        yield claim
+
+
+def _status(segment: Segment, component_separator: str) -> Dict[str, Any]:
+    codes = (_element(segment, 1) or "").split(component_separator)
+    return {
+        "statusCategoryCode": codes[0] or None,
+        "statusCode": codes[1] if len(codes) > 1 else None,
+        "entityIdentifierCode": codes[2] if len(codes) > 2 else None,
+        "statusEffectiveDate": _element(segment, 2),
+        "totalChargeAmount": _element(segment, 4),
+        "paymentAmount": _element(segment, 5),
+    }
+
+
+def iter_277_claims(segments: Iterable[Segment]) -> Iterator[Dict[str, Any]]:
+    """Yield one status record per TRN loop of a 277 (or 277CA).
+
+    Each record has the hierarchical level it was reported at, the names
+    seen on the way down (payer, provider, patient), the trace number, its
+    STC statuses, claim references and any service lines with their own
+    statuses.
+    """
+    component_separator = ">"
+    names: Dict[str, Optional[str]] = {}
+    level: Optional[str] = None
+    record: Optional[Dict[str, Any]] = None
+    service_line: Optional[Dict[str, Any]] = None
+
+    for segment in segments:
+        tag = segment[0]
+        if tag == "ISA":
+            component_separator = _element(segment, 16) or component_separator
+        elif tag in ("TRN", "HL", "SE"):
+            if record is not None:
+                yield record
+                record = service_line = None
+            if tag == "HL":
+                level = HL_LEVELS.get(_element(segment, 3) or "", _element(segment, 3))
+            elif tag == "TRN":
+                record = {
+                    "level": level,
+                    **names,
+                    "traceNumber": _element(segment, 2),
+                    "statuses": [],
+                    "serviceLines": [],
+                }
+            else:
+                names = {}
+        elif tag == "NM1" and record is None:
+            name = _element(segment, 3)
+            if _element(segment, 4):
+                name = f"{_element(segment, 4)} {name}"
+            names[f"{level}Name"] = name
+            if level in ("subscriber", "dependent"):
+                names["memberId"] = _element(segment, 9)
+        elif record is None:
+            continue
+        elif tag == "STC":
+            target = service_line if service_line is not None else record
+            target["statuses"].append(_status(segment, component_separator))
+        elif tag == "SVC":
+            procedure = (_element(segment, 1) or "").split(component_separator)
+            service_line = {
+                "procedureCode": procedure[1] if len(procedure) > 1 else procedure[0],
+                "chargeAmount": _element(segment, 2),
+                "paymentAmount": _element(segment, 3),
+                "statuses": [],
+            }
+            record["serviceLines"].append(service_line)
+        elif tag == "REF" and service_line is None:
+            key = {"1K": "payerClaimControlNumber", "EJ": "patientControlNumber", "D9": "clearinghouseTraceNumber"}.get(segment[1])
+            if key:
+                record[key] = _element(segment, 2)
+        elif tag == "DTP" and _element(segment, 1) == "472":
+            target = service_line if service_line is not None else record
+            target["serviceDate"] = _element(segment, 3)
+
+    if record is not None:
+        yield record
+
+
+WALKERS = {
+    "835": iter_835_claims,
+    "277": iter_277_claims,
+}
+
+# Transaction set -> the request that fetches its report.
+REPORT_REQUESTS = {
+    "277": 9,
+    "835": 10,
+}
+
+
+def iter_file(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a file in fixed-size chunks."""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_report(request_id: int, transaction_id: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Stream a report (request_9 for 277, request_10 for 835) without buffering the body.
+
+    The parser needs raw X12. Stedi returns these reports as JSON by default,
+    so a body that does not start with an ISA segment raises ValueError
+    before anything is yielded.
+    """
+    call = stedi_request.build_request(request_id, path_params={"transactionId": transaction_id})
+    with stedi_client.send(call["method"], call["url"], stream=True, **call["kwargs"]) as response:
+        response.raise_for_status()
+        chunks = response.iter_content(chunk_size=chunk_size)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head.lstrip()) >= 3:
+                break
+        start = head.lstrip()[:3]
+        if start and start != b"ISA":
+            kind = "JSON" if start[:1] in (b"{", b"[") else "not X12"
+            raise ValueError(
+                f"The report for {transaction_id} is {kind}; x12_parser.py needs raw X12 "
+                "(use era_ingest.py for JSON 835 reports)"
+            )
+        if head:
+            yield head
+        yield from chunks
+
+
+def main():
+    """Print one JSON line per claim from a 277 or 835 X12 file or report."""
+    parser = argparse.ArgumentParser(
+        description="Stream claim-level records out of a raw 277 or 835 X12 file or report as JSON lines.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --type 835 era.x12
+  %(prog)s --type 277 --transaction-id d567c2ae-f073-4725-8b8c-06c473b738a6
+        """
+    )
+    parser.add_argument("path", nargs="?", help="Raw X12 file to parse")
+    parser.add_argument("--type", choices=list(WALKERS), required=True, help="Transaction set to walk")
+    parser.add_argument(
+        "--transaction-id",
+        help="Stream the report for this transaction instead of reading a file (the report must be raw X12, not JSON)"
+    )
+    parser.add_argument(
+        "--api-key",
+        help="Override API key (default: uses STEDI_API_KEY environment variable or st.secrets)"
+    )
+    args = parser.parse_args()
+
+    if bool(args.path) == bool(args.transaction_id):
+        parser.error("give either a file path or --transaction-id")
+    if args.api_key:
+        stedi_request.set_api_key(args.api_key)
+
+    if args.transaction_id:
+        chunks = iter_report(REPORT_REQUESTS[args.type], args.transaction_id)
+    else:
+        chunks = iter_file(args.path)
+    try:
+        for record in WALKERS[args.type](tokenize(chunks)):
+            print(json.dumps(record, separators=(",", ":")))
+    except ValueError as e:
+        parser.exit(1, f"{parser.prog}: error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()